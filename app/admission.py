@@ -0,0 +1,237 @@
+# app/admission.py
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from urllib.parse import parse_qs
+from .metrics import ADMISSION_REJECTED
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Buckets of each limit are spread over this many independently locked shards, chosen by key.
+ADMISSION_BUCKET_SHARDS = int(os.getenv("ADMISSION_BUCKET_SHARDS", 16))
+# Per limit; the least recently used keys are dropped beyond this (they come back with a full bucket).
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", 100000))
+# Use the first X-Forwarded-For address as the client IP; only behind a proxy that sets it.
+ADMISSION_TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+# Bodies larger than this are not parsed for a username (the IP limit still applies).
+ADMISSION_MAX_BODY_BYTES = 64 * 1024
+
+@dataclass(frozen=True)
+class RouteLimits:
+    """
+    Admission limits of one route. `concurrency` caps requests in progress (503 beyond it);
+    `*_rate` is tokens per second and `*_burst` the bucket size per client IP / username
+    (429 when empty). None disables that limit.
+    """
+    concurrency: int | None = None
+    ip_rate: float | None = None
+    ip_burst: float | None = None
+    user_rate: float | None = None
+    user_burst: float | None = None
+    retry_after: float = 1 # Seconds suggested on 503
+
+_CPUS = os.cpu_count() or 1
+# Both routes are bcrypt-bound (see auth.PASSWORD_HASH_*). Logins are also limited per
+# username, against password guessing spread over many addresses.
+DEFAULT_ROUTE_LIMITS = {
+    "POST /token": RouteLimits(concurrency=_CPUS * 4, ip_rate=5, ip_burst=20, user_rate=0.2, user_burst=10),
+    "POST /users/": RouteLimits(concurrency=_CPUS * 2, ip_rate=1, ip_burst=10, user_rate=0.1, user_burst=3),
+    # Cheap, but public and polled per keystroke; bounds account enumeration per address.
+    "GET /users/availability": RouteLimits(ip_rate=10, ip_burst=50),
+}
+
+def load_route_limits() -> dict[str, RouteLimits]:
+    """
+    DEFAULT_ROUTE_LIMITS, updated from ADMISSION_LIMITS: a JSON object of "METHOD /path" to
+    RouteLimits fields, e.g. `{"POST /token": {"concurrency": 8, "ip_rate": 2}}`. Fields not
+    given keep their defaults; `null` as the whole value removes the route's limits.
+    """
+    limits = dict(DEFAULT_ROUTE_LIMITS)
+    overrides = json.loads(os.getenv("ADMISSION_LIMITS") or "{}")
+    known = {field.name for field in fields(RouteLimits)}
+    for route, values in overrides.items():
+        if values is None:
+            limits.pop(route, None)
+            continue
+        unknown = set(values) - known
+        if unknown:
+            raise ValueError(f"ADMISSION_LIMITS['{route}']: unknown fields {sorted(unknown)}")
+        base = limits.get(route, RouteLimits())
+        limits[route] = RouteLimits(**{**{name: getattr(base, name) for name in known}, **values})
+    return limits
+
+class TokenBuckets:
+    """
+    Why this class is necessary:
+    - Rate limits per client IP and per username, in process, without a round trip to a
+      shared store on every request.
+    What it's doing:
+    - One token bucket per key, refilled at `rate` tokens per second up to `burst`; each
+      request takes one token. Buckets are computed lazily from the last update time.
+    - Keys are hashed onto `shards` shards, each with its own lock and LRU-bounded dict, so
+      concurrent requests (event loop and threads) rarely wait on the same lock.
+    """
+
+    def __init__(self, rate: float, burst: float, shards: int = ADMISSION_BUCKET_SHARDS, max_keys: int = ADMISSION_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(max(shards, 1))]
+        self._max_keys_per_shard = max(max_keys // len(self._shards), 1)
+
+    def take(self, key: str) -> float:
+        """Takes a token; returns 0 if admitted, else the seconds until one is available."""
+        lock, buckets = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        now = time.monotonic()
+        with lock:
+            tokens, updated = buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now)
+                buckets.move_to_end(key)
+                while len(buckets) > self._max_keys_per_shard:
+                    buckets.popitem(last=False)
+                return 0.0
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+            return (1 - tokens) / self.rate if self.rate > 0 else math.inf
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for _, buckets in self._shards)
+
+class _RouteAdmission:
+    def __init__(self, route: str, limits: RouteLimits):
+        self.route = route
+        self.limits = limits
+        self.in_flight = 0
+        self.ip_buckets = TokenBuckets(limits.ip_rate, limits.ip_burst or 1) if limits.ip_rate is not None else None
+        self.user_buckets = TokenBuckets(limits.user_rate, limits.user_burst or 1) if limits.user_rate is not None else None
+
+def _build_route_admissions(limits: dict[str, RouteLimits]) -> dict[str, _RouteAdmission]:
+    return {route: _RouteAdmission(route, route_limits) for route, route_limits in limits.items()}
+
+# Shared by the middleware and `admission_stats`, which the metrics endpoint reads.
+route_admissions = _build_route_admissions(load_route_limits())
+
+def admission_stats() -> dict[str, dict]:
+    """Per limited route: requests in progress and the number of tracked IP and username buckets."""
+    return {
+        route: {
+            "in_flight": admission.in_flight,
+            "ip_keys": len(admission.ip_buckets) if admission.ip_buckets else 0,
+            "user_keys": len(admission.user_buckets) if admission.user_buckets else 0,
+        }
+        for route, admission in route_admissions.items()
+    }
+
+def _client_ip(scope) -> str:
+    if ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = dict(scope["headers"]).get(b"x-forwarded-for")
+        if forwarded:
+            return forwarded.split(b",")[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _username_from_body(content_type: bytes, body: bytes) -> str | None:
+    """`username` from a JSON or form body (`POST /users/`, `POST /token`), lower-cased."""
+    try:
+        if content_type.startswith(b"application/json"):
+            value = json.loads(body).get("username")
+        elif content_type.startswith(b"application/x-www-form-urlencoded"):
+            value = parse_qs(body.decode("latin-1")).get("username", [None])[0]
+        else:
+            return None
+    except (ValueError, AttributeError):
+        return None
+    return value.strip().lower() if isinstance(value, str) and value.strip() else None
+
+class AdmissionControlMiddleware:
+    """
+    Why this class is necessary:
+    - `/token` and `POST /users/` spend about 0.25 s of CPU on bcrypt per request, so a single
+      client can keep every worker busy. Excess requests should be refused before they reach
+      the hashing pool, in microseconds, with a hint when to retry.
+    What it's doing:
+    - For routes in `load_route_limits()` (exact "METHOD /path" match), in order:
+      at `concurrency` requests in progress -> 503; client IP bucket empty -> 429; username
+      bucket (from the JSON or form body) empty -> 429. Responses carry `Retry-After`
+      (whole seconds) and a `{"detail": ...}` body like HTTPException's.
+    - Only requests that pass take a concurrency slot; it is released when the response is done.
+    - Rejections are counted in `admission_rejected_total{route,reason}`.
+    - The body is read (at most ADMISSION_MAX_BODY_BYTES) only for routes with a username
+      limit, and replayed to the application.
+    """
+
+    def __init__(self, app, limits: dict[str, RouteLimits] | None = None, enabled: bool = ADMISSION_CONTROL_ENABLED):
+        self.app = app
+        self.enabled = enabled
+        self.routes = route_admissions if limits is None else _build_route_admissions(limits)
+
+    async def __call__(self, scope, receive, send):
+        admission = self.routes.get(f"{scope['method']} {scope['path']}") if scope["type"] == "http" and self.enabled else None
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+        limits = admission.limits
+
+        if limits.concurrency is not None and admission.in_flight >= limits.concurrency:
+            await self._reject(send, admission, "concurrency", 503, limits.retry_after, "Server is busy, please retry shortly.")
+            return
+        if admission.ip_buckets is not None:
+            wait = admission.ip_buckets.take(_client_ip(scope))
+            if wait:
+                await self._reject(send, admission, "client_ip", 429, wait, "Too many requests from this address.")
+                return
+        if admission.user_buckets is not None:
+            headers = dict(scope["headers"])
+            content_length = headers.get(b"content-length", b"")
+            if content_length.isdigit() and int(content_length) <= ADMISSION_MAX_BODY_BYTES:
+                body = await self._read_body(receive)
+                receive = self._replay(body, receive)
+                username = _username_from_body(headers.get(b"content-type", b""), body)
+                if username is not None:
+                    wait = admission.user_buckets.take(username)
+                    if wait:
+                        await self._reject(send, admission, "username", 429, wait, "Too many requests for this username.")
+                        return
+
+        admission.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.in_flight -= 1
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body, more_body = b"", True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        return body
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        sent = False
+
+        async def replay_receive():
+            nonlocal sent
+            if sent: # Body already delivered; later calls wait for the disconnect
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return replay_receive
+
+    @staticmethod
+    async def _reject(send, admission: _RouteAdmission, reason: str, status_code: int, retry_after: float, detail: str) -> None:
+        ADMISSION_REJECTED.inc(admission.route, reason)
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status_code, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(min(retry_after, 24 * 60 * 60)))).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
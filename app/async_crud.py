@@ -0,0 +1,326 @@
+# app/async_crud.py
+# Async variants of the functions in `app/crud.py`, for use with an `AsyncSession`
+# from `database.get_async_db`. Subscription queries eager-load `plan` in the same
+# statement, because the lazy load triggered by response serialization cannot run on an
+# AsyncSession, and writes return populated objects without a refresh SELECT.
+from sqlalchemy import Date, delete, false, func, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import MultipleResultsFound, IntegrityError
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import models, schemas
+from .retry import async_db_retry_decorator, commit_once_async
+from .exceptions import ActiveSubscriptionExistsError, UserAlreadyExistsError, is_active_subscription_conflict
+from . import auth # Module import: auth imports this module while it is still initializing
+from .services.plan_catalog import plan_catalog
+from .services.user_availability import user_availability
+from .subscription_counters import SubscriptionCounterDeltas
+from .subscription_events import SubscriptionEvents
+from datetime import date, datetime, timedelta
+
+async def record_subscription_changes(db: AsyncSession, deltas: SubscriptionCounterDeltas, events: SubscriptionEvents) -> None:
+    """Async counterpart of `crud.record_subscription_changes`."""
+    for statement in deltas.statements(db.bind.dialect):
+        await db.execute(statement)
+    for statement, rows in events.statements():
+        await db.execute(statement, rows)
+
+# --- User CRUD ---
+async def get_user(db: AsyncSession, user_id: int) -> models.User | None:
+    result = await db.execute(select(models.User).where(models.User.id == user_id).limit(1))
+    return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str) -> models.User | None:
+    result = await db.execute(select(models.User).where(models.User.email == email).limit(1))
+    return result.scalars().first()
+
+async def get_user_by_username(db: AsyncSession, username: str) -> models.User | None:
+    result = await db.execute(select(models.User).where(models.User.username == username).limit(1))
+    return result.scalars().first()
+
+async def get_registered_fields(db: AsyncSession, username: str | None, email: str | None) -> tuple[bool, bool]:
+    """
+    Why this function is necessary:
+    - Registration and availability checks need to know which of a username and an email is
+      taken. Comparing the returned rows in Python can disagree with the unique indexes, e.g.
+      under MySQL's case-insensitive collations ("Alice" is taken when "alice" is registered).
+    What it's doing:
+    - One query (at most two rows) in which the database evaluates both comparisons with the
+      columns' collations. Returns (username registered, email registered); None is not checked.
+    """
+    username_match = models.User.username == username if username is not None else false()
+    email_match = models.User.email == email if email is not None else false()
+    result = await db.execute(
+        select(username_match.label("username_match"), email_match.label("email_match"))
+        .where(or_(username_match, email_match)).limit(2)
+    )
+    rows = result.all()
+    return any(row.username_match for row in rows), any(row.email_match for row in rows)
+
+def registered_field(username_registered: bool, email_registered: bool) -> str | None:
+    """Which value of a registration is taken: "email" (checked first), "username" or None."""
+    if email_registered:
+        return "email"
+    return "username" if username_registered else None
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
+    """
+    Why this function is necessary:
+    - Registration used to query for an existing username or email before every INSERT.
+    What it's doing:
+    - Hashes the password once, then inserts the user in a single statement (`_insert_user`,
+      which is what gets retried); the unique indexes on `username` and `email` reject duplicates.
+    - On a violation, rolls back, looks up which value is taken (error path only) and raises
+      `UserAlreadyExistsError`; other integrity errors propagate.
+    - Adds the new account to `user_availability`.
+    """
+    hashed_password = await auth.get_password_hash_async(user.password)
+    db_user = await _insert_user(db, user, hashed_password)
+    auth.invalidate_cached_user(db_user.username) # A recreated username must not resolve to a cached old identity
+    user_availability.add(db_user.username, db_user.email)
+    return db_user
+
+@async_db_retry_decorator
+async def _insert_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str) -> models.User:
+    db_user = models.User(
+        username=user.username,
+        email=user.email,
+        hashed_password=hashed_password
+    )
+    db.add(db_user)
+    try:
+        await commit_once_async(db) # The INSERT fills in `id` (via RETURNING where supported); no refresh needed
+    except IntegrityError:
+        await db.rollback()
+        field = registered_field(*await get_registered_fields(db, username=user.username, email=user.email))
+        if field is None:
+            raise
+        raise UserAlreadyExistsError(field) from None
+    return db_user
+
+# --- Plan CRUD ---
+async def get_plan(db: AsyncSession, plan_id: int) -> models.Plan | None:
+    result = await db.execute(select(models.Plan).where(models.Plan.id == plan_id).limit(1))
+    return result.scalars().first()
+
+async def get_catalog_plan(db: AsyncSession, plan_id: int) -> models.Plan | None:
+    """
+    Why this function is necessary:
+    - Subscription endpoints need a plan per request; the in-memory catalog answers without a query.
+    What it's doing:
+    - Returns the catalog copy of the plan. On a miss it checks the database, since another
+      worker may have created the plan, and adds what it finds to the catalog.
+    """
+    plan = plan_catalog.get(plan_id)
+    if plan is None:
+        db_plan = await get_plan(db, plan_id=plan_id)
+        if db_plan is not None:
+            plan_catalog.add(db_plan)
+            plan = plan_catalog.get(plan_id)
+    return plan
+
+async def get_plans(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[models.Plan]:
+    result = await db.execute(select(models.Plan).offset(skip).limit(limit))
+    return list(result.scalars().all())
+
+# --- Subscription CRUD ---
+async def get_active_subscription_by_user(db: AsyncSession, user_id: int) -> models.Subscription | None:
+    try:
+        result = await db.execute(
+            select(models.Subscription)
+            .options(joinedload(models.Subscription.plan))
+            .where(
+                models.Subscription.user_id == user_id,
+                models.Subscription.status == models.SubscriptionStatusEnum.ACTIVE
+            )
+        )
+        return result.scalars().one_or_none()
+    except MultipleResultsFound:
+        print(f"Error: Multiple active subscriptions found for user_id {user_id}")
+        raise
+
+async def get_subscription_history(db: AsyncSession, user_id: int, before_id: int | None, limit: int) -> list[models.Subscription]:
+    """
+    Why this function is necessary:
+    - Lists all of a user's subscriptions (ACTIVE, CANCELLED, EXPIRED, ...), newest first.
+    What it's doing:
+    - Keyset pagination on `ix_subscriptions_user_id_id`: fetches up to `limit` rows with
+      `id < before_id`, so a deep page costs the same as the first one.
+    """
+    query = select(models.Subscription).options(joinedload(models.Subscription.plan)).where(
+        models.Subscription.user_id == user_id
+    )
+    if before_id is not None:
+        query = query.where(models.Subscription.id < before_id)
+    result = await db.execute(query.order_by(models.Subscription.id.desc()).limit(limit))
+    return list(result.scalars().all())
+
+@async_db_retry_decorator
+async def create_subscription(db: AsyncSession, user_id: int, plan_id: int, plan_details: models.Plan) -> models.Subscription:
+    start_date = date.today()
+    end_date = start_date + timedelta(days=plan_details.duration_days)
+    db_subscription = models.Subscription(
+        user_id=user_id,
+        plan_id=plan_id,
+        start_date=start_date,
+        end_date=end_date,
+        status=models.SubscriptionStatusEnum.ACTIVE
+    )
+    db.add(db_subscription)
+    deltas = SubscriptionCounterDeltas()
+    deltas.created(user_id, plan_id, start_date)
+    try:
+        await db.flush() # Insert first, so a duplicate is rejected before any counter row is locked
+    except IntegrityError as e:
+        await db.rollback()
+        if not is_active_subscription_conflict(e):
+            raise
+        raise ActiveSubscriptionExistsError(user_id) from None
+    events = SubscriptionEvents()
+    events.created(db_subscription.id, user_id, plan_id)
+    await record_subscription_changes(db, deltas, events)
+    await commit_once_async(db)
+    # Attach the already-loaded plan for serialization without cascading it into this session;
+    # `plan_details` may be a catalog copy shared by other requests.
+    set_committed_value(db_subscription, "plan", plan_details)
+    return db_subscription
+
+@async_db_retry_decorator
+async def update_active_subscription_plan(db: AsyncSession, user_id: int, new_plan: models.Plan) -> models.Subscription | None:
+    """
+    Why this function is necessary:
+    - Changing plans used to cost a SELECT of the active subscription plus an UPDATE.
+    What it's doing:
+    - Where the backend supports UPDATE ... RETURNING, moves the user's ACTIVE subscription to
+      `new_plan` in a single statement that also returns the updated row. It is preceded, in
+      the same transaction, by an INSERT ... SELECT recording the old plan and term in
+      `subscription_plan_changes` for billing (see `models.SubscriptionPlanChange`).
+    - Otherwise falls back to loading the active subscription and updating it.
+    - Returns None if the user has no ACTIVE subscription or is already on `new_plan`; the
+      caller looks up which of the two it was only on that error path.
+    """
+    today = date.today()
+    new_end_date = today + timedelta(days=new_plan.duration_days)
+    if db.bind.dialect.update_returning:
+        changing = (
+            models.Subscription.user_id == user_id,
+            models.Subscription.status == models.SubscriptionStatusEnum.ACTIVE,
+            models.Subscription.plan_id != new_plan.id
+        )
+        change = models.SubscriptionPlanChange
+        old_plan_id = (await db.execute(
+            insert(change).from_select(
+                [change.subscription_id, change.old_plan_id, change.new_plan_id, change.old_end_date, change.changed_on],
+                select(
+                    models.Subscription.id,
+                    models.Subscription.plan_id,
+                    literal(new_plan.id),
+                    models.Subscription.end_date,
+                    literal(today, Date)
+                ).where(*changing)
+            ).returning(change.old_plan_id)
+        )).scalar()
+        result = await db.execute(
+            update(models.Subscription)
+            .where(*changing)
+            .values(plan_id=new_plan.id, end_date=new_end_date)
+            .returning(models.Subscription)
+            .execution_options(synchronize_session=False)
+        )
+        subscription = result.scalars().one_or_none()
+        if subscription is not None:
+            deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+            deltas.plan_changed(user_id, old_plan_id, new_plan.id)
+            events.plan_changed(subscription.id, user_id, old_plan_id, new_plan.id)
+            await record_subscription_changes(db, deltas, events)
+        await commit_once_async(db)
+        if subscription is not None:
+            set_committed_value(subscription, "plan", new_plan) # See create_subscription
+        return subscription
+
+    subscription = await get_active_subscription_by_user(db, user_id=user_id)
+    if subscription is None or subscription.plan_id == new_plan.id:
+        return None
+    db.add(models.SubscriptionPlanChange.for_change(subscription, new_plan))
+    deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+    deltas.plan_changed(user_id, subscription.plan_id, new_plan.id)
+    events.plan_changed(subscription.id, user_id, subscription.plan_id, new_plan.id)
+    subscription.plan_id = new_plan.id
+    subscription.end_date = new_end_date
+    await record_subscription_changes(db, deltas, events)
+    await commit_once_async(db)
+    set_committed_value(subscription, "plan", new_plan)
+    return subscription
+
+@async_db_retry_decorator
+async def cancel_active_subscription(db: AsyncSession, user_id: int) -> bool:
+    """
+    Why this function is necessary:
+    - Cancels without first loading the subscription where the backend supports
+      UPDATE ... RETURNING (the returned id and plan feed the counters and the event).
+    What it's doing:
+    - Sets the user's ACTIVE subscription to CANCELLED and records the analytics counters and
+      the outbox event in the same transaction; returns False if there was none.
+    - Without RETURNING, reads the active subscription's plan first (two statements).
+    """
+    active = (
+        models.Subscription.user_id == user_id,
+        models.Subscription.status == models.SubscriptionStatusEnum.ACTIVE
+    )
+    cancel = (
+        update(models.Subscription)
+        .values(status=models.SubscriptionStatusEnum.CANCELLED)
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        row = (await db.execute(cancel.where(*active).returning(models.Subscription.id, models.Subscription.plan_id))).first()
+    else:
+        row = (await db.execute(select(models.Subscription.id, models.Subscription.plan_id).where(*active).with_for_update())).first()
+        if row:
+            await db.execute(cancel.where(models.Subscription.id == row.id))
+    if row is None:
+        await db.rollback()
+        return False
+    deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+    deltas.status_changed(user_id, row.plan_id, models.SubscriptionStatusEnum.ACTIVE, models.SubscriptionStatusEnum.CANCELLED, date.today())
+    events.status_changed(row.id, user_id, row.plan_id, models.SubscriptionStatusEnum.CANCELLED)
+    await record_subscription_changes(db, deltas, events)
+    await commit_once_async(db)
+    return True
+
+# --- Analytics ---
+async def get_subscription_counts(db: AsyncSession) -> dict[tuple[int, models.SubscriptionStatusEnum], int]:
+    """Subscriptions per (plan id, status), summed over the counter shards."""
+    result = await db.execute(
+        select(models.SubscriptionCount.plan_id, models.SubscriptionCount.status, func.sum(models.SubscriptionCount.count))
+        .group_by(models.SubscriptionCount.plan_id, models.SubscriptionCount.status)
+    )
+    return {(plan_id, status): int(count) for plan_id, status, count in result.all()}
+
+async def get_daily_subscription_counts(db: AsyncSession, since: date) -> dict[date, tuple[int, int, int]]:
+    """`(new_subscriptions, cancellations, expirations)` per day from `since` on, over all plans and shards."""
+    daily = models.SubscriptionDailyCount
+    result = await db.execute(
+        select(daily.day, func.sum(daily.new_subscriptions), func.sum(daily.cancellations), func.sum(daily.expirations))
+        .where(daily.day >= since)
+        .group_by(daily.day)
+    )
+    return {day: (int(new), int(cancelled), int(expired)) for day, new, cancelled, expired in result.all()}
+
+# --- Outbox ---
+async def get_latest_subscription_event_id(db: AsyncSession) -> int:
+    return (await db.execute(select(func.max(models.SubscriptionEvent.id)))).scalar() or 0
+
+async def get_subscription_events_after(db: AsyncSession, after_id: int, limit: int, up_to_id: int | None = None) -> list[models.SubscriptionEvent]:
+    """Outbox events with `after_id < id <= up_to_id` in id order, at most `limit`."""
+    query = select(models.SubscriptionEvent).where(models.SubscriptionEvent.id > after_id)
+    if up_to_id is not None:
+        query = query.where(models.SubscriptionEvent.id <= up_to_id)
+    result = await db.execute(query.order_by(models.SubscriptionEvent.id).limit(limit))
+    return list(result.scalars().all())
+
+async def delete_subscription_events_before(db: AsyncSession, cutoff: datetime) -> int:
+    result = await db.execute(delete(models.SubscriptionEvent).where(models.SubscriptionEvent.occurred_at < cutoff))
+    await db.commit()
+    return result.rowcount
@@ -1,30 +1,40 @@
 # app/auth.py
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Callable, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from . import schemas, models, crud # We'll need crud to fetch user for login
-from .database import get_db # To get a DB session in get_current_user
-from sqlalchemy.orm import Session
+from . import schemas, models, async_crud # We'll need crud to fetch user for login
+from .cache import TTLCache
+from .database import AsyncSessionLocal, DATABASE_REPLICA_URLS, get_async_read_db, release_async_connection # To get a DB session in get_current_user
+from .metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_REJECTED
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 load_dotenv()
 
 # Password Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-"""
-Why pwd_context is necessary:
-- Manages password hashing and verification using secure algorithms like bcrypt.
-What it's doing:
-- Configures passlib to use bcrypt for hashing.
-"""
+@cache
+def get_pwd_context():
+    """
+    Why this function is necessary:
+    - Manages password hashing and verification using secure algorithms like bcrypt.
+    What it's doing:
+    - Configures passlib to use bcrypt for hashing. passlib is imported and the context
+      built on first use, which keeps it off the worker's cold-start path.
+    """
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # JWT Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your_fallback_secret_key_please_change_in_env") # Load from .env or use a default
@@ -40,6 +50,114 @@ Why SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES are necessary:
 - ACCESS_TOKEN_EXPIRE_MINUTES: How long a token is valid after being issued.
 """
 
+# Authenticated user cache
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000)) # 0 disables the cache
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS)
+"""
+Why user_cache is necessary:
+- Clients reuse one token for many requests, and each of them used to pay for a JWT
+  signature check plus a `users` query in `get_current_user`.
+What it's doing:
+- Maps a token that has already been verified to a detached snapshot of its user.
+- Entries live for USER_CACHE_TTL_SECONDS at most and never beyond the token's `exp`.
+- `invalidate_cached_user` / `clear_user_cache` must be called when user rows change.
+- Flushed when SECRET_KEY changes, like `token_claims_cache` (see `_flush_if_secret_changed`):
+  a hit skips signature verification, so entries are only valid for the key that verified them.
+"""
+
+def invalidate_cached_user(username: str) -> int:
+    """
+    Why this function is necessary:
+    - Hook for code that changes or removes a user, so stale identities are not served.
+    What it's doing:
+    - Drops every cached token entry that resolves to `username`.
+    """
+    return user_cache.evict_matching(lambda user: user.username == username)
+
+def clear_user_cache() -> None:
+    """
+    Why this function is necessary:
+    - Drops all cached identities, e.g. after a bulk user change or a key rotation.
+    """
+    user_cache.clear()
+
+def _snapshot_user(user: models.User) -> models.User:
+    # A transient copy is never attached to, expired by, or rolled back with any request's session.
+    return models.User(id=user.id, username=user.username, email=user.email, hashed_password=user.hashed_password)
+
+# Verified token claims cache
+TOKEN_CLAIMS_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CLAIMS_CACHE_MAX_ENTRIES", 10000)) # 0 disables the cache
+
+token_claims_cache = TTLCache(maxsize=TOKEN_CLAIMS_CACHE_MAX_ENTRIES, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+_caches_secret = SECRET_KEY # Key that verified the entries of both token caches
+"""
+Why token_claims_cache is necessary:
+- Clients reuse one token for its whole lifetime, and every request used to pay for the
+  HMAC signature check and claim parsing in `jwt.decode`.
+What it's doing:
+- Maps the SHA-256 digest of a verified token (the token itself is not kept) to its claims.
+- Each entry expires at the token's `exp` (and after ACCESS_TOKEN_EXPIRE_MINUTES at most).
+- Flushed when SECRET_KEY changes (see `_flush_if_secret_changed`), so tokens signed with
+  a retired key stop being accepted at once.
+- Independent of `user_cache`: it only replaces signature and claim checks, not the user lookup.
+"""
+
+def _flush_if_secret_changed() -> None:
+    """
+    Why this function is necessary:
+    - SECRET_KEY can change without `rotate_secret_key` (e.g. it is reassigned directly), and a
+      cached token must not outlive the key that verified it.
+    What it's doing:
+    - Clears `token_claims_cache` and `user_cache` when SECRET_KEY differs from the key their
+      entries were verified with; called before every lookup in either cache.
+    """
+    global _caches_secret
+    if _caches_secret != SECRET_KEY:
+        token_claims_cache.clear()
+        clear_user_cache()
+        _caches_secret = SECRET_KEY
+
+def decode_access_token(token: str) -> dict:
+    """
+    Why this function is necessary:
+    - Single place that verifies a token, so repeated verification of the same token is cached.
+    What it's doing:
+    - Returns the cached claims for the token's digest if present; otherwise runs
+      `jwt.decode` (raising `JWTError` for invalid or expired tokens) and caches the claims
+      until `exp`. The returned dict is shared and must not be modified.
+    """
+    _flush_if_secret_changed()
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = token_claims_cache.get(digest)
+    if claims is not None:
+        return claims
+
+    from jose import jwt # Imported on first use: python-jose pulls in `cryptography`, slow to import
+
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    expires_in = claims.get("exp", 0) - datetime.now(timezone.utc).timestamp()
+    if expires_in > 0:
+        token_claims_cache.set(digest, claims, ttl=expires_in)
+    return claims
+
+def rotate_secret_key(new_secret_key: str) -> None:
+    """
+    Why this function is necessary:
+    - Changing the signing key must invalidate everything verified with the old one.
+    What it's doing:
+    - Switches SECRET_KEY (new tokens are signed with it) and flushes the token claims
+      and user caches.
+    """
+    global SECRET_KEY
+    SECRET_KEY = new_secret_key
+    token_claims_cache.clear()
+    clear_user_cache()
+
+# Comma-separated usernames allowed to call admin endpoints (e.g. data exports)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 """
 Why oauth2_scheme is necessary:
@@ -53,18 +171,108 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Why this function is necessary:
     - To securely compare a plain-text password (provided during login) with a stored hashed password.
     What it's doing:
-    - Uses pwd_context to check if the plain password, when hashed, matches the stored hash.
+    - Uses the password context to check if the plain password, when hashed, matches the stored hash.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """
     Why this function is necessary:
     - To securely hash a plain-text password before storing it in the database.
     What it's doing:
-    - Uses pwd_context to generate a bcrypt hash of the password.
+    - Uses the password context to generate a bcrypt hash of the password.
+    """
+    return get_pwd_context().hash(password)
+
+# Password hashing worker pool
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread") # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 4))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", 1))
+"""
+Why the password hashing pool is necessary:
+- bcrypt costs a few hundred milliseconds of CPU per call. Running it inside an `async def`
+  endpoint stalls the event loop, so a login burst blocks every other request.
+What it's doing:
+- Runs `verify_password`/`get_password_hash` on a dedicated pool of PASSWORD_HASH_WORKERS
+  threads (bcrypt releases the GIL) or processes, separate from FastAPI's threadpool.
+- At most PASSWORD_HASH_MAX_PENDING calls may be running or queued; beyond that callers get
+  503 with a Retry-After header instead of waiting in an unbounded queue.
+"""
+
+_password_hash_executor: Optional[Executor] = None
+_password_hash_executor_lock = threading.Lock()
+_password_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+def get_password_hash_executor() -> Executor:
+    """
+    Why this function is necessary:
+    - Creates the hashing pool on first use, so importing this module stays cheap.
+    """
+    global _password_hash_executor
+    with _password_hash_executor_lock:
+        if _password_hash_executor is None:
+            if PASSWORD_HASH_EXECUTOR == "process":
+                _password_hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+            else:
+                _password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        return _password_hash_executor
+
+def shutdown_password_hash_executor() -> None:
+    """
+    Why this function is necessary:
+    - Stops the hashing pool's workers when the application shuts down.
+    """
+    global _password_hash_executor
+    with _password_hash_executor_lock:
+        if _password_hash_executor is not None:
+            _password_hash_executor.shutdown(wait=False, cancel_futures=True)
+            _password_hash_executor = None
+
+async def _run_in_password_hash_pool(func: Callable, *args):
+    """
+    Why this function is necessary:
+    - Common path for the async hashing helpers: applies backpressure and awaits the pool.
+    What it's doing:
+    - Takes a slot without blocking; if none is free, raises 503 with Retry-After.
+    - Submits `func` to the pool and releases the slot when the work itself finishes,
+      even if the awaiting request was cancelled first.
+    - Records the time in `password_hash_duration_seconds` and rejections in
+      `password_hash_rejected_total`.
+    """
+    operation = "verify" if func is verify_password else "hash"
+    if not _password_hash_slots.acquire(blocking=False):
+        PASSWORD_HASH_REJECTED.inc(operation)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry shortly.",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+    try:
+        future = get_password_hash_executor().submit(func, *args)
+    except BaseException:
+        _password_hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_hash_slots.release())
+    started = time.perf_counter()
+    try:
+        return await asyncio.wrap_future(future)
+    finally:
+        PASSWORD_HASH_DURATION.observe(time.perf_counter() - started, operation)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Why this function is necessary:
+    - `verify_password` for `async def` endpoints, without blocking the event loop.
+    """
+    return await _run_in_password_hash_pool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Why this function is necessary:
+    - `get_password_hash` for async code paths, without blocking the event loop.
     """
-    return pwd_context.hash(password)
+    return await _run_in_password_hash_pool(get_password_hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -75,6 +283,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     - Sets an expiration time for the token.
     - Encodes the data and expiration time into a JWT string, signed with SECRET_KEY.
     """
+    from jose import jwt # Imported on first use: python-jose pulls in `cryptography`, slow to import
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
@@ -86,7 +296,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db) # Added db session
+    db: AsyncSession = Depends(get_async_read_db) # Async read session (replica when configured), so the lookup does not block the event loop
 ) -> models.User:
     """
     Why this function is necessary:
@@ -94,20 +304,31 @@ async def get_current_user(
     - It extracts, decodes, and validates the JWT from the request.
     - If valid, it fetches and returns the user associated with the token.
     What it's doing:
-    1. Tries to decode the JWT using SECRET_KEY and ALGORITHM.
+    0. Returns the cached user if this exact token was verified recently with the current
+       SECRET_KEY (see `user_cache`).
+    1. Verifies the JWT with `decode_access_token` (cached per token until `exp`).
     2. Extracts the username from the token's payload.
     3. If decoding fails or username is missing, raises an authentication error.
-    4. Fetches the user from the database based on the username.
+    4. Fetches the user from the database based on the username, then returns the connection
+       to the pool (the endpoint may share the session and checks out again on its first
+       query). With read replicas, a user the replica does not know yet (just registered) is
+       looked up again on the primary.
     5. If user not found, raises an authentication error.
-    6. Returns the User ORM object.
+    6. Caches and returns a snapshot of the User.
     """
+    _flush_if_secret_changed()
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    from jose import JWTError
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub") # "sub" is a standard claim for subject (username)
         if username is None:
             raise credentials_exception
@@ -115,9 +336,16 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = crud.get_user_by_username(db, username=token_data.username) # We need this CRUD function
+    user = await async_crud.get_user_by_username(db, username=token_data.username)
+    await release_async_connection(db) # The endpoint runs next; do not hold this connection through it
+    if user is None and DATABASE_REPLICA_URLS:
+        async with AsyncSessionLocal() as primary_db:
+            user = await async_crud.get_user_by_username(primary_db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    user = _snapshot_user(user)
+    expires_in = payload.get("exp", 0) - datetime.now(timezone.utc).timestamp()
+    user_cache.set(token, user, ttl=expires_in)
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)) -> models.User:
@@ -132,4 +360,15 @@ async def get_current_active_user(current_user: models.User = Depends(get_curren
     # If you add an `is_active` field to your User model, you can check it here:
     # if not current_user.is_active:
     #     raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_admin_user(current_user: models.User = Depends(get_current_active_user)) -> models.User:
+    """
+    Why this function is necessary:
+    - Protects administrative endpoints (such as data exports) that ordinary users must not call.
+    What it's doing:
+    - Allows only users listed in the ADMIN_USERNAMES environment variable; others get 403.
+    """
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
@@ -0,0 +1,211 @@
+# app/bootstrap.py
+import argparse
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from sqlalchemy import inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from . import crud, models, schemas
+from .database import engine, SessionLocal
+from .subscription_counters import check_counter_backend
+
+# What a worker does with the schema on startup:
+# "fingerprint" (default) runs `create_all` only when the stored schema fingerprint differs
+# from the models'; "create" always runs it (the original behaviour); "skip" leaves the
+# schema to `python -m app.bootstrap init-db` or an external migration.
+SCHEMA_STARTUP_MODE = os.getenv("SCHEMA_STARTUP_MODE", "fingerprint")
+SCHEMA_FINGERPRINT_NAME = "app"
+# Indexes the application relies on for correctness, not only for speed: with
+# SCHEMA_STARTUP_MODE=skip a worker refuses to start while any of them is missing.
+REQUIRED_INDEXES = {"subscriptions": ("uq_subscriptions_one_active_per_user",)}
+
+INITIAL_PLANS = [
+    schemas.PlanCreate(name="Free Trial", price=0.00, features="Limited access, 7 days", duration_days=7),
+    schemas.PlanCreate(name="Basic", price=9.99, features="Access to basic features, monthly", duration_days=30),
+    schemas.PlanCreate(name="Premium", price=19.99, features="Access to all features, priority support, monthly", duration_days=30),
+    schemas.PlanCreate(name="Pro Yearly", price=199.99, features="All premium features, yearly discount", duration_days=365),
+]
+
+def schema_fingerprint(bind: Engine = engine) -> str:
+    """
+    Why this function is necessary:
+    - Identifies the schema the models describe, so it can be compared with what was
+      last applied to the database.
+    What it's doing:
+    - Compiles CREATE TABLE / CREATE INDEX for every table with the engine's dialect
+      (no database round trip) and hashes the result.
+    """
+    statements = []
+    for table in models.Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=bind.dialect)).strip())
+        index_statements = []
+        for index in table.indexes:
+            try:
+                index_statements.append(str(CreateIndex(index).compile(dialect=bind.dialect)).strip())
+            except Exception:
+                # Dialect-specific indexes (e.g. the MySQL functional index) may not compile
+                # for other dialects; their name still changes the fingerprint.
+                index_statements.append(f"INDEX {index.name}")
+        # `table.indexes` is a set, so sort for a stable order across processes.
+        statements.extend(sorted(index_statements))
+    return hashlib.sha256("\n".join(statements).encode()).hexdigest()
+
+def get_stored_schema_fingerprint(db: Session) -> str | None:
+    """Fingerprint recorded by the last schema update, or None (also when the table does not exist yet)."""
+    try:
+        return db.scalar(
+            select(models.SchemaFingerprint.fingerprint).where(models.SchemaFingerprint.name == SCHEMA_FINGERPRINT_NAME)
+        )
+    except (OperationalError, ProgrammingError):
+        db.rollback()
+        return None
+
+def store_schema_fingerprint(db: Session, fingerprint: str) -> None:
+    row = db.get(models.SchemaFingerprint, SCHEMA_FINGERPRINT_NAME)
+    applied_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    if row is None:
+        db.add(models.SchemaFingerprint(name=SCHEMA_FINGERPRINT_NAME, fingerprint=fingerprint, applied_at=applied_at))
+    else:
+        row.fingerprint = fingerprint
+        row.applied_at = applied_at
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker stored it at the same time.
+        db.rollback()
+
+def create_missing_indexes(bind: Engine = engine) -> list[str]:
+    """
+    Why this function is necessary:
+    - `create_all` creates missing tables but never adds indexes to an existing one, so a
+      database created by an older version would lack indexes added since, e.g.
+      `uq_subscriptions_one_active_per_user`, which subscription creation depends on.
+    What it's doing:
+    - For every model table that exists, creates each model index (for this dialect) that the
+      table does not have yet; returns the names of the created indexes.
+    - Raises RuntimeError if a unique index cannot be created because existing rows violate
+      it (e.g. duplicate ACTIVE subscriptions); those rows have to be resolved first.
+    """
+    inspector = inspect(bind)
+    created = []
+    for table in models.Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing = sorted((index for index in table.indexes if index.name not in existing), key=lambda index: index.name)
+        for index in missing:
+            try:
+                index.create(bind) # No-op for a variant meant for another dialect (see models.Subscription)
+            except IntegrityError as e:
+                raise RuntimeError(
+                    f"Cannot create unique index {index.name} on {table.name}: existing rows violate it. "
+                    f"Resolve the duplicates and restart. ({e.orig})"
+                ) from e
+        if missing:
+            added = {index["name"] for index in inspect(bind).get_indexes(table.name)} - existing
+            for name in sorted(added):
+                print(f"Bootstrap: Created missing index {name} on {table.name}.")
+            created.extend(sorted(added))
+    return created
+
+def check_required_indexes(bind: Engine = engine) -> None:
+    """Raises RuntimeError if an index in REQUIRED_INDEXES is missing (one reflection query per table)."""
+    inspector = inspect(bind)
+    for table_name, index_names in REQUIRED_INDEXES.items():
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        missing = [name for name in index_names if name not in existing]
+        if missing:
+            raise RuntimeError(
+                f"Table {table_name} is missing required indexes {missing}; "
+                f"run `python -m app.bootstrap init-db` to create them."
+            )
+
+def ensure_schema(mode: str = SCHEMA_STARTUP_MODE, bind: Engine = engine) -> bool:
+    """
+    Why this function is necessary:
+    - `create_all` checks every table (one reflection query each) on every worker boot,
+      which is slow against a remote database.
+    What it's doing:
+    - "skip": only checks REQUIRED_INDEXES. "create": always runs `create_all`.
+    - "fingerprint": reads the stored fingerprint (one SELECT); only when it is missing or
+      different from `schema_fingerprint()` runs `create_all` and stores the new one.
+    - After `create_all`, adds the model indexes that existing tables lack
+      (`create_missing_indexes`); the fingerprint is only stored once that has succeeded.
+    - Returns True when `create_all` ran, so the caller knows the database may be new.
+    - In every mode, first refuses (RuntimeError) a backend the counter upserts do not
+      support (`check_counter_backend`), so the worker fails at startup, not on each write.
+    """
+    check_counter_backend(bind.dialect)
+    if mode == "skip":
+        check_required_indexes(bind)
+        return False
+    fingerprint = schema_fingerprint(bind) if mode == "fingerprint" else None
+    if fingerprint is not None:
+        db = SessionLocal()
+        try:
+            if get_stored_schema_fingerprint(db) == fingerprint:
+                return False
+        finally:
+            db.close()
+
+    models.Base.metadata.create_all(bind=bind)
+    create_missing_indexes(bind)
+    db = SessionLocal()
+    try:
+        store_schema_fingerprint(db, fingerprint or schema_fingerprint(bind))
+    finally:
+        db.close()
+    print(f"Bootstrap: Database schema created/updated ({mode} mode).")
+    return True
+
+def seed_initial_plans():
+    """
+    Why this function is necessary:
+    - A new database needs the default plans before anyone can subscribe.
+    What it's doing:
+    - Creates INITIAL_PLANS if the plans table is empty. Run once per database, through
+      `python -m app.bootstrap seed` / `init-db`, or on the startup that created the schema.
+    """
+    db: Session = SessionLocal()
+    try:
+        if db.query(models.Plan).count() == 0:
+            print("Seeding initial plans...")
+            for plan_data in INITIAL_PLANS:
+                crud.create_plan(db=db, plan=plan_data)
+            print(f"Seeded {len(INITIAL_PLANS)} plans.")
+        else:
+            print("Plans already exist, skipping seeding.")
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Database setup for the subscription service.")
+    parser.add_argument(
+        "command",
+        choices=("init-db", "seed", "fingerprint"),
+        help="init-db: create/update the schema and seed plans; seed: only seed plans; "
+             "fingerprint: print the models' and the stored schema fingerprints",
+    )
+    args = parser.parse_args()
+    started = time.perf_counter()
+    if args.command == "init-db":
+        ensure_schema(mode="create")
+        seed_initial_plans()
+    elif args.command == "seed":
+        seed_initial_plans()
+    else:
+        db = SessionLocal()
+        try:
+            print(f"models: {schema_fingerprint()}")
+            print(f"stored: {get_stored_schema_fingerprint(db)}")
+        finally:
+            db.close()
+    print(f"Bootstrap: {args.command} finished in {time.perf_counter() - started:.3f}s.")
+
+if __name__ == "__main__":
+    main()
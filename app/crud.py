@@ -1,17 +1,21 @@
 # app/crud.py
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import NoResultFound, MultipleResultsFound, SQLAlchemyError
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import NoResultFound, MultipleResultsFound, SQLAlchemyError, IntegrityError
 
 from . import models, schemas
-from .auth import get_password_hash # Import the hashing function
-from datetime import date, timedelta
+from .retry import db_retry_decorator, commit_once
+from .exceptions import ActiveSubscriptionExistsError, is_active_subscription_conflict
+from .auth import get_password_hash, invalidate_cached_user # Import the hashing function
+from .services.plan_catalog import plan_catalog
+from .services.user_availability import user_availability
+from .subscription_counters import SubscriptionCounterDeltas
+from .subscription_events import SubscriptionEvents
+from sqlalchemy import bindparam, case, insert, or_, select, update
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Iterator
+import time
 
-db_retry_decorator = retry(
-    stop=stop_after_attempt(3),
-    wait=wait_fixed(2),
-    retry=retry_if_exception_type(SQLAlchemyError)
-)
 
 # --- User CRUD ---
 def get_user(db: Session, user_id: int) -> models.User | None:
@@ -30,7 +34,6 @@ def get_user_by_username(db: Session, username: str) -> models.User | None:
     """
     return db.query(models.User).filter(models.User.username == username).first()
 
-@db_retry_decorator
 def create_user(db: Session, user: schemas.UserCreate) -> models.User:
     """
     Why this function is necessary:
@@ -38,20 +41,86 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
     What it's doing:
     - Hashes the plain-text password from `user.password` using `get_password_hash`.
     - Creates a new `models.User` instance with the username, email, and the `hashed_password`.
-    - Saves to the database.
+    - Saves to the database (`_insert_user`; only the insert is retried, not the hashing).
     """
     hashed_password = get_password_hash(user.password)
+    db_user = _insert_user(db, user, hashed_password)
+    invalidate_cached_user(db_user.username) # A recreated username must not resolve to a cached old identity
+    user_availability.add(db_user.username, db_user.email)
+    return db_user
+
+@db_retry_decorator
+def _insert_user(db: Session, user: schemas.UserCreate, hashed_password: str) -> models.User:
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password # Store the hashed password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    commit_once(db)
     return db_user
 
-# --- Plan CRUD (no changes here) ---
+def get_registered_positions(db: Session, usernames: list[str], emails: list[str]) -> tuple[set[int], set[int]]:
+    """
+    Why this function is necessary:
+    - Bulk provisioning must check a whole batch for existing accounts without one query per
+      row, and must agree with the unique indexes, e.g. under MySQL's case-insensitive
+      collations ("Bob" is taken when "bob" is registered), like `async_crud.get_registered_fields`.
+    What it's doing:
+    - One query for users matching any of `usernames` or `emails`, in which the database maps
+      each row back to the position of the given value it equals (`CASE column WHEN value`),
+      so the comparison uses the column's collation. Returns the positions (in `usernames` /
+      `emails`, each without exact repeats) that are already registered.
+    - If a row equals several given values (e.g. "Bob" and "bob" in one batch), only the
+      first is reported; inserting the other fails on the unique index instead.
+    """
+    if not usernames and not emails:
+        return set(), set()
+    username_position = case({value: position for position, value in enumerate(usernames)}, value=models.User.username)
+    email_position = case({value: position for position, value in enumerate(emails)}, value=models.User.email)
+    rows = db.execute(
+        select(username_position.label("username_position"), email_position.label("email_position")).where(
+            or_(models.User.username.in_(usernames), models.User.email.in_(emails))
+        )
+    ).all()
+    return (
+        {row.username_position for row in rows if row.username_position is not None},
+        {row.email_position for row in rows if row.email_position is not None},
+    )
+
+@db_retry_decorator
+def bulk_insert_users(db: Session, rows: list[dict]) -> dict[str, int]:
+    """
+    Why this function is necessary:
+    - Inserting thousands of users through the ORM unit of work, one commit each, is slow.
+    What it's doing:
+    - Inserts `rows` (dicts with username, email and hashed_password) with one executemany
+      and one commit; returns {username: id}.
+    - Gets the ids through RETURNING where the backend supports it with executemany,
+      otherwise with one SELECT by username.
+    - Raises IntegrityError (after rolling back) if any row violates a unique constraint.
+    """
+    if not rows:
+        return {}
+    try:
+        if db.bind.dialect.insert_executemany_returning:
+            result = db.execute(insert(models.User).returning(models.User.username, models.User.id), rows)
+            ids = {row.username: row.id for row in result}
+        else:
+            db.execute(insert(models.User), rows)
+            usernames = [row["username"] for row in rows]
+            ids = dict(db.execute(select(models.User.username, models.User.id).where(models.User.username.in_(usernames))).tuples())
+        commit_once(db)
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    for username in ids:
+        invalidate_cached_user(username)
+    for row in rows:
+        user_availability.add(row["username"], row["email"])
+    return ids
+
+# --- Plan CRUD ---
 def get_plan(db: Session, plan_id: int) -> models.Plan | None:
     return db.query(models.Plan).filter(models.Plan.id == plan_id).first()
 
@@ -62,8 +131,8 @@ def get_plans(db: Session, skip: int = 0, limit: int = 100) -> list[models.Plan]
 def create_plan(db: Session, plan: schemas.PlanCreate) -> models.Plan:
     db_plan = models.Plan(**plan.model_dump())
     db.add(db_plan)
-    db.commit()
-    db.refresh(db_plan)
+    commit_once(db)
+    plan_catalog.add(db_plan)
     return db_plan
 
 # --- Subscription CRUD ---
@@ -92,25 +161,81 @@ def create_subscription(db: Session, user_id: int, plan_id: int, plan_details: m
         status=models.SubscriptionStatusEnum.ACTIVE
     )
     db.add(db_subscription)
-    db.commit()
-    db.refresh(db_subscription)
+    deltas = SubscriptionCounterDeltas()
+    deltas.created(user_id, plan_id, start_date)
+    try:
+        db.flush() # Insert first, so a duplicate is rejected before any counter row is locked
+    except IntegrityError as e:
+        db.rollback()
+        if not is_active_subscription_conflict(e):
+            raise
+        raise ActiveSubscriptionExistsError(user_id) from None
+    events = SubscriptionEvents()
+    events.created(db_subscription.id, user_id, plan_id)
+    record_subscription_changes(db, deltas, events)
+    commit_once(db)
+    set_committed_value(db_subscription, "plan", plan_details) # Serializing `plan` needs no lazy load
     return db_subscription
 
 @db_retry_decorator
 def update_subscription_plan(db: Session, current_subscription: models.Subscription, new_plan: models.Plan) -> models.Subscription:
+    db.add(models.SubscriptionPlanChange.for_change(current_subscription, new_plan))
+    deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+    deltas.plan_changed(current_subscription.user_id, current_subscription.plan_id, new_plan.id)
+    events.plan_changed(current_subscription.id, current_subscription.user_id, current_subscription.plan_id, new_plan.id)
     current_subscription.plan_id = new_plan.id
     current_subscription.end_date = date.today() + timedelta(days=new_plan.duration_days)
-    db.commit()
-    db.refresh(current_subscription)
+    record_subscription_changes(db, deltas, events)
+    commit_once(db)
+    set_committed_value(current_subscription, "plan", new_plan)
     return current_subscription
 
 @db_retry_decorator
 def cancel_subscription(db: Session, subscription: models.Subscription) -> models.Subscription:
+    deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+    deltas.status_changed(subscription.user_id, subscription.plan_id, subscription.status, models.SubscriptionStatusEnum.CANCELLED, date.today())
+    events.status_changed(subscription.id, subscription.user_id, subscription.plan_id, models.SubscriptionStatusEnum.CANCELLED)
     subscription.status = models.SubscriptionStatusEnum.CANCELLED
-    db.commit()
-    db.refresh(subscription)
+    record_subscription_changes(db, deltas, events)
+    commit_once(db)
     return subscription
 
+def record_subscription_changes(db: Session, deltas: SubscriptionCounterDeltas, events: SubscriptionEvents) -> None:
+    """
+    Executes the analytics counter upserts and the outbox event INSERT in the session's
+    current transaction; the caller commits.
+    """
+    for statement in deltas.statements(db.bind.dialect):
+        db.execute(statement)
+    for statement, rows in events.statements():
+        db.execute(statement, rows)
+
+def _expire_and_count(db: Session, *criteria) -> int:
+    """
+    Why this function is necessary:
+    - Expirations must update the analytics counters and write outbox events for exactly
+      the rows they expired.
+    What it's doing:
+    - Expires the subscriptions matching `criteria` with UPDATE ... RETURNING where supported;
+      otherwise locks them with SELECT ... FOR UPDATE and updates them by id.
+    - Records the counter deltas and `subscription.expired` events in the same transaction
+      (the caller commits) and returns the number of rows expired.
+    """
+    expire = update(models.Subscription).values(status=models.SubscriptionStatusEnum.EXPIRED).execution_options(synchronize_session=False)
+    expired_columns = (models.Subscription.id, models.Subscription.user_id, models.Subscription.plan_id, models.Subscription.end_date)
+    if db.bind.dialect.update_returning:
+        rows = db.execute(expire.where(*criteria).returning(*expired_columns)).all()
+    else:
+        rows = db.execute(select(*expired_columns).where(*criteria).with_for_update()).all()
+        if rows:
+            db.execute(expire.where(models.Subscription.id.in_([row.id for row in rows])))
+    deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+    for row in sorted(rows, key=lambda row: row.id):
+        deltas.status_changed(row.user_id, row.plan_id, models.SubscriptionStatusEnum.ACTIVE, models.SubscriptionStatusEnum.EXPIRED, row.end_date)
+        events.status_changed(row.id, row.user_id, row.plan_id, models.SubscriptionStatusEnum.EXPIRED)
+    record_subscription_changes(db, deltas, events)
+    return len(rows)
+
 def get_subscriptions_to_expire(db: Session) -> list[models.Subscription]:
     today = date.today()
     return db.query(models.Subscription).filter(
@@ -118,11 +243,327 @@ def get_subscriptions_to_expire(db: Session) -> list[models.Subscription]:
         models.Subscription.end_date <= today
     ).all()
 
+def expire_subscriptions_in_chunks(
+    db: Session,
+    as_of: date | None = None,
+    chunk_size: int = 1000,
+    fence: Callable[[Session], bool] | None = None
+) -> Iterator[tuple[int, float]]:
+    """
+    Why this function is necessary:
+    - `get_subscriptions_to_expire` + `update_subscription_status` costs a SELECT, an UPDATE,
+      a commit and a refresh per row, which does not scale to large same-day cohorts.
+    What it's doing:
+    - Walks due subscriptions in primary-key order (keyset pagination on `id`), fetching at
+      most `chunk_size` ids at a time, so the full result set is never materialized.
+    - Expires each chunk with one set-based UPDATE over the id range (see `_expire_and_count`,
+      which also updates the analytics counters) and commits once per chunk.
+    - Yields `(rows_expired, seconds)` for every chunk so callers can report progress.
+    - `fence`, if given, is called in each chunk's transaction before its UPDATE (e.g.
+      `extend_lease`); when it returns False the chunk is rolled back and the walk stops.
+    """
+    as_of = as_of or date.today()
+    due_filter = (
+        models.Subscription.status == models.SubscriptionStatusEnum.ACTIVE,
+        models.Subscription.end_date <= as_of,
+    )
+    last_id = 0
+    while True:
+        chunk_started = time.perf_counter()
+        chunk_ids = db.query(models.Subscription.id).filter(
+            *due_filter,
+            models.Subscription.id > last_id
+        ).order_by(models.Subscription.id).limit(chunk_size).all()
+        if not chunk_ids:
+            return
+        upper_id = chunk_ids[-1].id
+        try:
+            if fence is not None and not fence(db):
+                db.rollback()
+                return
+            rows_expired = _expire_and_count(
+                db,
+                *due_filter,
+                models.Subscription.id > last_id,
+                models.Subscription.id <= upper_id
+            )
+            db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        last_id = upper_id
+        yield rows_expired, time.perf_counter() - chunk_started
+
 @db_retry_decorator
 def update_subscription_status(db: Session, subscription_id: int, new_status: models.SubscriptionStatusEnum) -> models.Subscription | None:
     db_subscription = db.query(models.Subscription).filter(models.Subscription.id == subscription_id).first()
     if db_subscription:
+        if db_subscription.status != new_status:
+            deltas, events = SubscriptionCounterDeltas(), SubscriptionEvents()
+            day = db_subscription.end_date if new_status == models.SubscriptionStatusEnum.EXPIRED else date.today()
+            deltas.status_changed(db_subscription.user_id, db_subscription.plan_id, db_subscription.status, new_status, day)
+            events.status_changed(db_subscription.id, db_subscription.user_id, db_subscription.plan_id, new_status)
+            record_subscription_changes(db, deltas, events)
         db_subscription.status = new_status
+        commit_once(db)
+    return db_subscription
+
+def iter_subscription_export_rows(
+    db: Session,
+    status: models.SubscriptionStatusEnum | None = None,
+    end_date_from: date | None = None,
+    end_date_to: date | None = None,
+    batch_size: int = 1000
+) -> Iterator:
+    """
+    Why this function is necessary:
+    - Exports must cover every subscription without loading the table into memory.
+    What it's doing:
+    - Selects subscriptions joined with their user and plan as plain rows (no ORM objects),
+      optionally filtered by `status` and an inclusive `end_date` range.
+    - Uses `yield_per`, which streams results with a server-side cursor where the driver
+      supports it, so only `batch_size` rows are held at a time.
+    """
+    query = select(
+        models.Subscription.id,
+        models.Subscription.user_id,
+        models.User.username,
+        models.User.email,
+        models.Subscription.plan_id,
+        models.Plan.name.label("plan_name"),
+        models.Plan.price.label("plan_price"),
+        models.Subscription.start_date,
+        models.Subscription.end_date,
+        models.Subscription.status,
+    ).join(models.User, models.User.id == models.Subscription.user_id).join(
+        models.Plan, models.Plan.id == models.Subscription.plan_id
+    ).order_by(models.Subscription.id)
+    if status is not None:
+        query = query.where(models.Subscription.status == status)
+    if end_date_from is not None:
+        query = query.where(models.Subscription.end_date >= end_date_from)
+    if end_date_to is not None:
+        query = query.where(models.Subscription.end_date <= end_date_to)
+    yield from db.execute(query.execution_options(yield_per=batch_size))
+
+# --- Billing ---
+def iter_billing_renewal_chunks(db: Session, period_start: date, period_end: date, chunk_size: int = 100000) -> Iterator[list]:
+    """
+    Why this function is necessary:
+    - A billing run reads every subscription renewing in the period, which can be millions.
+    What it's doing:
+    - Yields ACTIVE subscriptions with `period_start <= end_date < period_end` as lists of
+      plain `(id, user_id, plan_id, end_date)` rows, at most `chunk_size` per list, walking the
+      table in primary-key order (keyset pagination on `id`).
+    - Executes on the session's connection (Core), skipping the ORM's per-row result processing.
+    """
+    last_id = 0
+    while True:
+        rows = db.connection().execute(
+            select(
+                models.Subscription.id,
+                models.Subscription.user_id,
+                models.Subscription.plan_id,
+                models.Subscription.end_date,
+            ).where(
+                models.Subscription.status == models.SubscriptionStatusEnum.ACTIVE,
+                models.Subscription.end_date >= period_start,
+                models.Subscription.end_date < period_end,
+                models.Subscription.id > last_id
+            ).order_by(models.Subscription.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+def iter_unbilled_plan_change_chunks(db: Session, period_end: date, chunk_size: int = 100000) -> Iterator[list]:
+    """
+    Why this function is necessary:
+    - Plan changes are credited by the first billing run that sees them.
+    What it's doing:
+    - Yields plan changes made before `period_end` and not yet billed, with the subscription's
+      user, as lists of plain `(id, subscription_id, user_id, old_plan_id, new_plan_id,
+      old_end_date, changed_on)` rows, in primary-key order.
+    """
+    change = models.SubscriptionPlanChange
+    last_id = 0
+    while True:
+        rows = db.connection().execute(
+            select(
+                change.id,
+                change.subscription_id,
+                models.Subscription.user_id,
+                change.old_plan_id,
+                change.new_plan_id,
+                change.old_end_date,
+                change.changed_on,
+            ).join(models.Subscription, models.Subscription.id == change.subscription_id).where(
+                change.billing_run_id.is_(None),
+                change.changed_on < period_end,
+                change.id > last_id
+            ).order_by(change.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+@db_retry_decorator
+def create_billing_run(db: Session, period_start: date, period_end: date) -> models.BillingRun:
+    billing_run = models.BillingRun(
+        period_start=period_start,
+        period_end=period_end,
+        started_at=datetime.now(timezone.utc).replace(tzinfo=None),
+        status=models.BillingRunStatusEnum.RUNNING
+    )
+    db.add(billing_run)
+    commit_once(db)
+    return billing_run
+
+def apply_billing_renewals(db: Session, renewals: list[dict], charges: list[dict]) -> list[int]:
+    """
+    Why this function is necessary:
+    - Writes one chunk of a billing run's renewals back in a few statements.
+    What it's doing:
+    - Moves each renewed subscription's `end_date` (`{"b_id", "b_old_end", "b_new_end"}`) with one
+      executemany UPDATE, re-checking status and the old end date, and inserts the matching
+      `charges` with one executemany INSERT, in one transaction.
+    - If some subscription changed since it was read (fewer rows updated than expected), the
+      chunk is rolled back and redone row by row, so only unchanged subscriptions are charged.
+      Drivers without reliable executemany row counts (`supports_sane_multi_rowcount`) skip
+      that check.
+    - Returns the ids of the subscriptions that were not renewed (normally none).
+    """
+    if not renewals:
+        return []
+    subscriptions = models.Subscription.__table__
+    renew = update(subscriptions).where(
+        subscriptions.c.id == bindparam("b_id"),
+        subscriptions.c.status == models.SubscriptionStatusEnum.ACTIVE,
+        subscriptions.c.end_date == bindparam("b_old_end")
+    ).values(end_date=bindparam("b_new_end"))
+    try:
+        connection = db.connection()
+        renewed = connection.execute(renew, renewals).rowcount
+        if renewed == len(renewals) or not connection.dialect.supports_sane_multi_rowcount:
+            connection.execute(insert(models.BillingCharge), charges)
+            db.commit()
+            return []
+        db.rollback()
+        connection = db.connection()
+        not_renewed = []
+        for renewal, charge in zip(renewals, charges):
+            if connection.execute(renew, renewal).rowcount == 1:
+                connection.execute(insert(models.BillingCharge), [charge])
+            else:
+                not_renewed.append(renewal["b_id"])
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    return not_renewed
+
+def apply_billing_plan_changes(db: Session, billing_run_id: int, change_ids: list[int], charges: list[dict]) -> None:
+    """
+    Why this function is necessary:
+    - Writes one chunk of a billing run's proration credits and plan-change charges back.
+    What it's doing:
+    - Marks the changes as billed by `billing_run_id` and inserts their charges in one
+      transaction, so a re-run after a failure neither skips nor double-credits them.
+    """
+    if not change_ids:
+        return
+    try:
+        db.query(models.SubscriptionPlanChange).filter(
+            models.SubscriptionPlanChange.id.in_(change_ids)
+        ).update({models.SubscriptionPlanChange.billing_run_id: billing_run_id}, synchronize_session=False)
+        db.execute(insert(models.BillingCharge), charges)
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+
+@db_retry_decorator
+def finish_billing_run(
+    db: Session,
+    billing_run: models.BillingRun,
+    status: models.BillingRunStatusEnum,
+    renewals: int = 0,
+    plan_changes: int = 0,
+    net_amount: float = 0.0,
+    plan_revenue: list[dict] = ()
+) -> models.BillingRun:
+    """Stores the run's final status, totals and per-plan revenue rows (`models.BillingPlanRevenue` columns)."""
+    billing_run.status = status
+    billing_run.renewals = renewals
+    billing_run.plan_changes = plan_changes
+    billing_run.net_amount = net_amount
+    billing_run.finished_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    if plan_revenue:
+        db.execute(insert(models.BillingPlanRevenue), [{"billing_run_id": billing_run.id, **row} for row in plan_revenue])
+    commit_once(db)
+    return billing_run
+
+# --- Scheduler lease ---
+def try_acquire_lease(db: Session, name: str, holder: str, ttl_seconds: float) -> bool:
+    """
+    Why this function is necessary:
+    - Leader election for background jobs that must run in exactly one worker.
+    What it's doing:
+    - In one UPDATE, takes the lease if `holder` already owns it (renewal) or it has lapsed.
+    - Creates the lease row the first time; a concurrent creator loses on the primary key.
+    - Returns True if `holder` now owns the lease for the next `ttl_seconds`.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    try:
+        acquired = db.query(models.SchedulerLease).filter(
+            models.SchedulerLease.name == name,
+            or_(models.SchedulerLease.holder == holder, models.SchedulerLease.expires_at < now)
+        ).update(
+            {models.SchedulerLease.holder: holder, models.SchedulerLease.expires_at: expires_at},
+            synchronize_session=False
+        )
+        if acquired == 0 and db.query(models.SchedulerLease.name).filter(models.SchedulerLease.name == name).first() is None:
+            db.add(models.SchedulerLease(name=name, holder=holder, expires_at=expires_at))
+            acquired = 1
         db.commit()
-        db.refresh(db_subscription)
-    return db_subscription
\ No newline at end of file
+    except IntegrityError:
+        db.rollback()
+        return False
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    return acquired == 1
+
+def extend_lease(db: Session, name: str, holder: str, ttl_seconds: float) -> bool:
+    """
+    Why this function is necessary:
+    - Fencing for work done under a lease: a holder that stalled past the TTL and lost the
+      lease to another worker must not keep writing.
+    What it's doing:
+    - In the session's current transaction, extends the lease by `ttl_seconds` only if
+      `holder` still owns it, and returns whether it did. The caller commits it together
+      with its own writes, so they only take effect while the lease is held; the row lock
+      also makes a worker trying to take the lease wait for that commit.
+    """
+    expires_at = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=ttl_seconds)
+    extended = db.query(models.SchedulerLease).filter(
+        models.SchedulerLease.name == name,
+        models.SchedulerLease.holder == holder
+    ).update({models.SchedulerLease.expires_at: expires_at}, synchronize_session=False)
+    return extended == 1
+
+def release_lease(db: Session, name: str, holder: str) -> None:
+    """Lets another worker take over immediately instead of waiting for the lease to lapse."""
+    try:
+        db.query(models.SchedulerLease).filter(
+            models.SchedulerLease.name == name,
+            models.SchedulerLease.holder == holder
+        ).update({models.SchedulerLease.expires_at: datetime(1970, 1, 1)}, synchronize_session=False)
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+
@@ -1,9 +1,16 @@
 # app/database.py
+import itertools
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
+from fastapi import Request
+from .metrics import register_pool_metrics, timed_checkout_pool
+from .read_routing import should_read_from_primary
 
 load_dotenv() # Load environment variables from .env file
 
@@ -14,8 +21,10 @@ if not SQLALCHEMY_DATABASE_URL:
 
 # Create a SQLAlchemy engine
 # pool_pre_ping=True: checks connections for liveness before handing them out from the pool.
+# The pool class records checkout waits in `db_pool_checkout_wait_seconds` (see app/metrics.py).
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
+    poolclass=timed_checkout_pool(QueuePool, "sync"),
     pool_pre_ping=True,
     pool_size=10,  # Default is 5
     max_overflow=20 # Default is 10
@@ -24,7 +33,100 @@ engine = create_engine(
 # Each instance of the SessionLocal class will be a database session.
 # autocommit=False: You need to explicitly commit changes.
 # autoflush=False: You need to explicitly flush changes (send them to DB before commit).
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: objects returned by CRUD writes keep their loaded values after
+# commit, so no refresh SELECT is needed to serialize them.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Async drivers used when ASYNC_DATABASE_URL is not given explicitly.
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Why this function is necessary:
+    - The async engine needs an async DBAPI driver, while DATABASE_URL names a sync one.
+    What it's doing:
+    - Swaps the driver part of the URL for the async driver of the same backend
+      (e.g. `mysql+pymysql://...` -> `mysql+aiomysql://...`), keeping credentials and database.
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'. Set ASYNC_DATABASE_URL.")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+SQLALCHEMY_ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(SQLALCHEMY_DATABASE_URL)
+
+# Async engine for request handlers, so DB I/O does not block the event loop.
+# It has its own pool, sized like the sync one.
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL,
+    poolclass=timed_checkout_pool(AsyncAdaptedQueuePool, "async"),
+    pool_pre_ping=True,
+    pool_size=10,
+    max_overflow=20
+)
+
+# expire_on_commit=False: attributes stay loaded after commit, because an implicit
+# reload on attribute access is not possible with an AsyncSession.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# Read replicas: comma-separated sync URLs; each replica's async URL is derived like the primary's.
+# Empty (the default) means every read goes to the primary.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+replica_engines = [
+    create_engine(
+        url,
+        poolclass=timed_checkout_pool(QueuePool, f"replica{i}"),
+        pool_pre_ping=True,
+        pool_size=10,
+        max_overflow=20
+    )
+    for i, url in enumerate(DATABASE_REPLICA_URLS)
+]
+async_replica_engines = [
+    create_async_engine(
+        get_async_database_url(url),
+        poolclass=timed_checkout_pool(AsyncAdaptedQueuePool, f"async_replica{i}"),
+        pool_pre_ping=True,
+        pool_size=10,
+        max_overflow=20
+    )
+    for i, url in enumerate(DATABASE_REPLICA_URLS)
+]
+
+register_pool_metrics({
+    "sync": engine,
+    "async": async_engine,
+    **{f"replica{i}": e for i, e in enumerate(replica_engines)},
+    **{f"async_replica{i}": e for i, e in enumerate(async_replica_engines)},
+})
+
+ReplicaSessionLocals = [
+    sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=e) for e in replica_engines
+] or [SessionLocal]
+AsyncReplicaSessionLocals = [
+    async_sessionmaker(bind=e, autoflush=False, expire_on_commit=False) for e in async_replica_engines
+] or [AsyncSessionLocal]
+_replica_turn = itertools.count()
+
+def read_session_factory():
+    """
+    Why this function is necessary:
+    - Spreads read-only sessions over the replicas.
+    What it's doing:
+    - Returns the next replica sessionmaker in round-robin order, or `SessionLocal` when no
+      replicas are configured. Used directly by jobs that only read (e.g. exports).
+    """
+    return ReplicaSessionLocals[next(_replica_turn) % len(ReplicaSessionLocals)]
+
+def async_read_session_factory():
+    """Async counterpart of `read_session_factory`."""
+    return AsyncReplicaSessionLocals[next(_replica_turn) % len(AsyncReplicaSessionLocals)]
 
 # Base class for SQLAlchemy models to inherit from.
 Base = declarative_base()
@@ -37,16 +139,84 @@ def get_db():
     - Ensures that the database session is always closed after the request is finished,
       even if an error occurs. This prevents resource leaks.
     What it's doing:
-    - Creates a database session (db = SessionLocal()).
+    - Creates a database session (db = SessionLocal()). Creating it is free: the session
+      checks out a pool connection on its first statement, so requests answered from memory
+      or rejected before touching the database never take one.
     - Yields the session to the path operation function.
-    - After the path operation function finishes (or an exception occurs),
-      it closes the session (db.close()).
+    - The connection goes back to the pool when the transaction ends (commit, rollback or
+      `release_connection`), or at the latest when the session is closed here, after the
+      path operation (and response serialization) finishes, before the response is sent.
     How it's used:
     - Injected into path operation functions using FastAPI's dependency injection system:
       `db: Session = Depends(get_db)`
+    - Read paths that keep working after their last query call `release_connection(db)`.
     """
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def release_connection(db: Session) -> None:
+    """
+    Why this function is necessary:
+    - A session that has only read keeps its connection until the end of the request,
+      including any work the handler does after its last query (password hashing,
+      serialization); with many such requests the pool runs dry.
+    What it's doing:
+    - Ends the session's transaction so the connection is returned to the pool now. The
+      session stays usable: its next statement checks out a connection again, and loaded
+      objects keep their values (`expire_on_commit=False`).
+    - It commits, so only call it on sessions without uncommitted writes.
+    """
+    if db.in_transaction():
+        db.commit()
+
+async def release_async_connection(db: AsyncSession) -> None:
+    """Async counterpart of `release_connection`."""
+    if db.in_transaction():
+        await db.commit()
+
+async def get_async_db():
+    """
+    Why this function is necessary:
+    - Async counterpart of `get_db` for `async def` path operations and dependencies.
+    What it's doing:
+    - Opens an `AsyncSession`, yields it, and closes it once the path operation is finished.
+      As with `get_db`, a connection is only checked out by the first statement and is
+      returned when the transaction ends.
+    How it's used:
+    - `db: AsyncSession = Depends(get_async_db)`, together with the functions in `app/async_crud.py`;
+      `release_async_connection(db)` after the last query of a read path.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_read_db(request: Request):
+    """
+    Why this function is necessary:
+    - Read-only endpoints should not compete with writes for the primary.
+    What it's doing:
+    - Like `get_db`, but the session is bound to a replica (round-robin), unless the client
+      wrote recently (read-your-writes, see `app/read_routing.py`) or no replicas are configured.
+    - The session must only be used for reads: writes on a replica would be lost or rejected.
+    How it's used:
+    - `db: Session = Depends(get_read_db)` on routes that never write.
+    """
+    factory = SessionLocal if should_read_from_primary(request) else read_session_factory()
+    db = factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request):
+    """
+    Why this function is necessary:
+    - Async counterpart of `get_read_db`.
+    How it's used:
+    - `db: AsyncSession = Depends(get_async_read_db)` on async routes that never write.
+    """
+    factory = AsyncSessionLocal if should_read_from_primary(request) else async_read_session_factory()
+    async with factory() as db:
+        yield db
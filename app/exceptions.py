@@ -0,0 +1,37 @@
+# app/exceptions.py
+from sqlalchemy.exc import IntegrityError
+
+class ActiveSubscriptionExistsError(Exception):
+    """
+    Why this exception is necessary:
+    - Creating a subscription is a single INSERT guarded by the database's
+      one-ACTIVE-subscription-per-user unique index. The CRUD layer raises this error when
+      that index rejects the row, so endpoints can answer 409 without a prior SELECT.
+    What it carries:
+    - `user_id`: the user who already has an active subscription.
+    """
+    def __init__(self, user_id: int):
+        super().__init__(f"User {user_id} already has an active subscription.")
+        self.user_id = user_id
+
+def is_active_subscription_conflict(error: IntegrityError) -> bool:
+    """
+    True if `error` was raised by `uq_subscriptions_one_active_per_user`, so that other
+    integrity errors (e.g. a foreign key failure) are not reported as a conflict.
+    PostgreSQL and MySQL name the index in the message; SQLite names its column.
+    """
+    message = str(error.orig)
+    return "uq_subscriptions_one_active_per_user" in message or "UNIQUE constraint failed: subscriptions.user_id" in message
+
+class UserAlreadyExistsError(Exception):
+    """
+    Why this exception is necessary:
+    - Registration is a single INSERT guarded by the unique indexes on `users.username` and
+      `users.email`. The CRUD layer raises this error when one of them rejects the row, so
+      endpoints can answer 400 without a SELECT before every INSERT.
+    What it carries:
+    - `field`: "email" or "username", the value that is already registered ("email" when both are).
+    """
+    def __init__(self, field: str):
+        super().__init__(f"A user with this {field} is already registered.")
+        self.field = field
@@ -0,0 +1,197 @@
+# app/idempotency.py
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+from .cache import TTLCache
+from .database import AsyncSessionLocal
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory") # "memory" or "database"
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000))
+# (method, path) pairs that honour the Idempotency-Key header
+IDEMPOTENT_ROUTES = {("POST", "/subscriptions/"), ("POST", "/users/")}
+
+@dataclass(frozen=True)
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+class MemoryIdempotencyStore:
+    """
+    Why this class is necessary:
+    - Default store for replayable responses; fast, but each worker has its own copy.
+    What it's doing:
+    - Keeps up to IDEMPOTENCY_MAX_ENTRIES responses in a TTLCache for IDEMPOTENCY_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL_SECONDS)
+
+    async def get(self, key: str) -> StoredResponse | None:
+        return self._cache.get(key)
+
+    async def put(self, key: str, response: StoredResponse) -> None:
+        self._cache.set(key, response)
+
+class DatabaseIdempotencyStore:
+    """
+    Why this class is necessary:
+    - Shared store, so a retry that reaches a different worker is still replayed.
+    What it's doing:
+    - Keeps responses in the `idempotency_keys` table; expired rows are ignored and purged
+      every 100 writes. The first writer of a key wins.
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self):
+        self._writes = 0
+
+    async def get(self, key: str) -> StoredResponse | None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(models.IdempotencyKey).where(
+                    models.IdempotencyKey.key == key,
+                    models.IdempotencyKey.expires_at > now
+                )
+            )).scalars().first()
+        if row is None:
+            return None
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row.headers)]
+        return StoredResponse(row.request_hash, row.status_code, headers, row.body)
+
+    async def put(self, key: str, response: StoredResponse) -> None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        headers = json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in response.headers])
+        async with AsyncSessionLocal() as db:
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                await db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
+            db.add(models.IdempotencyKey(
+                key=key,
+                request_hash=response.request_hash,
+                status_code=response.status_code,
+                headers=headers,
+                body=response.body,
+                expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+            ))
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback() # Another worker stored this key first
+
+def create_idempotency_store():
+    return DatabaseIdempotencyStore() if IDEMPOTENCY_BACKEND == "database" else MemoryIdempotencyStore()
+
+class IdempotencyMiddleware:
+    """
+    Why this class is necessary:
+    - Mobile clients retry `POST /subscriptions/` and `POST /users/` on timeouts, and each
+      retry used to repeat validation queries, bcrypt hashing and the 400/409 round trip.
+    What it's doing:
+    - For IDEMPOTENT_ROUTES with an `Idempotency-Key` header, the key is scoped to the
+      method, path and Authorization header, so different callers can't see each other's responses.
+    - The first request runs the handler. Its response (status, headers, body) is stored unless
+      it is a 5xx, and later requests with the key get those exact bytes back, with an
+      `Idempotent-Replayed: true` header, without running the handler.
+    - Concurrent duplicates in this process wait for the in-flight request and share its
+      response; if that request fails with a 5xx, the next duplicate runs the handler itself.
+    - Reusing a key with a different request body gets 422.
+    """
+
+    def __init__(self, app, store=None):
+        self.app = app
+        self.store = store or create_idempotency_store()
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        key = hashlib.sha256(b"\n".join([
+            scope["method"].encode(), scope["path"].encode(), headers.get(b"authorization", b""), idempotency_key
+        ])).hexdigest()
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        stored = await self.store.get(key)
+        while stored is None and key in self._in_flight:
+            shared = await asyncio.shield(self._in_flight[key])
+            if shared.status_code < 500:
+                stored = shared
+            # A failed in-flight request is not shared; run the handler again instead.
+        if stored is not None:
+            await self._replay(stored, request_hash, send)
+            return
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = in_flight
+        status_code, response_headers, chunks = 500, [], []
+
+        async def capture(message):
+            nonlocal status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code, response_headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        body_sent = False
+
+        async def replay_body():
+            nonlocal body_sent
+            if body_sent: # Body already delivered; later calls wait for the disconnect
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        try:
+            await self.app(scope, replay_body, capture)
+        finally:
+            response = StoredResponse(request_hash, status_code, response_headers, b"".join(chunks))
+            try:
+                if status_code < 500:
+                    await self.store.put(key, response)
+            except Exception as e:
+                print(f"Idempotency: Could not store response for key: {e}")
+            finally:
+                del self._in_flight[key]
+                in_flight.set_result(response)
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body, more_body = b"", True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        return body
+
+    @staticmethod
+    async def _replay(stored: StoredResponse, request_hash: str, send) -> None:
+        if stored.request_hash != request_hash:
+            body = json.dumps({"detail": "Idempotency-Key was already used with a different request body."}).encode()
+            await send({"type": "http.response.start", "status": 422, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        await send({"type": "http.response.start", "status": stored.status_code,
+                    "headers": stored.headers + [(b"idempotent-replayed", b"true")]})
+        await send({"type": "http.response.body", "body": stored.body})
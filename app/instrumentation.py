@@ -0,0 +1,195 @@
+# app/instrumentation.py
+import os
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from .metrics import (
+    DB_QUERY_DURATION,
+    DB_QUERIES_PER_REQUEST,
+    DB_ROUTE_CHECKOUT_WAIT,
+    DB_ROUTE_CONNECTION_HOLD,
+    DB_TIME_PER_REQUEST,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS_IN_FLIGHT,
+)
+
+# Adds an `X-DB-Statements` header with the request's statement count to every response.
+EXPOSE_DB_STATEMENT_COUNT = os.getenv("EXPOSE_DB_STATEMENT_COUNT", "false").lower() in ("1", "true", "yes")
+
+# Mutable [statement count, seconds in SQL] list, so statements run in worker threads or
+# greenlets (which see a copy of the request's context) still add to the same request's totals.
+_request_statement_count: ContextVar[list | None] = ContextVar("request_statement_count", default=None)
+
+# Route template of the current request (set by MetricsMiddleware), for per-route pool metrics.
+_request_route: ContextVar[str] = ContextVar("request_route", default="background")
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_statement_count.get()
+    if counter is not None:
+        counter[0] += 1
+    context._query_started = time.perf_counter()
+
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    DB_QUERY_DURATION.observe(elapsed)
+    counter = _request_statement_count.get()
+    if counter is not None:
+        counter[1] += elapsed
+
+def install_statement_counter(*engines: Engine) -> None:
+    """
+    Why this function is necessary:
+    - Makes the number of SQL statements each request issues measurable.
+    What it's doing:
+    - Registers `before_cursor_execute`/`after_cursor_execute` listeners on each (sync)
+      engine; pass `async_engine.sync_engine` for the async engine. BEGIN/COMMIT are not counted.
+    - Statement durations feed `db_query_duration_seconds` and the request's SQL time.
+    """
+    for engine in engines:
+        if not event.contains(engine, "before_cursor_execute", _count_statement):
+            event.listen(engine, "before_cursor_execute", _count_statement)
+            event.listen(engine, "after_cursor_execute", _time_statement)
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    info = connection_record.info
+    info["checked_out_at"] = time.perf_counter()
+    info["checked_out_by"] = route = _request_route.get()
+    DB_ROUTE_CHECKOUT_WAIT.observe(info.pop("checkout_wait", 0.0), info.get("pool_name", "unknown"), route)
+
+def _on_checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is not None:
+        DB_ROUTE_CONNECTION_HOLD.observe(
+            time.perf_counter() - checked_out_at,
+            connection_record.info.get("pool_name", "unknown"),
+            connection_record.info.pop("checked_out_by", "background")
+        )
+
+def install_connection_hold_timer(*engines: Engine) -> None:
+    """
+    Why this function is necessary:
+    - Pool exhaustion comes from connections held longer than their statements need; the
+      global pool metrics do not say which endpoint holds them.
+    What it's doing:
+    - Registers pool `checkout`/`checkin` listeners on each (sync) engine that observe, per
+      pool and route template, the wait for a connection (`db_connection_checkout_wait_seconds`)
+      and how long it stayed checked out (`db_connection_hold_seconds`). Work outside a
+      request is labelled "background". Requires the engines' pools to come from
+      `metrics.timed_checkout_pool`, which records the wait.
+    """
+    for engine in engines:
+        if not event.contains(engine, "checkout", _on_checkout):
+            event.listen(engine, "checkout", _on_checkout)
+            event.listen(engine, "checkin", _on_checkin)
+
+def get_request_statement_count() -> int | None:
+    """Statements issued so far by the current request, or None outside a request."""
+    counter = _request_statement_count.get()
+    return counter[0] if counter is not None else None
+
+def begin_request_counter():
+    """
+    Starts the statement counter for a request, or joins the one an outer middleware
+    already started. Returns (counter, token for `end_request_counter`).
+    """
+    counter = _request_statement_count.get()
+    if counter is not None:
+        return counter, None
+    counter = [0, 0.0]
+    return counter, _request_statement_count.set(counter)
+
+def end_request_counter(token) -> None:
+    if token is not None:
+        _request_statement_count.reset(token)
+
+class StatementCountMiddleware:
+    """
+    Why this class is necessary:
+    - Scopes the statement counter to one HTTP request.
+    What it's doing:
+    - Starts a fresh count for every request and, when EXPOSE_DB_STATEMENT_COUNT is set,
+      reports it in the `X-DB-Statements` response header.
+    - Plain ASGI middleware: no extra task or body buffering per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        counter, token = begin_request_counter()
+
+        async def send_with_count(message):
+            if EXPOSE_DB_STATEMENT_COUNT and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-db-statements", str(counter[0]).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            end_request_counter(token)
+
+class MetricsMiddleware:
+    """
+    Why this class is necessary:
+    - Per-route latency and concurrency are the first things to look at when the service slows down.
+    What it's doing:
+    - Resolves the route template (e.g. `/subscriptions/me/`) so label cardinality stays
+      bounded; resolutions of static paths are cached. Unknown paths are labelled "unmatched".
+    - Tracks requests in flight per route and observes the request duration per
+      method/route/status, plus the request's statement count and SQL time.
+    - Makes the route available to the pool listeners of `install_connection_hold_timer`.
+    - Plain ASGI middleware; add it last so it is the outermost one and times everything.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+        self._static_routes: dict[tuple[str, str], str] = {}
+
+    def _route_template(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        template = self._static_routes.get(key)
+        if template is not None:
+            return template
+        template = "unmatched"
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                template = route.path
+                break
+        if template == scope["path"] and len(self._static_routes) < 1000:
+            self._static_routes[key] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = self._route_template(scope)
+        status_code = 500
+        counter, token = begin_request_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        route_token = _request_route.set(route)
+        HTTP_REQUESTS_IN_FLIGHT.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_route.reset(route_token)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method, route, str(status_code))
+            HTTP_REQUESTS_IN_FLIGHT.dec(method, route)
+            DB_QUERIES_PER_REQUEST.observe(counter[0], route)
+            DB_TIME_PER_REQUEST.observe(counter[1], route)
+            end_request_counter(token)
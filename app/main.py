@@ -1,53 +1,114 @@
 # app/main.py
-from fastapi import FastAPI, Depends, HTTPException, status, Path
+import time
+_import_started = time.perf_counter() # Cold-start import time is reported at startup
+
+from fastapi import FastAPI, Depends, HTTPException, status, Path, Query, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm # For login form data
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import MultipleResultsFound
-from typing import List
-from datetime import timedelta
-from fastapi.responses import PlainTextResponse
-
-from . import crud, models, schemas
-from .database import engine, get_db, SessionLocal
-from .services.scheduler import start_background_scheduler
+from typing import Annotated, List, Literal, Optional
+from datetime import date, timedelta
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from . import crud, async_crud, models, schemas
+from .exceptions import ActiveSubscriptionExistsError, UserAlreadyExistsError
+from .pagination import encode_cursor, decode_cursor
+from .serialization import fast_json_response, page_to_dict, plan_to_dict, subscription_to_dict
+from .database import (
+    engine, async_engine, replica_engines, async_replica_engines, DATABASE_REPLICA_URLS,
+    get_db, get_async_db, get_read_db, get_async_read_db, release_connection, release_async_connection, SessionLocal
+)
+from .instrumentation import MetricsMiddleware, StatementCountMiddleware, install_connection_hold_timer, install_statement_counter
+from .metrics import BOOT_SECONDS, CallbackMetric, render_metrics
+from .retry import RequestDeadlineMiddleware, db_retry_metrics
+from .idempotency import IdempotencyMiddleware
+from .read_routing import ReadYourWritesMiddleware
+from .admission import AdmissionControlMiddleware, admission_stats
+from .bootstrap import ensure_schema, seed_initial_plans
+from .services.scheduler import start_background_scheduler, stop_background_scheduler
+from .services.plan_catalog import plan_catalog
+from .services.user_availability import start_user_availability_build, user_availability
+from .services.exports import stream_subscription_export
+from .services.provisioning import UploadStreamingResponse, shutdown_provisioning_executor, stream_provisioning_results
+from .services.analytics import build_subscription_analytics
+from .services.outbox import outbox_stats, start_outbox_relay, stop_outbox_relay, stream_subscription_events
 from .auth import ( # Import auth functions
     create_access_token,
     get_current_active_user,
+    get_current_admin_user,
     ACCESS_TOKEN_EXPIRE_MINUTES,
-    verify_password
+    verify_password_async,
+    shutdown_password_hash_executor,
+    token_claims_cache,
+    user_cache
 )
 
-models.Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="User Subscription Service API",
     description="API for managing user subscriptions and plans, with JWT authentication.",
     version="1.1.0"
 )
 
+install_statement_counter(engine, async_engine.sync_engine, *replica_engines, *(e.sync_engine for e in async_replica_engines))
+install_connection_hold_timer(engine, async_engine.sync_engine, *replica_engines, *(e.sync_engine for e in async_replica_engines))
+app.add_middleware(StatementCountMiddleware)
+app.add_middleware(ReadYourWritesMiddleware, enabled=bool(DATABASE_REPLICA_URLS))
+app.add_middleware(RequestDeadlineMiddleware)
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(AdmissionControlMiddleware) # Sheds excess bcrypt-bound requests before any other work
+app.add_middleware(MetricsMiddleware, router=app.router) # Outermost, so it times every other middleware too
+
+CallbackMetric("db_retries", "Retried and abandoned DB calls per CRUD function.", ("function", "outcome"), lambda: dict(db_retry_metrics), type="counter")
+CallbackMetric("user_cache_events", "Authenticated-user cache lookups and evictions.", ("event",),
+               lambda: {(event,): count for event, count in user_cache.stats().items() if event in ("hits", "misses", "evictions")}, type="counter")
+CallbackMetric("user_cache_entries", "Users currently cached by token.", (), lambda: {(): user_cache.stats()["size"]})
+CallbackMetric("admission_in_flight", "Requests in progress on routes with admission limits.", ("route",),
+               lambda: {(route,): stats["in_flight"] for route, stats in admission_stats().items()})
+CallbackMetric("admission_tracked_keys", "Client IP and username rate-limit buckets held in memory.", ("route", "key"),
+               lambda: {(route, key): stats[f"{key}_keys"] for route, stats in admission_stats().items() for key in ("ip", "user")})
+CallbackMetric("user_availability_checks", "Availability lookups answered by the filter alone, checked in the DB, and filter false positives.", ("result",),
+               lambda: {(result,): count for result, count in user_availability.stats.items()}, type="counter")
+CallbackMetric("outbox_events_relayed", "Subscription events relayed to this worker's SSE broker, and missing ids skipped.", ("outcome",),
+               lambda: {("relayed",): outbox_stats()["relayed"], ("gap_skipped",): outbox_stats()["gaps_skipped"]}, type="counter")
+CallbackMetric("outbox_sse_clients", "Clients connected to the subscription event stream.", (), lambda: {(): outbox_stats()["sse_clients"]})
+CallbackMetric("token_claims_cache_events", "Verified-token claims cache lookups and evictions.", ("event",),
+               lambda: {(event,): count for event, count in token_claims_cache.stats().items() if event in ("hits", "misses", "evictions")}, type="counter")
+
 @app.on_event("startup")
 async def startup_event():
+    """
+    Why this function is necessary:
+    - Prepares the worker before it serves requests, doing as little DB work as possible.
+    What it's doing:
+    - `ensure_schema` skips `create_all` when the stored schema fingerprint matches
+      (SCHEMA_STARTUP_MODE); plans are only seeded when it had to create the schema,
+      otherwise seeding is left to `python -m app.bootstrap seed`.
+    - Reports import and startup time (also exported as `app_boot_seconds`).
+    """
     print("Application startup: Initializing...")
+    started = time.perf_counter()
+    if ensure_schema():
+        seed_initial_plans()
     start_background_scheduler()
-    seed_initial_plans()
-    print("Application startup: Complete.")
-
-def seed_initial_plans():
+    start_outbox_relay()
+    start_user_availability_build()
+    load_plan_catalog()
+    startup_seconds = time.perf_counter() - started
+    BOOT_SECONDS.set("startup", value=startup_seconds)
+    print(f"Application startup: Complete in {startup_seconds:.3f}s (imports took {IMPORT_SECONDS:.3f}s).")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_background_scheduler()
+    await stop_outbox_relay()
+    shutdown_password_hash_executor()
+    shutdown_provisioning_executor()
+
+def load_plan_catalog():
     db: Session = SessionLocal()
     try:
-        if db.query(models.Plan).count() == 0:
-            print("Seeding initial plans...")
-            plans_to_seed = [
-                schemas.PlanCreate(name="Free Trial", price=0.00, features="Limited access, 7 days", duration_days=7),
-                schemas.PlanCreate(name="Basic", price=9.99, features="Access to basic features, monthly", duration_days=30),
-                schemas.PlanCreate(name="Premium", price=19.99, features="Access to all features, priority support, monthly", duration_days=30),
-                schemas.PlanCreate(name="Pro Yearly", price=199.99, features="All premium features, yearly discount", duration_days=365),
-            ]
-            for plan_data in plans_to_seed:
-                crud.create_plan(db=db, plan=plan_data)
-            print(f"Seeded {len(plans_to_seed)} plans.")
-        else:
-            print("Plans already exist, skipping seeding.")
+        plan_catalog.load(db)
     finally:
         db.close()
 
@@ -55,7 +116,7 @@ def seed_initial_plans():
 @app.post("/token", response_model=schemas.Token, tags=["Authentication"])
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Why this endpoint is necessary:
@@ -67,8 +128,9 @@ async def login_for_access_token(
     4. If credentials are valid, creates a new JWT access token.
     5. Returns the token.
     """
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await async_crud.get_user_by_username(db, username=form_data.username)
+    await release_async_connection(db) # Not held during the bcrypt check
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -81,19 +143,58 @@ async def login_for_access_token(
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- User Endpoints ---
+REGISTERED_DETAILS = {"email": "Email already registered", "username": "Username already registered"}
+
 @app.post("/users/", response_model=schemas.User, status_code=status.HTTP_201_CREATED, tags=["Users"])
-def create_new_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_new_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Creates a new user. The password provided will be hashed.
     This endpoint is typically public.
+    A single INSERT: duplicates are rejected by the unique indexes. Only when the availability
+    filter says the username or email is probably taken is it checked first, so that
+    duplicates are refused without spending a bcrypt hash.
+    """
+    if any(user_availability.might_exist(user.username, user.email)):
+        field = async_crud.registered_field(
+            *await async_crud.get_registered_fields(db, username=user.username, email=user.email)
+        )
+        await release_async_connection(db) # Not held while the password is hashed
+        if field is not None:
+            raise HTTPException(status_code=400, detail=REGISTERED_DETAILS[field])
+    try:
+        return await async_crud.create_user(db=db, user=user)
+    except UserAlreadyExistsError as e:
+        raise HTTPException(status_code=400, detail=REGISTERED_DETAILS[e.field])
+
+@app.get("/users/availability", response_model=schemas.UserAvailability, tags=["Users"])
+async def check_user_availability(
+    query: Annotated[schemas.UserAvailabilityQuery, Query()],
+    db: AsyncSession = Depends(get_async_read_db)
+):
     """
-    db_user_by_email = crud.get_user_by_email(db, email=user.email)
-    if db_user_by_email:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    db_user_by_username = crud.get_user_by_username(db, username=user.username)
-    if db_user_by_username:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    Whether a username and/or email can still be registered, for signup forms that check
+    as the user types. Answered from an in-memory Bloom filter over all usernames and
+    emails; only values the filter reports as probably taken are looked up in the database
+    (one query). Accounts created by other workers are picked up within
+    USER_AVAILABILITY_REFRESH_SECONDS. See `app/services/user_availability.py`.
+    """
+    if user_availability.needs_refresh():
+        await db.run_sync(user_availability.refresh)
+    username_probable, email_probable = user_availability.might_exist(query.username, query.email)
+    username_taken = email_taken = False
+    if username_probable or email_probable:
+        username_taken, email_taken = await async_crud.get_registered_fields(
+            db, username=query.username if username_probable else None, email=query.email if email_probable else None
+        ) # Compared by the database, so the answer follows the same collation as the unique indexes
+        await release_async_connection(db)
+    user_availability.record(
+        checked_db=username_probable or email_probable,
+        false_positives=(username_probable and not username_taken) + (email_probable and not email_taken)
+    )
+    return {
+        "username_available": None if query.username is None else not username_taken,
+        "email_available": None if query.email is None else not email_taken,
+    }
 
 @app.get("/users/me/", response_model=schemas.User, tags=["Users"])
 async def read_users_me(current_user: models.User = Depends(get_current_active_user)):
@@ -120,114 +221,271 @@ def create_new_plan(
     existing_plan = db.query(models.Plan).filter(models.Plan.name == plan.name).first()
     if existing_plan:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Plan with name '{plan.name}' already exists.")
-    return crud.create_plan(db=db, plan=plan)
+    db_plan = crud.create_plan(db=db, plan=plan)
+    return fast_json_response(lambda: plan_to_dict(db_plan), status_code=status.HTTP_201_CREATED) or db_plan
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
 
 @app.get("/plans/", response_model=List[schemas.Plan], tags=["Plans"])
-def read_all_available_plans(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_all_available_plans(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_read_db) # Only read when the catalog is empty; served from a replica
+):
     """
     Retrieves all available plans. This endpoint can remain public.
+    Served from the in-memory plan catalog, with an ETag; a matching `If-None-Match`
+    gets 304 Not Modified.
     """
-    plans = crud.get_plans(db, skip=skip, limit=limit)
-    return plans
+    if plan_catalog.is_stale():
+        plan_catalog.load(db)
+        release_connection(db)
+    etag, plans = plan_catalog.get_page(skip=skip, limit=limit)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return fast_json_response(lambda: [plan_to_dict(plan) for plan in plans], headers={"ETag": etag}) or plans
+
+@app.get("/plans/paged/", response_model=schemas.PlanPage, tags=["Plans"])
+def read_plans_page(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Keyset-paginated plan listing, ordered by id. Pass the returned `next_cursor` as
+    `cursor` to fetch the next page; every page costs the same as the first.
+    """
+    if plan_catalog.is_stale():
+        plan_catalog.load(db)
+        release_connection(db)
+    plans = plan_catalog.page_after(decode_cursor(cursor), limit + 1)
+    next_cursor = encode_cursor(plans[limit - 1].id) if len(plans) > limit else None
+    return (
+        fast_json_response(lambda: page_to_dict(plan_to_dict, plans[:limit], next_cursor))
+        or {"items": plans[:limit], "next_cursor": next_cursor}
+    )
 
 # --- Subscription Endpoints ---
 @app.post("/subscriptions/", response_model=schemas.Subscription, status_code=status.HTTP_201_CREATED, tags=["Subscriptions"])
-def create_new_subscription(
+async def create_new_subscription(
     subscription_in: schemas.SubscriptionCreate, # Client now only sends plan_id
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user) # Protected
 ):
     """
     Allows an authenticated user to subscribe to a specific plan.
     The user_id is derived from the authentication token.
     """
-    db_plan = crud.get_plan(db, plan_id=subscription_in.plan_id)
+    db_plan = await async_crud.get_catalog_plan(db, plan_id=subscription_in.plan_id)
     if not db_plan:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Plan with ID {subscription_in.plan_id} not found.")
 
     # user_id comes from current_user (the authenticated user)
     user_id_from_token = current_user.id
-    active_subscription = crud.get_active_subscription_by_user(db, user_id=user_id_from_token)
-    if active_subscription:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"User {current_user.username} already has an active subscription (ID: {active_subscription.id})."
-        )
     try:
-        # Pass user_id from token and plan_id from request
-        new_subscription = crud.create_subscription(
+        # A single INSERT; the database's one-active-subscription-per-user index rejects duplicates.
+        new_subscription = await async_crud.create_subscription(
             db=db,
             user_id=user_id_from_token,
             plan_id=subscription_in.plan_id,
             plan_details=db_plan
         )
-        return new_subscription
-    except MultipleResultsFound:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Data integrity issue: Multiple active subscriptions found unexpectedly.")
-
+        return fast_json_response(lambda: subscription_to_dict(new_subscription), status_code=status.HTTP_201_CREATED) or new_subscription
+    except ActiveSubscriptionExistsError:
+        # Only the conflict path pays for looking up the existing subscription.
+        active_subscription = await async_crud.get_active_subscription_by_user(db, user_id=user_id_from_token)
+        existing_id = active_subscription.id if active_subscription else "unknown"
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"User {current_user.username} already has an active subscription (ID: {existing_id})."
+        )
 
 @app.get("/subscriptions/me/", response_model=schemas.Subscription, tags=["Subscriptions"])
-def retrieve_my_subscription(
-    db: Session = Depends(get_db),
+async def retrieve_my_subscription(
+    db: AsyncSession = Depends(get_async_read_db), # Replica, or the primary right after this user's own write
     current_user: models.User = Depends(get_current_active_user) # Protected
 ):
     """
     Retrieves the active subscription for the currently authenticated user.
     """
     try:
-        active_subscription = crud.get_active_subscription_by_user(db, user_id=current_user.id)
+        active_subscription = await async_crud.get_active_subscription_by_user(db, user_id=current_user.id)
     except MultipleResultsFound:
         print(f"CRITICAL: Multiple active subscriptions found for user_id {current_user.id} during GET request.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Multiple active subscriptions found for user. Please contact support.")
+    await release_async_connection(db) # Released before serialization
 
     if not active_subscription:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No active subscription found for user {current_user.username}.")
-    return active_subscription
+    return fast_json_response(lambda: subscription_to_dict(active_subscription)) or active_subscription
+
+
+@app.get("/subscriptions/me/history/", response_model=schemas.SubscriptionPage, tags=["Subscriptions"])
+async def list_my_subscription_history(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(get_current_active_user) # Protected
+):
+    """
+    Lists all subscriptions of the authenticated user (including cancelled and expired
+    ones), newest first. Pass the returned `next_cursor` as `cursor` for the next page.
+    """
+    subscriptions = await async_crud.get_subscription_history(
+        db, user_id=current_user.id, before_id=decode_cursor(cursor), limit=limit + 1
+    )
+    await release_async_connection(db) # Released before serialization
+    next_cursor = encode_cursor(subscriptions[limit - 1].id) if len(subscriptions) > limit else None
+    return (
+        fast_json_response(lambda: page_to_dict(subscription_to_dict, subscriptions[:limit], next_cursor))
+        or {"items": subscriptions[:limit], "next_cursor": next_cursor}
+    )
 
 
 @app.put("/subscriptions/me/", response_model=schemas.Subscription, tags=["Subscriptions"])
-def update_my_subscription(
+async def update_my_subscription(
     update_data: schemas.SubscriptionUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user) # Protected
 ):
     """
     Allows an authenticated user to update their active subscription plan.
+    The plan comes from the in-memory catalog and the change is a single UPDATE ... RETURNING
+    where supported; the active subscription is only read on error paths.
     """
-    active_subscription = crud.get_active_subscription_by_user(db, user_id=current_user.id)
+    new_plan = await async_crud.get_catalog_plan(db, plan_id=update_data.new_plan_id)
+    updated_subscription = None
+    if new_plan:
+        updated_subscription = await async_crud.update_active_subscription_plan(db, user_id=current_user.id, new_plan=new_plan)
+    if updated_subscription:
+        return fast_json_response(lambda: subscription_to_dict(updated_subscription)) or updated_subscription
+
+    active_subscription = await async_crud.get_active_subscription_by_user(db, user_id=current_user.id)
     if not active_subscription:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No active subscription found for user {current_user.username} to update.")
-
-    new_plan = crud.get_plan(db, plan_id=update_data.new_plan_id)
     if not new_plan:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"New plan with ID {update_data.new_plan_id} not found.")
-
-    if active_subscription.plan_id == new_plan.id:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User is already subscribed to this plan.")
-
-    updated_subscription = crud.update_subscription_plan(db, current_subscription=active_subscription, new_plan=new_plan)
-    return updated_subscription
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User is already subscribed to this plan.")
 
 
 @app.delete("/subscriptions/me/", status_code=status.HTTP_204_NO_CONTENT, tags=["Subscriptions"])
-def cancel_my_subscription(
-    db: Session = Depends(get_db),
+async def cancel_my_subscription(
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user) # Protected
 ):
     """
     Allows an authenticated user to cancel their active subscription.
+    Only ACTIVE subscriptions are cancelled, in a single UPDATE.
     """
-    active_subscription = crud.get_active_subscription_by_user(db, user_id=current_user.id)
-    if not active_subscription:
+    if not await async_crud.cancel_active_subscription(db, user_id=current_user.id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No active subscription found for user {current_user.username} to cancel.")
+    return None
 
-    if active_subscription.status == models.SubscriptionStatusEnum.CANCELLED:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Subscription is already cancelled.")
 
-    crud.cancel_subscription(db, subscription=active_subscription)
-    return None
+@app.get("/subscriptions/events", tags=["Subscriptions"])
+async def subscription_events(
+    request: Request,
+    after: Optional[int] = Query(None, ge=0, description="Offset (event id) to resume after; defaults to the Last-Event-ID header, else only new events"),
+    current_user: models.User = Depends(get_current_admin_user) # Admin only: carries every user's changes
+):
+    """
+    Server-sent events for subscription lifecycle changes (`subscription.created`,
+    `subscription.plan_changed`, `subscription.cancelled`, `subscription.expired`), so
+    downstream services can subscribe instead of polling. Every event is written to the
+    `subscription_events` outbox in the same transaction as the change; the SSE `id` is the
+    resumable offset. See `app/services/outbox.py`.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if after is None and last_event_id:
+        if not last_event_id.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Last-Event-ID must be an event id.")
+        after = int(last_event_id)
+    return StreamingResponse(
+        stream_subscription_events(request, after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
+# --- Admin Endpoints ---
+@app.get("/admin/exports/subscriptions", tags=["Admin"])
+async def export_subscriptions(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    status_filter: Optional[models.SubscriptionStatusEnum] = Query(None, alias="status"),
+    end_date_from: Optional[date] = None,
+    end_date_to: Optional[date] = None,
+    current_user: models.User = Depends(get_current_admin_user) # Admin only
+):
+    """
+    Streams all subscriptions joined with their plan and user as NDJSON or CSV.
+    Optional `status` and inclusive `end_date_from`/`end_date_to` filters keep incremental
+    pulls cheap. Rows are read with a server-side cursor, so memory use does not grow with
+    the number of rows.
+    """
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_subscription_export(export_format, status_filter, end_date_from, end_date_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="subscriptions.{export_format}"'}
+    )
+
+
+@app.post("/admin/users/bulk", tags=["Admin"])
+async def bulk_provision_users(
+    request: Request,
+    current_user: models.User = Depends(get_current_admin_user) # Admin only
+):
+    """
+    Creates many users from an NDJSON body, one `{"username", "email", "password"}` object
+    per line (or `hashed_password` with an existing bcrypt hash instead of `password`).
+    Streams back one NDJSON result per input line, batch by batch: `status` is "created"
+    (with the new `id`) or "error" (with `detail`). Rows are checked for existing accounts
+    in one query per batch, passwords are hashed on a process pool and the new users are
+    inserted with one executemany per batch. The body is read batch by batch, never whole.
+    See `app/services/provisioning.py`.
+    """
+    return UploadStreamingResponse(stream_provisioning_results(request.stream()), media_type="application/x-ndjson")
+
+@app.get("/admin/analytics/subscriptions", response_model=schemas.SubscriptionAnalytics, tags=["Admin"])
+async def subscription_analytics(
+    days: int = Query(30, ge=1, le=366),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(get_current_admin_user) # Admin only
+):
+    """
+    Subscriptions per plan and status, MRR, and daily new subscriptions and churn for the
+    last `days` days (today included). Served from counters kept up to date by every
+    subscription write, so the cost does not grow with the subscriptions table: two small
+    GROUP BY queries. See `app/services/analytics.py`.
+    """
+    today = date.today()
+    since = today - timedelta(days=days - 1)
+    counts = await async_crud.get_subscription_counts(db)
+    daily = await async_crud.get_daily_subscription_counts(db, since=since)
+    await release_async_connection(db)
+    if plan_catalog.is_stale():
+        await db.run_sync(plan_catalog.load)
+    plans = {plan.id: plan for plan in plan_catalog.all()}
+    return build_subscription_analytics(counts, daily, plans, since=since, until=today)
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """
+    Why this endpoint is necessary:
+    - Lets Prometheus (or any compatible scraper) collect the service's latency, DB pool,
+      query, bcrypt and scheduler metrics.
+    What it's doing:
+    - Renders every metric from `app/metrics.py` in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/", response_class=PlainTextResponse, include_in_schema=False)
 async def root():
     message = """
@@ -254,4 +512,7 @@ Available main functionalities:
 
 Happy testing!
     """
-    return PlainTextResponse(content=message)
\ No newline at end of file
+    return PlainTextResponse(content=message)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+BOOT_SECONDS.set("import", value=IMPORT_SECONDS)
@@ -0,0 +1,214 @@
+# app/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable
+
+"""
+Why this module is necessary:
+- Behind a load balancer the only signals were `print()` lines. This module keeps
+  in-process counters, gauges and histograms and renders them in the Prometheus text
+  exposition format for `GET /metrics`.
+What it's doing:
+- Each metric keeps one value (or one bucket array) per label combination behind its own
+  lock, so recording costs a dict lookup, a bisect and a few additions.
+- Values that already live elsewhere (pool sizes, retry counts, cache stats) are read by
+  `CallbackMetric`s only when `/metrics` is scraped.
+"""
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow bcrypt/DB calls.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SCHEDULER_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+_registry: list = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _family(self) -> str:
+        """The name on the HELP and TYPE lines; in format 0.0.4 a counter's is its `_total` sample name."""
+        return f"{self.name}_total" if self.type == "counter" else self.name
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self._family()} {self.documentation}", f"# TYPE {self._family()} {self.type}"]
+
+class Counter(_Metric):
+    """Monotonic count per label combination. Rendered with the `_total` suffix."""
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self._family()}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+class Gauge(_Metric):
+    """Value that goes up and down per label combination (e.g. requests in flight)."""
+    type = "gauge"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram per label combination, with `_sum` and `_count`."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # One slot per bucket plus +Inf, then the running sum.
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        lines = self._header()
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class CallbackMetric(_Metric):
+    """
+    Why this class is necessary:
+    - Exports values kept by other components without touching their hot paths.
+    What it's doing:
+    - Calls `collect()` at scrape time; it returns {label values tuple: value}.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, collect: Callable[[], dict], type: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        try:
+            items = self.collect().items()
+        except Exception as e:
+            print(f"Metrics: Error collecting {self.name}: {e}")
+            items = []
+        return self._header() + [f"{self._family()}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in items]
+
+def render_metrics() -> str:
+    """Renders every registered metric in the Prometheus text format (version 0.0.4)."""
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# HTTP
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.", ("method", "route"))
+HTTP_REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time to handle a request, until the response has been sent.", ("method", "route", "status"))
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQL statements issued per request.", ("route",), buckets=QUERY_COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram("db_query_seconds_per_request", "Time spent executing SQL statements per request.", ("route",))
+
+# Database
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "Execution time of a single SQL statement.")
+DB_POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time waiting for a connection from the pool.", ("pool",))
+DB_ROUTE_CHECKOUT_WAIT = Histogram("db_connection_checkout_wait_seconds", "Time waiting for a pooled connection, per checkout, by route.", ("pool", "route"))
+DB_ROUTE_CONNECTION_HOLD = Histogram("db_connection_hold_seconds", "Time from checkout to checkin of a pooled connection, by route.", ("pool", "route"))
+
+# Password hashing and scheduler
+PASSWORD_HASH_DURATION = Histogram("password_hash_duration_seconds", "bcrypt time per call, including time queued for the hashing pool.", ("operation",))
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected", "Hashing calls rejected with 503 because the pool was full.", ("operation",))
+ADMISSION_REJECTED = Counter("admission_rejected", "Requests shed by admission control, by reason (concurrency, client_ip, username).", ("route", "reason"))
+SCHEDULER_JOB_DURATION = Histogram("scheduler_job_duration_seconds", "Duration of scheduler expiration runs.", ("job",), buckets=SCHEDULER_BUCKETS)
+SCHEDULER_SUBSCRIPTIONS_EXPIRED = Counter("scheduler_subscriptions_expired", "Subscriptions expired by the scheduler.", ("job",))
+
+# Startup
+BOOT_SECONDS = Gauge("app_boot_seconds", "Time this worker spent importing the app and running startup.", ("phase",))
+
+def timed_checkout_pool(pool_class: type, pool_name: str) -> type:
+    """
+    Why this function is necessary:
+    - SQLAlchemy has no event before a pool checkout, so the wait for a free connection
+      cannot be measured with listeners alone.
+    What it's doing:
+    - Returns a subclass of `pool_class` whose `_do_get` (the blocking checkout) records its
+      duration in `db_pool_checkout_wait_seconds{pool=pool_name}`. Pass it as `poolclass`
+      to `create_engine`; `engine.dispose()` recreates the pool with the same class.
+    - The wait and pool name are also left in the connection record's `info` for the
+      per-route checkout listeners (see `instrumentation.install_connection_hold_timer`).
+    """
+    def _do_get(self):
+        started = time.perf_counter()
+        record = None
+        try:
+            record = super(timed_pool, self)._do_get()
+            return record
+        finally:
+            waited = time.perf_counter() - started
+            DB_POOL_CHECKOUT_WAIT.observe(waited, pool_name)
+            if record is not None:
+                record.info["checkout_wait"] = waited
+                record.info["pool_name"] = pool_name
+
+    timed_pool = type(f"Timed{pool_class.__name__}", (pool_class,), {"_do_get": _do_get})
+    return timed_pool
+
+def register_pool_metrics(engines: dict) -> None:
+    """
+    Why this function is necessary:
+    - Exposes pool size, checked-out connections and overflow for each engine.
+    What it's doing:
+    - Registers scrape-time gauges reading `engine.pool` (QueuePool API) for {pool name: engine}.
+    """
+    def collector(method: str) -> Callable[[], dict]:
+        return lambda: {(name,): getattr(engine.pool, method)() for name, engine in engines.items()}
+
+    CallbackMetric("db_pool_size", "Configured pool size.", ("pool",), collector("size"))
+    CallbackMetric("db_pool_checked_out", "Connections currently checked out.", ("pool",), collector("checkedout"))
+    CallbackMetric("db_pool_checked_in", "Idle connections in the pool.", ("pool",), collector("checkedin"))
+    CallbackMetric("db_pool_overflow", "Connections beyond pool_size (negative while the pool is not full).", ("pool",), collector("overflow"))
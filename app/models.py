@@ -1,7 +1,8 @@
 
 # app/models.py
 import enum
-from sqlalchemy import Column, Integer, String, Float, Text, Date, ForeignKey, Enum as SQLAlchemyEnum
+from datetime import date
+from sqlalchemy import Column, Integer, String, Float, Text, Date, DateTime, LargeBinary, ForeignKey, Index, text, Enum as SQLAlchemyEnum
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -32,10 +33,227 @@ class Plan(Base):
 class Subscription(Base):
     __tablename__ = "subscriptions"
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False) # Indexed by ix_subscriptions_user_id_status
     plan_id = Column(Integer, ForeignKey("plans.id"), nullable=False, index=True)
     start_date = Column(Date, nullable=False)
     end_date = Column(Date, nullable=False)
     status = Column(SQLAlchemyEnum(SubscriptionStatusEnum), nullable=False, default=SubscriptionStatusEnum.ACTIVE)
     user = relationship("User", back_populates="subscriptions")
-    plan = relationship("Plan", back_populates="subscriptions")
\ No newline at end of file
+    plan = relationship("Plan", back_populates="subscriptions")
+
+    __table_args__ = (
+        # Serves the per-user lookups, e.g. the active subscription of a user.
+        Index("ix_subscriptions_user_id_status", "user_id", "status"),
+        # Keyset pagination of a user's subscription history.
+        Index("ix_subscriptions_user_id_id", "user_id", "id"),
+        # At most one ACTIVE subscription per user, enforced by the database:
+        # a partial unique index where the backend supports one...
+        Index(
+            "uq_subscriptions_one_active_per_user",
+            "user_id",
+            unique=True,
+            postgresql_where=text("status = 'ACTIVE'"),
+            sqlite_where=text("status = 'ACTIVE'"),
+        ).ddl_if(dialect=("postgresql", "sqlite")),
+        # ...and a functional unique index on MySQL (8.0.13+), where NULLs for non-ACTIVE rows never collide.
+        Index(
+            "uq_subscriptions_one_active_per_user",
+            text("(CASE WHEN status = 'ACTIVE' THEN user_id END)"), # Functional key parts need their own parentheses
+            unique=True,
+        ).ddl_if(dialect="mysql"),
+    )
+
+class SchedulerLease(Base):
+    """
+    Why this model is necessary:
+    - Several API workers each start a scheduler; a lease row lets exactly one of them
+      (the leader) run the expiration loop, and lets another take over if it dies.
+    What it's storing:
+    - `name`: which job the lease is for; `holder`: the worker holding it;
+      `expires_at` (UTC): when the lease lapses unless the holder renews it.
+    """
+    __tablename__ = "scheduler_leases"
+    name = Column(String(100), primary_key=True)
+    holder = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class IdempotencyKey(Base):
+    """
+    Why this model is necessary:
+    - Shared store for `Idempotency-Key` responses (IDEMPOTENCY_BACKEND=database), so a
+      retried request can be replayed by any worker.
+    What it's storing:
+    - `key`: digest of method, path, caller and key; `request_hash`: digest of the body;
+      the original status, headers (JSON) and body; and when the entry expires (UTC).
+    """
+    __tablename__ = "idempotency_keys"
+    key = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    headers = Column(Text, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class SchemaFingerprint(Base):
+    """
+    Why this model is necessary:
+    - Lets a starting worker tell with one SELECT whether the database already has the
+      schema these models describe, instead of running `create_all` on every boot.
+    What it's storing:
+    - `name`: which metadata the fingerprint is for; `fingerprint`: SHA-256 of the models'
+      DDL (see `app/bootstrap.py`); `applied_at` (UTC): when it was last applied.
+    """
+    __tablename__ = "schema_fingerprints"
+    name = Column(String(100), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+
+class SubscriptionPlanChange(Base):
+    """
+    Why this model is necessary:
+    - A plan change overwrites the subscription's `plan_id` and `end_date`, so without a
+      record of the old plan and term the unused part of it cannot be credited.
+    What it's storing:
+    - The old and new plan, the old term's end date and the day of the change, written in
+      the same transaction as the change; `billing_run_id` is set once a billing run has
+      credited it (see `app/services/billing.py`).
+    """
+    __tablename__ = "subscription_plan_changes"
+    id = Column(Integer, primary_key=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), nullable=False, index=True)
+    old_plan_id = Column(Integer, ForeignKey("plans.id"), nullable=False)
+    new_plan_id = Column(Integer, ForeignKey("plans.id"), nullable=False)
+    old_end_date = Column(Date, nullable=False)
+    changed_on = Column(Date, nullable=False, index=True)
+    billing_run_id = Column(Integer, ForeignKey("billing_runs.id"), nullable=True)
+
+    @classmethod
+    def for_change(cls, subscription: Subscription, new_plan: Plan) -> "SubscriptionPlanChange":
+        """The record for moving `subscription` to `new_plan` today; add it before changing the subscription."""
+        return cls(
+            subscription_id=subscription.id,
+            old_plan_id=subscription.plan_id,
+            new_plan_id=new_plan.id,
+            old_end_date=subscription.end_date,
+            changed_on=date.today()
+        )
+
+class BillingRunStatusEnum(enum.Enum):
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+class BillingRun(Base):
+    """
+    Why this model is necessary:
+    - Records which billing periods have been run, and their totals.
+    What it's storing:
+    - The period `[period_start, period_end)`, when the run started and finished (UTC), its
+      status, and the number of subscriptions renewed, changes credited and the net amount.
+    """
+    __tablename__ = "billing_runs"
+    id = Column(Integer, primary_key=True)
+    period_start = Column(Date, nullable=False)
+    period_end = Column(Date, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    status = Column(SQLAlchemyEnum(BillingRunStatusEnum), nullable=False, default=BillingRunStatusEnum.RUNNING)
+    renewals = Column(Integer, nullable=False, default=0)
+    plan_changes = Column(Integer, nullable=False, default=0)
+    net_amount = Column(Float, nullable=False, default=0.0)
+
+class BillingChargeKindEnum(enum.Enum):
+    RENEWAL = "RENEWAL"
+    PRORATION_CREDIT = "PRORATION_CREDIT"
+    PLAN_CHANGE = "PLAN_CHANGE"
+
+class BillingCharge(Base):
+    """
+    Why this model is necessary:
+    - The line items of a billing run, one per subscription and kind.
+    What it's storing:
+    - The subscription, user and plan charged, the kind, the amount (negative for credits),
+      the number of plan terms it covers and the service period it is for.
+    """
+    __tablename__ = "billing_charges"
+    id = Column(Integer, primary_key=True)
+    billing_run_id = Column(Integer, ForeignKey("billing_runs.id"), nullable=False, index=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    plan_id = Column(Integer, ForeignKey("plans.id"), nullable=False)
+    kind = Column(SQLAlchemyEnum(BillingChargeKindEnum), nullable=False)
+    amount = Column(Float, nullable=False)
+    terms = Column(Integer, nullable=False)
+    service_start = Column(Date, nullable=False)
+    service_end = Column(Date, nullable=False)
+
+class BillingPlanRevenue(Base):
+    """
+    Why this model is necessary:
+    - Per-plan revenue of a billing period, without summing its charges again.
+    What it's storing:
+    - For each run and plan: renewal charges, plan-change charges, proration credits
+      (negative) and their sum.
+    """
+    __tablename__ = "billing_plan_revenue"
+    billing_run_id = Column(Integer, ForeignKey("billing_runs.id"), primary_key=True)
+    plan_id = Column(Integer, ForeignKey("plans.id"), primary_key=True)
+    renewal_amount = Column(Float, nullable=False, default=0.0)
+    plan_change_amount = Column(Float, nullable=False, default=0.0)
+    credit_amount = Column(Float, nullable=False, default=0.0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class SubscriptionCount(Base):
+    """
+    Why this model is necessary:
+    - Answers "how many subscriptions per plan and status" (and MRR) without scanning
+      `subscriptions`.
+    What it's storing:
+    - The number of subscriptions per plan and status, split over `shard` rows
+      (`user_id % ANALYTICS_COUNTER_SHARDS`); the real count is the sum over shards. Updated
+      in the same transaction as every subscription write (see `app/subscription_counters.py`)
+      and rebuilt by `python -m app.services.analytics reconcile`.
+    """
+    __tablename__ = "subscription_counts"
+    plan_id = Column(Integer, ForeignKey("plans.id"), primary_key=True)
+    status = Column(SQLAlchemyEnum(SubscriptionStatusEnum), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class SubscriptionDailyCount(Base):
+    """
+    Why this model is necessary:
+    - Daily new-subscription and churn figures without scanning `subscriptions`.
+    What it's storing:
+    - Per day, plan and shard: subscriptions started, cancelled and expired that day
+      (expirations are counted on the subscription's `end_date`).
+    """
+    __tablename__ = "subscription_daily_counts"
+    day = Column(Date, primary_key=True)
+    plan_id = Column(Integer, ForeignKey("plans.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    new_subscriptions = Column(Integer, nullable=False, default=0)
+    cancellations = Column(Integer, nullable=False, default=0)
+    expirations = Column(Integer, nullable=False, default=0)
+
+class SubscriptionEvent(Base):
+    """
+    Why this model is necessary:
+    - Transactional outbox of subscription lifecycle changes, so downstream services can
+      subscribe (`GET /subscriptions/events`) instead of polling.
+    What it's storing:
+    - One row per change (`subscription.created`, `.plan_changed`, `.cancelled`, `.expired`),
+      written in the same transaction as the change. `id` is the consumers' resumable
+      offset; AUTOINCREMENT on SQLite so ids are never reused after pruning.
+    """
+    __tablename__ = "subscription_events"
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String(50), nullable=False)
+    subscription_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    plan_id = Column(Integer, nullable=False)
+    previous_plan_id = Column(Integer, nullable=True)
+    status = Column(SQLAlchemyEnum(SubscriptionStatusEnum), nullable=False)
+    occurred_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = {"sqlite_autoincrement": True}
@@ -0,0 +1,31 @@
+# app/pagination.py
+import base64
+from fastapi import HTTPException, status
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Why this function is necessary:
+    - Keyset-paginated endpoints hand clients an opaque cursor instead of an offset, so the
+      position format can change without breaking clients.
+    What it's doing:
+    - Encodes the id of the last item on the page as URL-safe base64.
+    """
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str | None) -> int | None:
+    """
+    Why this function is necessary:
+    - Turns a cursor from `encode_cursor` back into the id to continue after.
+    What it's doing:
+    - Returns None for the first page (no cursor); raises 400 for a malformed cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, last_id = decoded.split(":", 1)
+        if prefix != "id":
+            raise ValueError(decoded)
+        return int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor.")
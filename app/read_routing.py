@@ -0,0 +1,82 @@
+# app/read_routing.py
+import hashlib
+import os
+import time
+from .cache import TTLCache
+
+# After a client's successful write, its reads go to the primary for this many seconds,
+# so it sees its own writes despite replica lag. 0 disables read-your-writes stickiness.
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_STICKY_MAX_CLIENTS = int(os.getenv("REPLICA_STICKY_MAX_CLIENTS", 100000))
+PRIMARY_COOKIE_NAME = "read_primary_until"
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+_recent_writers = TTLCache(maxsize=REPLICA_STICKY_MAX_CLIENTS, ttl=max(REPLICA_STICKY_SECONDS, 0.001))
+"""
+Why _recent_writers is necessary:
+- Read-your-writes: a client that just changed its subscription must not read the old row
+  from a lagging replica.
+What it's doing:
+- Remembers, for REPLICA_STICKY_SECONDS, the clients (by digest of their Authorization
+  header) whose last write succeeded in this worker.
+- The same deadline is also sent as the `read_primary_until` cookie, so a client that keeps
+  cookies stays on the primary when its next request lands on another worker.
+"""
+
+def _client_key(authorization: str | bytes | None) -> bytes | None:
+    if not authorization:
+        return None
+    if isinstance(authorization, str):
+        authorization = authorization.encode()
+    return hashlib.sha256(authorization).digest()
+
+def should_read_from_primary(request) -> bool:
+    """
+    Why this function is necessary:
+    - Decides whether a read-only session for this request may use a replica.
+    What it's doing:
+    - True if this client wrote within REPLICA_STICKY_SECONDS, either as recorded by this
+      worker or as stated by its `read_primary_until` cookie.
+    """
+    if REPLICA_STICKY_SECONDS <= 0:
+        return False
+    key = _client_key(request.headers.get("authorization"))
+    if key is not None and _recent_writers.get(key) is not None:
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE_NAME, 0)) > time.time()
+    except ValueError:
+        return False
+
+class ReadYourWritesMiddleware:
+    """
+    Why this class is necessary:
+    - Marks clients as recent writers without every write endpoint having to do it.
+    What it's doing:
+    - After a request with a non-safe method (POST/PUT/PATCH/DELETE) gets a 2xx/3xx response,
+      records the client in `_recent_writers` and sets the `read_primary_until` cookie.
+    - Plain ASGI middleware; a no-op when no replicas are configured.
+    """
+
+    def __init__(self, app, enabled: bool):
+        self.app = app
+        self.enabled = enabled and REPLICA_STICKY_SECONDS > 0
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        authorization = next((value for name, value in scope["headers"] if name == b"authorization"), None)
+
+        async def send_marking_writer(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                key = _client_key(authorization)
+                if key is not None:
+                    _recent_writers.set(key, True)
+                primary_until = time.time() + REPLICA_STICKY_SECONDS
+                cookie = f"{PRIMARY_COOKIE_NAME}={primary_until:.3f}; Max-Age={int(REPLICA_STICKY_SECONDS) + 1}; Path=/; HttpOnly; SameSite=Lax"
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_marking_writer)
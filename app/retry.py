@@ -0,0 +1,165 @@
+# app/retry.py
+import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from tenacity import retry, stop_after_attempt, wait_random_exponential, RetryCallState
+
+DB_RETRY_MAX_ATTEMPTS = int(os.getenv("DB_RETRY_MAX_ATTEMPTS", 3))
+DB_RETRY_BASE_SECONDS = float(os.getenv("DB_RETRY_BASE_SECONDS", 0.1))
+DB_RETRY_MAX_SECONDS = float(os.getenv("DB_RETRY_MAX_SECONDS", 2))
+# Time budget for retries within one HTTP request; no retry sleeps past it.
+DB_RETRY_REQUEST_BUDGET_SECONDS = float(os.getenv("DB_RETRY_REQUEST_BUDGET_SECONDS", 5))
+
+# MySQL: lock wait timeout, deadlock, server gone away, lost connection.
+# PostgreSQL (SQLSTATE): serialization failure, deadlock detected.
+TRANSIENT_MYSQL_ERROR_CODES = {1205, 1213, 2006, 2013}
+TRANSIENT_SQLSTATES = {"40001", "40P01"}
+
+_request_deadline: ContextVar[float | None] = ContextVar("db_retry_request_deadline", default=None)
+
+_retry_metrics_lock = threading.Lock()
+db_retry_metrics: Counter = Counter()
+"""
+Why db_retry_metrics is necessary:
+- Makes retries visible: keys are `(function_name, outcome)` with outcome "retried" (one per
+  retry sleep) or "gave_up" (a transient error that was re-raised after the last attempt).
+"""
+
+def is_transient_db_error(exc: BaseException) -> bool:
+    """
+    Why this function is necessary:
+    - Only errors that may succeed on a fresh connection are worth retrying. Constraint
+      violations, programming errors and data errors fail the same way every time.
+    What it's doing:
+    - Accepts disconnects (the pool invalidated the connection), interface errors, and
+      operational errors that signal deadlocks, lock timeouts or a lost server.
+    """
+    if isinstance(exc, DisconnectionError):
+        return True
+    if isinstance(exc, DBAPIError) and exc.connection_invalidated:
+        return True
+    if isinstance(exc, InterfaceError):
+        return True
+    if isinstance(exc, OperationalError):
+        orig = exc.orig
+        code = orig.args[0] if orig is not None and orig.args else None
+        sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+        return code in TRANSIENT_MYSQL_ERROR_CODES or sqlstate in TRANSIENT_SQLSTATES
+    return False
+
+# Set on errors raised by the COMMIT of `commit_once`; those are never retried.
+_RAISED_BY_COMMIT = "raised_by_commit"
+
+def _retry_if_transient(retry_state: RetryCallState) -> bool:
+    outcome = retry_state.outcome
+    if not outcome.failed:
+        return False
+    error = outcome.exception()
+    return is_transient_db_error(error) and not getattr(error, _RAISED_BY_COMMIT, False)
+
+
+def commit_once(db: Session) -> None:
+    """
+    Why this function is necessary:
+    - An error raised by COMMIT itself (e.g. the connection dropped) does not tell whether
+      the transaction was applied. Retrying the whole function could apply it twice, e.g.
+      a second subscription event in the outbox.
+    What it's doing:
+    - Flushes pending changes first, so errors from the writes themselves stay retryable,
+      then commits. An error raised by the COMMIT is marked, and the retry decorators
+      re-raise it instead of retrying.
+    """
+    db.flush()
+    try:
+        db.commit()
+    except Exception as e:
+        setattr(e, _RAISED_BY_COMMIT, True)
+        raise
+
+async def commit_once_async(db: AsyncSession) -> None:
+    """`commit_once` for an `AsyncSession`."""
+    await db.flush()
+    try:
+        await db.commit()
+    except Exception as e:
+        setattr(e, _RAISED_BY_COMMIT, True)
+        raise
+
+def _stop(retry_state: RetryCallState) -> bool:
+    # The wait is computed before stop, so upcoming_sleep is the sleep this retry would take.
+    deadline = _request_deadline.get()
+    out_of_time = deadline is not None and time.monotonic() + retry_state.upcoming_sleep > deadline
+    should_stop = out_of_time or stop_after_attempt(DB_RETRY_MAX_ATTEMPTS)(retry_state)
+    if should_stop and _retry_if_transient(retry_state):
+        _record(retry_state, "gave_up")
+    return should_stop
+
+def _record(retry_state: RetryCallState, outcome: str) -> None:
+    with _retry_metrics_lock:
+        db_retry_metrics[(retry_state.fn.__name__, outcome)] += 1
+
+def _session_of(retry_state: RetryCallState):
+    return retry_state.args[0] if retry_state.args else retry_state.kwargs.get("db")
+
+def _rollback_before_retry(retry_state: RetryCallState) -> None:
+    _record(retry_state, "retried")
+    db = _session_of(retry_state)
+    if db is not None:
+        db.rollback() # Releases the broken connection; the next attempt checks out a fresh one
+
+async def _rollback_before_retry_async(retry_state: RetryCallState) -> None:
+    _record(retry_state, "retried")
+    db = _session_of(retry_state)
+    if db is not None:
+        await db.rollback()
+
+_retry_policy = dict(
+    retry=_retry_if_transient,
+    wait=wait_random_exponential(multiplier=DB_RETRY_BASE_SECONDS, max=DB_RETRY_MAX_SECONDS),
+    stop=_stop,
+    reraise=True,
+)
+
+db_retry_decorator = retry(before_sleep=_rollback_before_retry, **_retry_policy)
+"""
+Why db_retry_decorator is necessary:
+- Retries CRUD writes (taking a sync `Session` as `db`) across transient DB failures,
+  such as a failover, without amplifying them.
+What it's doing:
+- Retries only `is_transient_db_error` errors, at most DB_RETRY_MAX_ATTEMPTS attempts, and
+  never an error raised by the COMMIT of `commit_once`: the whole function is re-run, so
+  retried functions commit through it.
+- Rolls the session back before each retry, so the next attempt runs on a new connection.
+- Sleeps with jittered exponential backoff, and never past the current request's deadline.
+- Re-raises the original error when it gives up; counts retries in `db_retry_metrics`.
+"""
+
+async_db_retry_decorator = retry(before_sleep=_rollback_before_retry_async, **_retry_policy)
+"""Same policy for `async def` CRUD functions on an `AsyncSession`; sleeps with asyncio.sleep."""
+
+class RequestDeadlineMiddleware:
+    """
+    Why this class is necessary:
+    - Bounds how long DB retries may delay a single request, so retries during an outage
+      do not keep requests and pool connections waiting.
+    What it's doing:
+    - Sets a deadline DB_RETRY_REQUEST_BUDGET_SECONDS after the request starts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_deadline.set(time.monotonic() + DB_RETRY_REQUEST_BUDGET_SECONDS)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_deadline.reset(token)
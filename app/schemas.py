@@ -1,6 +1,7 @@
 
 # app/schemas.py
-from pydantic import BaseModel, Field, field_validator, EmailStr
+import re
+from pydantic import BaseModel, Field, field_validator, model_validator, EmailStr
 from typing import List, Optional
 from datetime import date
 from .models import SubscriptionStatusEnum
@@ -25,6 +26,22 @@ class UserBase(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
     email: EmailStr # Pydantic will validate if it's a valid email format
 
+class UserAvailabilityQuery(BaseModel):
+    """Query of `GET /users/availability`: a username, an email, or both."""
+    username: Optional[str] = Field(None, min_length=3, max_length=50)
+    email: Optional[EmailStr] = None
+
+    @model_validator(mode="after")
+    def require_one(self):
+        if self.username is None and self.email is None:
+            raise ValueError("Give a username, an email, or both.")
+        return self
+
+class UserAvailability(BaseModel):
+    """True when the value can be registered; null when it was not asked for."""
+    username_available: Optional[bool] = None
+    email_available: Optional[bool] = None
+
 class UserCreate(UserBase):
     """
     Why this Pydantic model is necessary:
@@ -35,6 +52,33 @@ class UserCreate(UserBase):
     """
     password: str = Field(..., min_length=8)
 
+BCRYPT_HASH_PATTERN = re.compile(r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$")
+
+class UserProvision(UserBase):
+    """
+    Why this Pydantic model is necessary:
+    - Validates one line of a bulk provisioning upload (`POST /admin/users/bulk`).
+    What it's doing:
+    - Requires exactly one of `password` (hashed during provisioning, same rules as
+      `UserCreate`) or `hashed_password` (an existing bcrypt hash, e.g. when migrating
+      accounts from another system, stored as is).
+    """
+    password: Optional[str] = Field(None, min_length=8)
+    hashed_password: Optional[str] = None
+
+    @field_validator("hashed_password")
+    @classmethod
+    def check_bcrypt_hash(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and not BCRYPT_HASH_PATTERN.match(value):
+            raise ValueError("must be a bcrypt hash")
+        return value
+
+    @model_validator(mode="after")
+    def check_one_password(self):
+        if (self.password is None) == (self.hashed_password is None):
+            raise ValueError("exactly one of password or hashed_password is required")
+        return self
+
 class User(UserBase): # Schema for returning User data (without password)
     """
     Why this Pydantic model is necessary:
@@ -98,3 +142,59 @@ class Subscription(SubscriptionBase):
     class Config:
         from_attributes = True
         use_enum_values = True
+
+# --- Pagination Schemas ---
+class PlanPage(BaseModel):
+    """
+    Why this Pydantic model is necessary:
+    - Response of keyset-paginated plan listings.
+    What it's doing:
+    - `items`: the plans on this page.
+    - `next_cursor`: pass as `cursor` to get the next page; None on the last page.
+    """
+    items: List[Plan]
+    next_cursor: Optional[str] = None
+
+class SubscriptionPage(BaseModel):
+    """
+    Why this Pydantic model is necessary:
+    - Response of the keyset-paginated subscription history.
+    What it's doing:
+    - `items`: the subscriptions on this page, newest first.
+    - `next_cursor`: pass as `cursor` to get the next page; None on the last page.
+    """
+    items: List[Subscription]
+    next_cursor: Optional[str] = None
+
+# --- Analytics Schemas ---
+class PlanSubscriptionStats(BaseModel):
+    """Subscription counts and monthly recurring revenue of one plan."""
+    plan_id: int
+    plan_name: Optional[str] = None
+    active: int = 0
+    cancelled: int = 0
+    expired: int = 0
+    inactive: int = 0
+    mrr: float = 0.0
+
+class DailySubscriptionStats(BaseModel):
+    """New subscriptions and churn (cancellations + expirations) on one day."""
+    day: date
+    new_subscriptions: int = 0
+    cancellations: int = 0
+    expirations: int = 0
+    churned: int = 0
+
+class SubscriptionAnalytics(BaseModel):
+    """
+    Why this Pydantic model is necessary:
+    - Response of the subscription analytics endpoint.
+    What it's doing:
+    - `plans`: counts per status and MRR per plan; `total_active` and `mrr` over all plans.
+    - `daily`: one entry per day of the requested window, oldest first (days without
+      activity included, with zeros).
+    """
+    total_active: int
+    mrr: float
+    plans: List[PlanSubscriptionStats]
+    daily: List[DailySubscriptionStats]
@@ -0,0 +1,98 @@
+# app/serialization.py
+import enum
+import os
+from datetime import date
+from typing import Any, Callable, Iterable, Optional
+from fastapi.responses import ORJSONResponse
+
+from .models import SubscriptionStatusEnum
+
+# Opt-in: build plan/subscription response bodies straight from the ORM objects and encode
+# them with orjson, instead of validating them against `response_model` first.
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() in ("1", "true", "yes")
+"""
+Why the fast serialization path is necessary:
+- For every response FastAPI validates the returned ORM objects against `response_model`
+  (`from_attributes=True`, including the nested `Plan`), dumps the validated model and runs
+  `jsonable_encoder` over the result before `json.dumps`. Profiles show this dominating CPU
+  on the plan and subscription endpoints.
+What it's doing:
+- The `*_to_dict` functions map ORM objects to dicts with the same keys, key order and
+  value types the schemas produce; `fast_json_response` encodes them with orjson and
+  returns the response directly, so FastAPI skips its validation and encoding.
+- The output is byte-identical to the standard path. Values the two encoders would format
+  differently (floats that `json.dumps` writes in exponent notation) or that pydantic would
+  convert (e.g. a datetime in a date field) raise `FastPathUnsupported`, and the endpoint
+  falls back to the standard path.
+- User responses always take the standard path: `EmailStr` validation normalizes the address.
+"""
+
+class FastPathUnsupported(Exception):
+    """A value cannot be encoded byte-identically without pydantic; use the standard path."""
+
+def _float(value) -> float:
+    value = float(value)
+    # `json.dumps` (float repr) and orjson agree on plain decimal notation only.
+    if value != 0 and not 1e-4 <= abs(value) < 1e16:
+        raise FastPathUnsupported(f"float {value!r}")
+    return value
+
+def _int(value) -> int:
+    if type(value) is not int:
+        raise FastPathUnsupported(f"int {value!r}")
+    return value
+
+def _date(value) -> date:
+    if type(value) is not date:
+        raise FastPathUnsupported(f"date {value!r}")
+    return value
+
+def _status(value) -> str:
+    if isinstance(value, enum.Enum):
+        return value.value
+    return SubscriptionStatusEnum(value).value
+
+def plan_to_dict(plan) -> dict:
+    """`schemas.Plan` as a dict."""
+    return {
+        "name": plan.name,
+        "price": _float(plan.price),
+        "features": plan.features,
+        "duration_days": _int(plan.duration_days),
+        "id": _int(plan.id),
+    }
+
+def subscription_to_dict(subscription) -> dict:
+    """`schemas.Subscription` (with its nested plan) as a dict."""
+    return {
+        "user_id": _int(subscription.user_id),
+        "plan_id": _int(subscription.plan_id),
+        "id": _int(subscription.id),
+        "start_date": _date(subscription.start_date),
+        "end_date": _date(subscription.end_date),
+        "status": _status(subscription.status),
+        "plan": plan_to_dict(subscription.plan),
+    }
+
+def page_to_dict(to_dict: Callable[[Any], dict], items: Iterable, next_cursor: Optional[str]) -> dict:
+    """`schemas.PlanPage` / `schemas.SubscriptionPage` as a dict."""
+    return {"items": [to_dict(item) for item in items], "next_cursor": next_cursor}
+
+def fast_json_response(build: Callable[[], Any], status_code: int = 200, headers: Optional[dict] = None) -> Optional[ORJSONResponse]:
+    """
+    Why this function is necessary:
+    - Single switch between the fast path and the standard `response_model` path.
+    What it's doing:
+    - Returns None when FAST_SERIALIZATION is off or `build()` raises `FastPathUnsupported`;
+      the endpoint then returns its ORM objects as before.
+    - Otherwise returns an `ORJSONResponse` with the built content, status code and headers.
+    How it's used:
+    - `return fast_json_response(lambda: plan_to_dict(plan)) or plan`
+    """
+    if not FAST_SERIALIZATION:
+        return None
+    try:
+        content = build()
+    except FastPathUnsupported:
+        return None
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
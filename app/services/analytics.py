@@ -0,0 +1,205 @@
+# app/services/analytics.py
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+from .. import models
+from ..database import SessionLocal, read_session_factory
+from ..subscription_counters import ANALYTICS_COUNTER_SHARDS
+
+# MRR normalizes every plan to a month of this many days: price * MRR_MONTH_DAYS / duration_days.
+MRR_MONTH_DAYS = float(os.getenv("MRR_MONTH_DAYS", 30))
+
+def monthly_recurring_revenue(plan: models.Plan | None, active: int) -> float:
+    if plan is None or not plan.duration_days:
+        return 0.0
+    return active * plan.price * MRR_MONTH_DAYS / plan.duration_days
+
+def build_subscription_analytics(
+    counts: dict[tuple[int, models.SubscriptionStatusEnum], int],
+    daily: dict[date, tuple[int, int, int]],
+    plans: dict[int, models.Plan],
+    since: date,
+    until: date
+) -> dict:
+    """
+    Why this function is necessary:
+    - Turns the summed counters into the `schemas.SubscriptionAnalytics` response.
+    What it's doing:
+    - One entry per plan that has counters or exists in `plans`, with its counts per status
+      and MRR (active subscriptions times the plan's price per MRR_MONTH_DAYS).
+    - One entry per day from `since` to `until` inclusive; churn is cancellations plus expirations.
+    """
+    per_plan = defaultdict(dict)
+    for (plan_id, status), count in counts.items():
+        per_plan[plan_id][status] = count
+    plan_stats = []
+    for plan_id in sorted(set(per_plan) | set(plans)):
+        by_status = per_plan.get(plan_id, {})
+        plan = plans.get(plan_id)
+        active = by_status.get(models.SubscriptionStatusEnum.ACTIVE, 0)
+        plan_stats.append({
+            "plan_id": plan_id,
+            "plan_name": plan.name if plan else None,
+            "active": active,
+            "cancelled": by_status.get(models.SubscriptionStatusEnum.CANCELLED, 0),
+            "expired": by_status.get(models.SubscriptionStatusEnum.EXPIRED, 0),
+            "inactive": by_status.get(models.SubscriptionStatusEnum.INACTIVE, 0),
+            "mrr": round(monthly_recurring_revenue(plan, active), 2),
+        })
+    daily_stats = []
+    for offset in range((until - since).days + 1):
+        day = since + timedelta(days=offset)
+        new, cancelled, expired = daily.get(day, (0, 0, 0))
+        daily_stats.append({
+            "day": day, "new_subscriptions": new, "cancellations": cancelled,
+            "expirations": expired, "churned": cancelled + expired,
+        })
+    return {
+        "total_active": sum(stats["active"] for stats in plan_stats),
+        "mrr": round(sum(stats["mrr"] for stats in plan_stats), 2),
+        "plans": plan_stats,
+        "daily": daily_stats,
+    }
+
+def compute_counters(db: Session) -> tuple[dict, dict]:
+    """
+    Why this function is necessary:
+    - The ground truth the incremental counters are checked against and rebuilt from.
+    What it's doing:
+    - Scans `subscriptions` (three GROUP BY queries) and returns
+      `({(plan_id, status, shard): count}, {(day, plan_id, shard): {"new_subscriptions", "expirations"}})`.
+    - New subscriptions are counted on `start_date` under the plan they started on (the old
+      plan of their first recorded plan change, if any); expirations on `end_date`.
+    - Cancellation days are not stored on subscriptions, so they cannot be recomputed.
+    """
+    subscription = models.Subscription
+    change = models.SubscriptionPlanChange
+    shard = (subscription.user_id % ANALYTICS_COUNTER_SHARDS).label("shard")
+
+    counts = {
+        (plan_id, status, shard_number): count
+        for plan_id, status, shard_number, count in db.execute(
+            select(subscription.plan_id, subscription.status, shard, func.count())
+            .group_by(subscription.plan_id, subscription.status, shard)
+        ).all()
+    }
+
+    first_change = select(change.subscription_id, func.min(change.id).label("first_id")).group_by(change.subscription_id).subquery()
+    original_plan = select(change.subscription_id, change.old_plan_id).join(first_change, change.id == first_change.c.first_id).subquery()
+    started_plan = func.coalesce(original_plan.c.old_plan_id, subscription.plan_id).label("plan_id")
+    daily = defaultdict(lambda: {"new_subscriptions": 0, "expirations": 0})
+    for day, plan_id, shard_number, count in db.execute(
+        select(subscription.start_date, started_plan, shard, func.count())
+        .outerjoin(original_plan, original_plan.c.subscription_id == subscription.id)
+        .group_by(subscription.start_date, started_plan, shard)
+    ).all():
+        daily[(day, plan_id, shard_number)]["new_subscriptions"] = count
+    for day, plan_id, shard_number, count in db.execute(
+        select(subscription.end_date, subscription.plan_id, shard, func.count())
+        .where(subscription.status == models.SubscriptionStatusEnum.EXPIRED)
+        .group_by(subscription.end_date, subscription.plan_id, shard)
+    ).all():
+        daily[(day, plan_id, shard_number)]["expirations"] = count
+    return counts, dict(daily)
+
+def reconcile(db: Session, fix: bool = True) -> dict:
+    """
+    Why this function is necessary:
+    - Counters drift if subscriptions are written around the CRUD functions (manual SQL,
+      bulk loads) or were written before the counters existed.
+    What it's doing:
+    - Compares the stored counters with `compute_counters` per plan and status, and per day
+      and plan for new subscriptions and expirations; returns the differences.
+    - With `fix`, replaces the stored counters with the computed ones in one transaction,
+      keeping the stored daily cancellations. Writes committed while it runs may be lost
+      (last writer wins), so prefer a quiet period.
+    """
+    started = time.perf_counter()
+    expected_counts, expected_daily = compute_counters(db)
+    stored_counts = {
+        (row.plan_id, row.status, row.shard): row.count for row in db.query(models.SubscriptionCount)
+    }
+    stored_daily = {(row.day, row.plan_id, row.shard): row for row in db.query(models.SubscriptionDailyCount)}
+
+    def by_plan_status(counts: dict) -> dict:
+        totals = defaultdict(int)
+        for (plan_id, status, _), count in counts.items():
+            totals[(plan_id, status)] += count
+        return totals
+
+    expected_totals, stored_totals = by_plan_status(expected_counts), by_plan_status(stored_counts)
+    count_drift = []
+    for plan_id, status in sorted(set(expected_totals) | set(stored_totals), key=lambda key: (key[0], key[1].value)):
+        stored, expected = stored_totals.get((plan_id, status), 0), expected_totals.get((plan_id, status), 0)
+        if stored != expected:
+            count_drift.append({"plan_id": plan_id, "status": status.value, "stored": stored, "expected": expected})
+
+    def by_day_plan(rows: dict, column: str) -> dict:
+        totals = defaultdict(int)
+        for (day, plan_id, _), values in rows.items():
+            totals[(day, plan_id)] += values[column] if isinstance(values, dict) else getattr(values, column)
+        return totals
+
+    daily_drift = []
+    for column in ("new_subscriptions", "expirations"):
+        expected, stored = by_day_plan(expected_daily, column), by_day_plan(stored_daily, column)
+        daily_drift.extend(
+            {"day": day.isoformat(), "plan_id": plan_id, "column": column, "stored": stored.get((day, plan_id), 0), "expected": expected.get((day, plan_id), 0)}
+            for day, plan_id in sorted(set(expected) | set(stored))
+            if stored.get((day, plan_id), 0) != expected.get((day, plan_id), 0)
+        )
+
+    fixed = False
+    if fix and (count_drift or daily_drift):
+        daily_rows = {
+            key: {"new_subscriptions": 0, "expirations": 0, "cancellations": row.cancellations}
+            for key, row in stored_daily.items() if row.cancellations
+        }
+        for key, values in expected_daily.items():
+            daily_rows.setdefault(key, {"cancellations": 0}).update(values)
+        try:
+            db.execute(delete(models.SubscriptionCount))
+            db.execute(delete(models.SubscriptionDailyCount))
+            if expected_counts:
+                db.execute(insert(models.SubscriptionCount), [
+                    {"plan_id": plan_id, "status": status, "shard": shard, "count": count}
+                    for (plan_id, status, shard), count in expected_counts.items()
+                ])
+            if daily_rows:
+                db.execute(insert(models.SubscriptionDailyCount), [
+                    {"day": day, "plan_id": plan_id, "shard": shard, **values}
+                    for (day, plan_id, shard), values in daily_rows.items()
+                ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        fixed = True
+    seconds = time.perf_counter() - started
+    print(f"Analytics: Reconciled in {seconds:.2f}s: {len(count_drift)} count and {len(daily_drift)} daily differences{' (fixed)' if fixed else ''}.")
+    return {"count_drift": count_drift, "daily_drift": daily_drift, "fixed": fixed, "seconds": round(seconds, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Subscription analytics counters.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = subcommands.add_parser("reconcile", help="Rebuild the counters from the subscriptions table and report drift")
+    reconcile_parser.add_argument("--check", action="store_true", help="Only report drift (exit status 1 if any); reads from a replica when configured")
+    args = parser.parse_args()
+
+    db: Session = (read_session_factory() if args.check else SessionLocal)()
+    try:
+        report = reconcile(db, fix=not args.check)
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+    if args.check and (report["count_drift"] or report["daily_drift"]):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# app/services/exports.py
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterator
+from sqlalchemy.orm import Session
+from ..database import read_session_factory
+from ..crud import iter_subscription_export_rows
+from ..models import SubscriptionStatusEnum
+
+EXPORT_BATCH_SIZE = 1000
+
+SUBSCRIPTION_EXPORT_FIELDS = [
+    "id", "user_id", "username", "email", "plan_id", "plan_name", "plan_price",
+    "start_date", "end_date", "status",
+]
+
+def _export_record(row) -> list:
+    return [
+        row.id, row.user_id, row.username, row.email, row.plan_id, row.plan_name, row.plan_price,
+        row.start_date.isoformat(), row.end_date.isoformat(), row.status.value,
+    ]
+
+def stream_subscription_export(
+    export_format: str,
+    status: SubscriptionStatusEnum | None = None,
+    end_date_from: date | None = None,
+    end_date_to: date | None = None
+) -> Iterator[str]:
+    """
+    Why this function is necessary:
+    - Body generator for the subscription export endpoint's `StreamingResponse`.
+    What it's doing:
+    - Opens its own read-only session (on a replica when configured), because
+      request-scoped dependencies are closed before a streaming body is sent.
+    - Encodes rows from `crud.iter_subscription_export_rows` as NDJSON (one object per line)
+      or CSV (with a header row), one chunk of text per EXPORT_BATCH_SIZE rows, so memory
+      stays constant however many rows are exported.
+    """
+    db: Session = read_session_factory()()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+        if writer:
+            writer.writerow(SUBSCRIPTION_EXPORT_FIELDS)
+        pending = 0
+        for row in iter_subscription_export_rows(db, status, end_date_from, end_date_to, batch_size=EXPORT_BATCH_SIZE):
+            record = _export_record(row)
+            if writer:
+                writer.writerow(record)
+            else:
+                buffer.write(json.dumps(dict(zip(SUBSCRIPTION_EXPORT_FIELDS, record))))
+                buffer.write("\n")
+            pending += 1
+            if pending == EXPORT_BATCH_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
@@ -0,0 +1,297 @@
+# app/services/outbox.py
+import argparse
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Awaitable, Callable
+import orjson
+from fastapi import Request
+from ..database import AsyncSessionLocal
+from ..async_crud import delete_subscription_events_before, get_latest_subscription_event_id, get_subscription_events_after
+from ..subscription_events import event_to_dict
+
+OUTBOX_RELAY_ENABLED = os.getenv("OUTBOX_RELAY_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_RELAY_BATCH_SIZE = int(os.getenv("OUTBOX_RELAY_BATCH_SIZE", 500))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", 1))
+# Ids are assigned at INSERT but become visible at COMMIT, so a missing id may be a
+# transaction still in flight; the relay waits this long for it before skipping it.
+OUTBOX_GAP_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_GAP_TIMEOUT_SECONDS", 5))
+# Events kept in memory per worker for SSE clients; older offsets are replayed from the table.
+OUTBOX_BUFFER_SIZE = int(os.getenv("OUTBOX_BUFFER_SIZE", 10000))
+OUTBOX_SSE_KEEPALIVE_SECONDS = float(os.getenv("OUTBOX_SSE_KEEPALIVE_SECONDS", 15))
+
+class EventBroker:
+    """
+    Why this class is necessary:
+    - SSE clients of one worker should share the relay's single poll of the outbox table
+      instead of each querying it.
+    What it's doing:
+    - Keeps the last OUTBOX_BUFFER_SIZE published events in a ring buffer and wakes waiting
+      clients on every publish.
+    - `floor` is the offset below which the buffer is incomplete (events before it were
+      never buffered or have been evicted); clients behind it replay from the table.
+    """
+
+    def __init__(self, size: int = OUTBOX_BUFFER_SIZE):
+        self.events: deque[dict] = deque(maxlen=size)
+        self.floor: int | None = None # None until the relay has read its starting offset
+        self.last_id = 0
+        self.published = 0
+        self.clients = 0
+        self._changed = asyncio.Condition()
+
+    async def start_at(self, event_id: int) -> None:
+        async with self._changed:
+            self.floor = self.last_id = event_id
+            self._changed.notify_all()
+
+    async def publish(self, events: list[dict]) -> None:
+        async with self._changed:
+            if len(self.events) + len(events) > self.events.maxlen:
+                evicted = len(self.events) + len(events) - self.events.maxlen
+                self.floor = (list(self.events) + events)[evicted - 1]["id"]
+            self.events.extend(events)
+            self.last_id = events[-1]["id"]
+            self.published += len(events)
+            self._changed.notify_all()
+
+    def events_after(self, after_id: int) -> list[dict] | None:
+        """Buffered events with id > `after_id`; None if `after_id` is behind the buffer."""
+        if self.floor is None or after_id < self.floor:
+            return None
+        if after_id >= self.last_id:
+            return []
+        return [event for event in self.events if event["id"] > after_id]
+
+    async def wait(self, after_id: int, timeout: float) -> None:
+        """Returns once an event after `after_id` is published, or after `timeout` seconds."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.last_id > after_id), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+class OutboxRelay:
+    """
+    Why this class is necessary:
+    - Delivers the `subscription_events` outbox rows in id order, in batches, to a sink
+      (the SSE broker or a file), so consumers never query the subscriptions tables.
+    What it's doing:
+    - Starts after `start_id` (default: the newest event, i.e. only new events), then polls
+      for up to OUTBOX_RELAY_BATCH_SIZE newer events every OUTBOX_POLL_INTERVAL_SECONDS,
+      immediately again while batches come back full.
+    - Publishes only the gap-free prefix of each batch: a missing id may belong to a
+      transaction that has not committed yet, and publishing past it would lose that event
+      for offset-based consumers. After OUTBOX_GAP_TIMEOUT_SECONDS the id is treated as
+      rolled back and skipped.
+    - `publish` is called with `event_to_dict` dicts; the offset only advances once it returns.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[list[dict]], Awaitable[None]],
+        start_id: int | None = None,
+        batch_size: int = OUTBOX_RELAY_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL_SECONDS,
+        gap_timeout: float = OUTBOX_GAP_TIMEOUT_SECONDS
+    ):
+        self.publish = publish
+        self.last_id = start_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout
+        self.relayed = 0
+        self.gaps_skipped = 0
+        self._gap: tuple[int, float] | None = None # (missing id, first seen)
+
+    def _gap_timed_out(self, missing_id: int) -> bool:
+        now = time.monotonic()
+        if self._gap is None or self._gap[0] != missing_id:
+            self._gap = (missing_id, now)
+        return now - self._gap[1] >= self.gap_timeout
+
+    async def poll_once(self) -> int:
+        """Relays the next batch; returns the number of events published."""
+        async with AsyncSessionLocal() as db:
+            if self.last_id is None:
+                self.last_id = await get_latest_subscription_event_id(db)
+            events = await get_subscription_events_after(db, self.last_id, self.batch_size)
+        ready = []
+        expected_id = self.last_id + 1
+        for event in events:
+            if event.id != expected_id:
+                if not self._gap_timed_out(expected_id):
+                    break
+                print(f"Outbox: Skipping missing event ids {expected_id}-{event.id - 1} after {self.gap_timeout}s.")
+                self.gaps_skipped += event.id - expected_id
+            ready.append(event_to_dict(event))
+            expected_id = event.id + 1
+        if ready:
+            await self.publish(ready)
+            self.last_id = ready[-1]["id"]
+            self.relayed += len(ready)
+        return len(ready)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                published = await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Outbox: Relay poll failed: {e}")
+                published = 0
+            if published < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+class FileSink:
+    """
+    Why this class is necessary:
+    - A consumer for local testing and simple pipelines that needs no running server.
+    What it's doing:
+    - Appends each event as one NDJSON line to `path` and then stores the last written id
+      in `path + ".offset"`, so a restarted relay resumes where it stopped. A crash between
+      the two writes repeats events (at-least-once); consumers deduplicate on `id`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = path + ".offset"
+
+    def read_offset(self) -> int | None:
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return None
+
+    async def publish(self, events: list[dict]) -> None:
+        with open(self.path, "ab") as f:
+            f.write(b"".join(orjson.dumps(event) + b"\n" for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.offset_path + ".tmp", "w") as f:
+            f.write(str(events[-1]["id"]))
+        os.replace(self.offset_path + ".tmp", self.offset_path)
+
+event_broker = EventBroker()
+_relay: OutboxRelay | None = None
+_relay_task: asyncio.Task | None = None
+
+async def _start_broker_relay() -> None:
+    async with AsyncSessionLocal() as db:
+        start_id = await get_latest_subscription_event_id(db)
+    _relay.last_id = start_id
+    await event_broker.start_at(start_id)
+    await _relay.run()
+
+def start_outbox_relay() -> None:
+    """Starts this worker's relay into `event_broker` on the running event loop (app startup)."""
+    global _relay, _relay_task
+    if not OUTBOX_RELAY_ENABLED or _relay_task is not None:
+        return
+    _relay = OutboxRelay(event_broker.publish)
+    _relay_task = asyncio.get_running_loop().create_task(_start_broker_relay())
+    print("Outbox: Relay started.")
+
+async def stop_outbox_relay() -> None:
+    global _relay_task
+    if _relay_task is None:
+        return
+    _relay_task.cancel()
+    try:
+        await _relay_task
+    except asyncio.CancelledError:
+        pass
+    _relay_task = None
+    print("Outbox: Relay stopped.")
+
+def outbox_stats() -> dict:
+    return {
+        "relayed": _relay.relayed if _relay else 0,
+        "gaps_skipped": _relay.gaps_skipped if _relay else 0,
+        "sse_clients": event_broker.clients,
+    }
+
+def _format_sse(event: dict) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (event["id"], event["type"].encode(), orjson.dumps(event))
+
+async def stream_subscription_events(request: Request, after_id: int | None) -> AsyncIterator[bytes]:
+    """
+    Why this function is necessary:
+    - Body of `GET /subscriptions/events`: an SSE stream consumers resume from their last
+      offset (`Last-Event-ID`), so they can subscribe instead of polling subscriptions.
+    What it's doing:
+    - Without an offset, starts at the newest relayed event (only new events).
+    - While the offset is behind the broker's buffer (`EventBroker.floor`), replays from the
+      table in OUTBOX_RELAY_BATCH_SIZE batches up to the floor, then follows the buffer. The replay reads the primary, like the relay: a lagging replica
+      would return no rows for committed events, and the stream would skip them.
+    - Jumps to the floor only when the primary has no events between the offset and it.
+    - Sends a comment every OUTBOX_SSE_KEEPALIVE_SECONDS without events, and stops when the
+      client disconnects.
+    """
+    event_broker.clients += 1
+    try:
+        yield b"retry: 2000\n\n"
+        while event_broker.floor is None: # Relay still reading its starting offset
+            await event_broker.wait(-1, 0.1)
+            if await request.is_disconnected():
+                return
+        if after_id is None:
+            after_id = event_broker.last_id
+        while True:
+            events = event_broker.events_after(after_id)
+            if events is None:
+                floor = event_broker.floor
+                async with AsyncSessionLocal() as db:
+                    rows = await get_subscription_events_after(db, after_id, OUTBOX_RELAY_BATCH_SIZE, up_to_id=floor)
+                events = [event_to_dict(row) for row in rows]
+                if not events: # The primary has nothing up to the floor; continue from it
+                    after_id = max(after_id, floor)
+                    continue
+            if events:
+                yield b"".join(_format_sse(event) for event in events)
+                after_id = events[-1]["id"]
+                continue
+            await event_broker.wait(after_id, OUTBOX_SSE_KEEPALIVE_SECONDS)
+            if await request.is_disconnected():
+                return
+            if event_broker.last_id <= after_id:
+                yield b": keepalive\n\n"
+    finally:
+        event_broker.clients -= 1
+
+async def _relay_to_file(path: str, once: bool) -> None:
+    sink = FileSink(path)
+    start_id = sink.read_offset()
+    relay = OutboxRelay(sink.publish, start_id=start_id if start_id is not None else 0)
+    if once:
+        while await relay.poll_once() == relay.batch_size:
+            pass
+    else:
+        await relay.run()
+    print(f"Outbox: Relayed {relay.relayed} events to {path} (offset {relay.last_id}).")
+
+async def _prune(days: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await delete_subscription_events_before(db, datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days))
+
+def main():
+    parser = argparse.ArgumentParser(description="Subscription lifecycle event outbox.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    relay_parser = subcommands.add_parser("relay", help="Relay events to an NDJSON file, resuming from its .offset file")
+    relay_parser.add_argument("path")
+    relay_parser.add_argument("--once", action="store_true", help="Exit once caught up instead of polling")
+    prune_parser = subcommands.add_parser("prune", help="Delete events older than --days")
+    prune_parser.add_argument("--days", type=int, required=True)
+    args = parser.parse_args()
+
+    if args.command == "relay":
+        asyncio.run(_relay_to_file(args.path, args.once))
+    else:
+        print(f"Outbox: Deleted {asyncio.run(_prune(args.days))} events older than {args.days} days.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# app/services/plan_catalog.py
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from sqlalchemy.orm import Session
+from ..models import Plan
+
+# Maximum age before GET /plans/ reloads the catalog, so plans created by other workers show up.
+PLAN_CATALOG_MAX_AGE_SECONDS = float(os.getenv("PLAN_CATALOG_MAX_AGE_SECONDS", 300))
+
+class PlanCatalog:
+    """
+    Why this class is necessary:
+    - Plans change rarely but are read on every `GET /plans/` and by every subscription
+      create/update. Serving them from memory avoids a DB query per request.
+    What it's doing:
+    - Holds detached copies of all plans, keyed by id, loaded with `load()` at startup.
+    - `add()` is called by `crud.create_plan` so this process sees its own writes immediately.
+    - `etag` is a digest of the contents only, so every worker serving the same plans returns
+      the same strong tag, and a reload that changes nothing keeps it. `version` counts the
+      changes of this process (for logs) and is bumped only when the digest changes.
+    - Copies are never attached to a session, so they can be shared between requests.
+    """
+
+    def __init__(self):
+        self._plans: dict[int, Plan] = {}
+        self._ids: list[int] = [] # Sorted keys of self._plans, for keyset pages
+        self._lock = threading.Lock()
+        self._loaded_at: float | None = None
+        self.version = 0
+        self.etag = self._compute_etag()
+
+    @staticmethod
+    def _copy(plan: Plan) -> Plan:
+        return Plan(id=plan.id, name=plan.name, price=plan.price, features=plan.features, duration_days=plan.duration_days)
+
+    def _compute_etag(self) -> str:
+        contents = json.dumps(
+            [[p.id, p.name, p.price, p.features, p.duration_days] for p in self._plans.values()],
+            separators=(",", ":")
+        )
+        digest = hashlib.sha256(contents.encode()).hexdigest()[:16]
+        return f'"{digest}"'
+
+    def _changed(self) -> None:
+        # Caller holds self._lock
+        etag = self._compute_etag()
+        if etag != self.etag:
+            self.version += 1
+            self.etag = etag
+
+    def load(self, db: Session) -> None:
+        plans = db.query(Plan).order_by(Plan.id).all()
+        with self._lock:
+            self._plans = {plan.id: self._copy(plan) for plan in plans}
+            self._ids = list(self._plans)
+            self._loaded_at = time.monotonic()
+            self._changed()
+        print(f"Plan catalog: Loaded {len(plans)} plans (version {self.version}).")
+
+    def add(self, plan: Plan) -> None:
+        with self._lock:
+            plans = dict(self._plans)
+            plans[plan.id] = self._copy(plan)
+            self._plans = dict(sorted(plans.items()))
+            self._ids = list(self._plans)
+            self._changed()
+
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > PLAN_CATALOG_MAX_AGE_SECONDS
+
+    def get(self, plan_id: int) -> Plan | None:
+        return self._plans.get(plan_id)
+
+    def all(self) -> list[Plan]:
+        return list(self._plans.values())
+
+    def get_page(self, skip: int = 0, limit: int = 100) -> tuple[str, list[Plan]]:
+        """Returns the current ETag together with the requested page, read consistently."""
+        with self._lock:
+            return self.etag, list(self._plans.values())[skip:skip + limit]
+
+    def page_after(self, after_id: int | None, limit: int) -> list[Plan]:
+        """Keyset page: up to `limit` plans with id greater than `after_id`, by id."""
+        with self._lock:
+            plans, ids = self._plans, self._ids
+        start = 0 if after_id is None else bisect.bisect_right(ids, after_id)
+        return [plans[plan_id] for plan_id in ids[start:start + limit]]
+
+plan_catalog = PlanCatalog()
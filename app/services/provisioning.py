@@ -0,0 +1,270 @@
+# app/services/provisioning.py
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..auth import get_password_hash
+from ..crud import bulk_insert_users, get_registered_positions
+from ..database import SessionLocal
+from ..schemas import UserProvision
+
+# Rows checked, hashed and inserted together; one uniqueness query and one executemany each.
+PROVISIONING_BATCH_SIZE = int(os.getenv("PROVISIONING_BATCH_SIZE", 1000))
+# Processes hashing passwords for a provisioning job. Separate from the login hashing pool,
+# so a bulk upload cannot starve `/token`.
+PROVISIONING_HASH_WORKERS = int(os.getenv("PROVISIONING_HASH_WORKERS", os.cpu_count() or 1))
+
+_provisioning_executor: ProcessPoolExecutor | None = None
+_provisioning_executor_lock = threading.Lock()
+
+def _spawn_hash_pool(workers: int) -> ProcessPoolExecutor:
+    # "spawn", not fork: the API worker has running threads and open DB connections that a
+    # forked child would inherit in whatever state they were in.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def get_provisioning_executor() -> ProcessPoolExecutor:
+    """
+    Why this function is necessary:
+    - Provisioning jobs of one worker share a single hashing pool instead of starting
+      processes per job; it is created on first use, so importing this module stays cheap.
+    """
+    global _provisioning_executor
+    with _provisioning_executor_lock:
+        if _provisioning_executor is None:
+            _provisioning_executor = _spawn_hash_pool(PROVISIONING_HASH_WORKERS)
+        return _provisioning_executor
+
+def shutdown_provisioning_executor() -> None:
+    """
+    Why this function is necessary:
+    - Stops the provisioning pool's processes when the application shuts down.
+    """
+    global _provisioning_executor
+    with _provisioning_executor_lock:
+        if _provisioning_executor is not None:
+            _provisioning_executor.shutdown(wait=False, cancel_futures=True)
+            _provisioning_executor = None
+
+def _validation_detail(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc']) or 'row'}: {item['msg']}" for item in error.errors()
+    )
+
+class UserProvisioner:
+    """
+    Why this class is necessary:
+    - Onboarding a customer through `POST /users/` costs two uniqueness queries, a bcrypt
+      hash and a commit per account, one request at a time.
+    What it's doing:
+    - Reads NDJSON lines (`schemas.UserProvision`) in batches of PROVISIONING_BATCH_SIZE.
+    - Per batch: validates rows, rejects usernames/emails repeated earlier in the job, checks
+      the rest against the database in one set-based query, hashes plain passwords on
+      `executor` (default: this worker's provisioning pool), and inserts the new users with one executemany and one commit.
+    - Yields one result per input line, in input order:
+      `{"line": n, "username": ..., "status": "created", "id": ...}` or
+      `{"line": n, "username": ..., "status": "error", "detail": ...}`.
+    - If a concurrent registration makes the batch insert fail, the batch is retried row by
+      row so only the conflicting rows fail.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        batch_size: int = PROVISIONING_BATCH_SIZE,
+        executor: Executor | None = None,
+        hash_workers: int = PROVISIONING_HASH_WORKERS
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.executor = executor
+        self.hash_workers = hash_workers
+        self._seen_usernames: set[str] = set()
+        self._seen_emails: set[str] = set()
+
+    def _hash_passwords(self, passwords: list[str]) -> list[str]:
+        if not passwords:
+            return []
+        executor = self.executor or get_provisioning_executor()
+        chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+        return list(executor.map(get_password_hash, passwords, chunksize=chunksize))
+
+    def _parse(self, line_number: int, line: str | bytes) -> tuple[UserProvision | None, dict]:
+        result = {"line": line_number, "username": None}
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None, {**result, "status": "error", "detail": "Invalid JSON"}
+        if isinstance(data, dict):
+            result["username"] = data.get("username")
+        try:
+            return UserProvision.model_validate(data), result
+        except ValidationError as e:
+            return None, {**result, "status": "error", "detail": _validation_detail(e)}
+
+    def _insert_one_by_one(self, rows: list[dict], results: list[dict]) -> None:
+        for row, result in zip(rows, results):
+            try:
+                result.update(status="created", id=bulk_insert_users(self.db, [row])[row["username"]])
+            except IntegrityError:
+                result.update(status="error", detail="Username or email already registered")
+
+    def _provision_batch(self, batch: list[tuple[int, str | bytes]]) -> list[dict]:
+        results = []
+        candidates: list[tuple[UserProvision, dict]] = []
+        for line_number, line in batch:
+            user, result = self._parse(line_number, line)
+            results.append(result)
+            if user is None:
+                continue
+            if user.email in self._seen_emails:
+                result.update(status="error", detail="Email repeated in this upload")
+            elif user.username in self._seen_usernames:
+                result.update(status="error", detail="Username repeated in this upload")
+            else:
+                candidates.append((user, result))
+            self._seen_emails.add(user.email)
+            self._seen_usernames.add(user.username)
+
+        taken_usernames, taken_emails = get_registered_positions(
+            self.db, [user.username for user, _ in candidates], [user.email for user, _ in candidates]
+        ) # Compared by the database, as the unique indexes compare
+        new_users = []
+        for position, (user, result) in enumerate(candidates):
+            # Same messages and precedence as `POST /users/`.
+            if position in taken_emails:
+                result.update(status="error", detail="Email already registered")
+            elif position in taken_usernames:
+                result.update(status="error", detail="Username already registered")
+            else:
+                new_users.append((user, result))
+
+        hashes = iter(self._hash_passwords([user.password for user, _ in new_users if user.password is not None]))
+        rows = [
+            {
+                "username": user.username,
+                "email": user.email,
+                "hashed_password": user.hashed_password if user.password is None else next(hashes),
+            }
+            for user, _ in new_users
+        ]
+        new_results = [result for _, result in new_users]
+        try:
+            ids = bulk_insert_users(self.db, rows)
+        except IntegrityError:
+            self._insert_one_by_one(rows, new_results)
+        else:
+            for row, result in zip(rows, new_results):
+                result.update(status="created", id=ids[row["username"]])
+        return results
+
+    def provision(self, lines: Iterable[str | bytes]) -> Iterator[list[dict]]:
+        """Yields the results of each batch; blank lines are skipped but still count as line numbers."""
+        numbered = ((number, line) for number, line in enumerate(lines, start=1) if line.strip())
+        while batch := list(islice(numbered, self.batch_size)):
+            yield self._provision_batch(batch)
+
+async def _ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Lines of an NDJSON body as its chunks arrive; only the current partial line is buffered."""
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+async def stream_provisioning_results(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Why this function is necessary:
+    - Body generator for `POST /admin/users/bulk`'s response, so an upload of any size is
+      processed with one batch of lines in memory instead of the whole body.
+    What it's doing:
+    - Reads the request body (`request.stream()`) line by line and provisions every
+      PROVISIONING_BATCH_SIZE non-blank lines in the threadpool, on its own session
+      (request-scoped dependencies are closed before a streaming body is sent).
+    - Writes each batch's results as NDJSON as soon as the batch is committed; the rest of
+      the body is read only after that, so a slow job holds back the upload.
+    """
+    db: Session = SessionLocal()
+    provisioner = UserProvisioner(db)
+    try:
+        batch: list[tuple[int, bytes]] = []
+        line_number = 0
+        async for line in _ndjson_lines(chunks):
+            line_number += 1
+            if line.strip():
+                batch.append((line_number, line))
+            if len(batch) == provisioner.batch_size:
+                results = await run_in_threadpool(provisioner._provision_batch, batch)
+                yield "".join(json.dumps(result) + "\n" for result in results)
+                batch = []
+        if batch:
+            results = await run_in_threadpool(provisioner._provision_batch, batch)
+            yield "".join(json.dumps(result) + "\n" for result in results)
+    finally:
+        db.close()
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    Why this class is necessary:
+    - Under ASGI spec < 2.4 (uvicorn), `StreamingResponse` listens for the disconnect by
+      calling `receive` while the body is sent, which would swallow the chunks of a request
+      body that the response body is still reading.
+    What it's doing:
+    - Only sends the body. The body iterator is the sole reader of `receive`, and sees a
+      disconnect as `ClientDisconnect` from `request.stream()`.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision users from an NDJSON file (one schemas.UserProvision object per line).")
+    parser.add_argument("input", help="NDJSON file, or - for stdin")
+    parser.add_argument("--output", "-o", help="Write per-line results as NDJSON to this file")
+    parser.add_argument("--batch-size", type=int, default=PROVISIONING_BATCH_SIZE)
+    parser.add_argument("--hash-workers", type=int, default=PROVISIONING_HASH_WORKERS)
+    args = parser.parse_args()
+
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    output = open(args.output, "w") if args.output else None
+    db: Session = SessionLocal()
+    executor = _spawn_hash_pool(args.hash_workers)
+    provisioner = UserProvisioner(db, batch_size=args.batch_size, executor=executor, hash_workers=args.hash_workers)
+    created = failed = 0
+    started = time.perf_counter()
+    try:
+        for results in provisioner.provision(source):
+            for result in results:
+                if result["status"] == "created":
+                    created += 1
+                else:
+                    failed += 1
+                if output:
+                    output.write(json.dumps(result) + "\n")
+            print(f"Provisioning: {created} created, {failed} failed ({time.perf_counter() - started:.1f}s)")
+    finally:
+        executor.shutdown()
+        db.close()
+        if output:
+            output.close()
+        if source is not sys.stdin.buffer:
+            source.close()
+    print(f"Provisioning: Finished in {time.perf_counter() - started:.2f}s: {created} created, {failed} failed.")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,81 @@
 # app/services/scheduler.py
+import os
 import schedule
+import socket
 import time
 import threading
+import uuid
+from typing import Callable
+from datetime import date, datetime, timedelta
 from sqlalchemy.orm import Session
 from ..database import SessionLocal
-from ..crud import get_subscriptions_to_expire, update_subscription_status
+from ..crud import (
+    get_subscriptions_to_expire,
+    update_subscription_status,
+    expire_subscriptions_in_chunks,
+    try_acquire_lease,
+    extend_lease,
+    release_lease,
+)
 from ..models import SubscriptionStatusEnum
+from ..metrics import SCHEDULER_JOB_DURATION, SCHEDULER_SUBSCRIPTIONS_EXPIRED
+
+# "bulk" (the default, replacing the original row-by-row job) expires due subscriptions with chunked
+# set-based UPDATEs; "per_row" keeps the original path. Both write the same counters and events.
+EXPIRATION_MODE = os.getenv("EXPIRATION_MODE", "bulk")
+EXPIRATION_CHUNK_SIZE = int(os.getenv("EXPIRATION_CHUNK_SIZE", 1000))
+
+# "daily" runs the expiration job at 01:00 in every worker; "leader" runs one elected
+# LeaderExpirationScheduler across all workers that expires subscriptions as they fall due.
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "daily")
+SCHEDULER_LEASE_NAME = "expire_subscriptions"
+SCHEDULER_LEASE_TTL_SECONDS = float(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", 30))
 
 def expire_subscriptions_job():
+    """
+    Why this function is necessary:
+    - Entry point registered with the scheduler; picks the expiration strategy.
+    What it's doing:
+    - Runs `expire_subscriptions_bulk_job` when `EXPIRATION_MODE` is "bulk" (default),
+      otherwise falls back to the row-by-row `expire_subscriptions_per_row_job`.
+    """
+    if EXPIRATION_MODE == "bulk":
+        expire_subscriptions_bulk_job()
+    else:
+        expire_subscriptions_per_row_job()
+
+def expire_subscriptions_bulk_job(chunk_size: int = EXPIRATION_CHUNK_SIZE, fence: Callable[[Session], bool] | None = None) -> bool:
+    """
+    Why this function is necessary:
+    - Expiring a large cohort row by row holds a pooled connection for hours.
+    What it's doing:
+    - Uses `crud.expire_subscriptions_in_chunks` to expire due subscriptions in
+      keyset-paginated chunks of `chunk_size`, with one commit per chunk.
+    - `fence` is checked in every chunk's transaction (see `expire_subscriptions_in_chunks`).
+    - Prints rows and seconds for each chunk, then a total. Returns False if the job failed.
+    """
+    print(f"Scheduler: Running bulk expire_subscriptions_job (chunk size {chunk_size})...")
+    db: Session = SessionLocal()
+    total_rows = 0
+    job_started = time.perf_counter()
+    try:
+        for chunk_number, (rows_expired, seconds) in enumerate(expire_subscriptions_in_chunks(db, chunk_size=chunk_size, fence=fence), start=1):
+            total_rows += rows_expired
+            SCHEDULER_SUBSCRIPTIONS_EXPIRED.inc("bulk", amount=rows_expired)
+            print(f"Scheduler: Chunk {chunk_number}: expired {rows_expired} subscriptions in {seconds:.3f}s")
+        if total_rows == 0:
+            print("Scheduler: No subscriptions to expire.")
+        else:
+            print(f"Scheduler: Expired {total_rows} subscriptions in {time.perf_counter() - job_started:.3f}s.")
+    except Exception as e:
+        print(f"Scheduler: Error during expire_subscriptions_job after expiring {total_rows} subscriptions: {e}")
+        return False
+    finally:
+        db.close()
+        SCHEDULER_JOB_DURATION.observe(time.perf_counter() - job_started, "bulk")
+    return True
+
+def expire_subscriptions_per_row_job():
     """
     Why this function is necessary:
     - This is the core logic for the background task that handles subscription expiration.
@@ -22,6 +90,7 @@ def expire_subscriptions_job():
     """
     print("Scheduler: Running expire_subscriptions_job...")
     db: Session = SessionLocal()
+    job_started = time.perf_counter()
     try:
         subscriptions_to_expire = get_subscriptions_to_expire(db)
         if not subscriptions_to_expire:
@@ -31,11 +100,13 @@ def expire_subscriptions_job():
         for sub in subscriptions_to_expire:
             print(f"Scheduler: Expiring subscription ID {sub.id} for user ID {sub.user_id}")
             update_subscription_status(db, sub.id, SubscriptionStatusEnum.EXPIRED)
+            SCHEDULER_SUBSCRIPTIONS_EXPIRED.inc("per_row")
         print(f"Scheduler: Processed {len(subscriptions_to_expire)} subscriptions for expiration.")
     except Exception as e:
         print(f"Scheduler: Error during expire_subscriptions_job: {e}")
     finally:
         db.close()
+        SCHEDULER_JOB_DURATION.observe(time.perf_counter() - job_started, "per_row")
 
 def run_scheduler():
     """
@@ -52,6 +123,87 @@ def run_scheduler():
         schedule.run_pending()
         time.sleep(60) # Check every 60 seconds
 
+class LeaderExpirationScheduler:
+    """
+    Why this class is necessary:
+    - With several uvicorn workers, the daily job runs once per worker and all copies fight
+      over the same rows; and a daily batch at 01:00 leaves due subscriptions ACTIVE for an hour.
+    What it's doing:
+    - Every worker runs this loop, but only the holder of the `scheduler_leases` row acts.
+      Workers try to take or renew the lease every third of SCHEDULER_LEASE_TTL_SECONDS; if
+      the leader dies, the lease lapses and another worker takes over on its next attempt.
+    - The leader runs the chunked sweep (`expire_subscriptions_bulk_job`) on taking
+      leadership and at every day boundary, which is when subscriptions fall due
+      (`end_date` is a date). It wakes up at midnight for that instead of at 01:00.
+    - Every chunk of the sweep renews the lease in its own transaction (`crud.extend_lease`),
+      so a long sweep keeps the lease, and a leader that lost it rolls the chunk back and
+      stops instead of sweeping alongside the new leader.
+    """
+
+    def __init__(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._swept_on: date | None = None
+        self._stop = threading.Event()
+
+    def _renew_lease(self, db: Session) -> None:
+        was_leader = self.is_leader
+        self.is_leader = try_acquire_lease(db, SCHEDULER_LEASE_NAME, self.holder, SCHEDULER_LEASE_TTL_SECONDS)
+        if self.is_leader and not was_leader:
+            print(f"Scheduler: {self.holder} became the expiration leader.")
+            self._swept_on = None
+        elif was_leader and not self.is_leader:
+            print(f"Scheduler: {self.holder} lost expiration leadership.")
+
+    def _hold_lease(self, db: Session) -> bool:
+        # Fence for each sweep chunk; the chunk's commit also commits the renewal.
+        if self.is_leader and not extend_lease(db, SCHEDULER_LEASE_NAME, self.holder, SCHEDULER_LEASE_TTL_SECONDS):
+            print(f"Scheduler: {self.holder} lost expiration leadership during a sweep; stopping it.")
+            self.is_leader = False
+        return self.is_leader
+
+    def _expire_due(self) -> None:
+        today = date.today()
+        if self._swept_on == today:
+            return
+        if expire_subscriptions_bulk_job(fence=self._hold_lease) and self.is_leader:
+            self._swept_on = today
+
+    def _seconds_until_next_run(self) -> float:
+        renew_in = SCHEDULER_LEASE_TTL_SECONDS / 3
+        if not self.is_leader:
+            return renew_in
+        tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+        return max(0.0, min(renew_in, (tomorrow - datetime.now()).total_seconds()))
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            db: Session = SessionLocal()
+            try:
+                self._renew_lease(db)
+            except Exception as e:
+                print(f"Scheduler: Error in leader expiration loop: {e}")
+                self.is_leader = False
+            finally:
+                db.close()
+            if self.is_leader:
+                self._expire_due()
+            self._stop.wait(self._seconds_until_next_run())
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.is_leader:
+            db: Session = SessionLocal()
+            try:
+                release_lease(db, SCHEDULER_LEASE_NAME, self.holder)
+            except Exception as e:
+                print(f"Scheduler: Error releasing expiration lease: {e}")
+            finally:
+                db.close()
+            self.is_leader = False
+
+leader_scheduler: LeaderExpirationScheduler | None = None
+
 def start_background_scheduler():
     """
     Why this function is necessary:
@@ -66,7 +218,15 @@ def start_background_scheduler():
     - `daemon=True`: Makes the thread a daemon thread, meaning it will exit automatically
       when the main program exits.
     - `scheduler_thread.start()`: Starts the background thread.
+    - With `SCHEDULER_MODE=leader`, starts a `LeaderExpirationScheduler` thread instead.
     """
+    global leader_scheduler
+    if SCHEDULER_MODE == "leader":
+        leader_scheduler = LeaderExpirationScheduler()
+        threading.Thread(target=leader_scheduler.run, daemon=True).start()
+        print(f"Scheduler: Leader-elected expiration scheduler started as {leader_scheduler.holder}.")
+        return
+
     # Schedule the job. For testing, you might want it to run more frequently.
     # e.g., schedule.every(1).minutes.do(expire_subscriptions_job)
     schedule.every().day.at("01:00").do(expire_subscriptions_job) # Run daily at 1 AM
@@ -76,4 +236,12 @@ def start_background_scheduler():
 
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
-    print("Scheduler: Background scheduler thread started.")
\ No newline at end of file
+    print("Scheduler: Background scheduler thread started.")
+
+def stop_background_scheduler():
+    """
+    Why this function is necessary:
+    - On shutdown, a leader hands its lease back so another worker takes over immediately.
+    """
+    if leader_scheduler is not None:
+        leader_scheduler.stop()
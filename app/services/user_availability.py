@@ -0,0 +1,194 @@
+# app/services/user_availability.py
+import hashlib
+import math
+import os
+import threading
+import time
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from ..database import read_session_factory
+from ..models import User
+
+USER_AVAILABILITY_ENABLED = os.getenv("USER_AVAILABILITY_ENABLED", "true").lower() in ("1", "true", "yes")
+# Accounts the filter is sized for (at least twice the accounts found at startup).
+USER_AVAILABILITY_CAPACITY = int(os.getenv("USER_AVAILABILITY_CAPACITY", 1000000))
+USER_AVAILABILITY_ERROR_RATE = float(os.getenv("USER_AVAILABILITY_ERROR_RATE", 0.01))
+# Accounts created by other workers become visible to this worker's filter after at most this long.
+USER_AVAILABILITY_REFRESH_SECONDS = float(os.getenv("USER_AVAILABILITY_REFRESH_SECONDS", 5))
+USER_AVAILABILITY_SCAN_CHUNK_SIZE = int(os.getenv("USER_AVAILABILITY_SCAN_CHUNK_SIZE", 50000))
+
+_MASK64 = (1 << 64) - 1
+# Batches at least this large set their bits with NumPy; smaller ones (signups, most refreshes) in Python.
+_NUMPY_MIN_BATCH = 1000
+
+class BloomFilter:
+    """
+    Why this class is necessary:
+    - Answers "definitely not present" for a string in constant time and about 10 bits per
+      entry (at a 1% error rate), so most availability checks need no query.
+    What it's doing:
+    - `hash_count` bit positions per value by double hashing one 128-bit BLAKE2b digest:
+      `(h1 + i * h2) mod 2**64 mod size`, set in a `bytearray`. `add_many` computes them for
+      a large batch with NumPy, imported on first use, so only a large build loads it.
+    - A value that was added is always reported present; one that was not is reported
+      present with probability about `error_rate` while the filter holds at most `capacity`.
+    - Entries cannot be removed. Adds take a lock; lookups do not.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(value: str) -> bytes:
+        return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+    def _positions(self, value: str) -> list[int]:
+        digest = self._digest(value)
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [((h1 + i * h2) & _MASK64) % self.size for i in range(self.hash_count)]
+
+    def _set_bits(self, value: str) -> None:
+        bits = self._bits
+        for position in self._positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def add(self, value: str) -> None:
+        with self._lock:
+            self._set_bits(value)
+            self.count += 1
+
+    def add_many(self, values: list[str]) -> None:
+        if len(values) < _NUMPY_MIN_BATCH:
+            with self._lock:
+                for value in values:
+                    self._set_bits(value)
+                self.count += len(values)
+            return
+
+        import numpy as np # Imported on first use: only a build over many accounts needs it
+
+        digests = np.frombuffer(b"".join(self._digest(value) for value in values), dtype="<u8").reshape(-1, 2)
+        rounds = np.arange(self.hash_count, dtype=np.uint64)
+        with np.errstate(over="ignore"): # uint64 arithmetic wraps, like the `& _MASK64` in `_positions`
+            positions = (digests[:, :1] + rounds * digests[:, 1:]) % np.uint64(self.size)
+        positions = positions.ravel()
+        with self._lock:
+            np.bitwise_or.at(np.frombuffer(self._bits, dtype=np.uint8), (positions >> np.uint64(3)).astype(np.intp), (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+            self.count += len(values)
+
+    def __contains__(self, value: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+def _username_key(username: str) -> str:
+    # Lower-cased, so the filter over-approximates case-insensitive collations; the DB decides.
+    return "u:" + username.strip().lower()
+
+def _email_key(email: str) -> str:
+    return "e:" + email.strip().lower()
+
+class UserAvailabilityIndex:
+    """
+    Why this class is necessary:
+    - Signup forms check username and email availability on every keystroke; almost all
+      of those values are not registered, and a query per keystroke is wasted work.
+    What it's doing:
+    - Holds a `BloomFilter` over all usernames and emails, built by `build()` with a
+      keyset-paginated scan of `users` (USER_AVAILABILITY_SCAN_CHUNK_SIZE rows at a time).
+    - `add()` is called by the user CRUD functions, so this process sees its own signups at
+      once; `refresh()` adds accounts with a higher id than any seen (other workers'
+      signups) when the last refresh is older than USER_AVAILABILITY_REFRESH_SECONDS.
+    - `might_exist()` is False only for values that are definitely not registered. True
+      means "probably": the caller confirms with the database. Until the first build has
+      finished it is always True.
+    """
+
+    def __init__(self):
+        self._filter: BloomFilter | None = None
+        self._last_user_id = 0
+        self._refreshed_at: float | None = None
+        self._refresh_lock = threading.Lock()
+        self.stats = {"filter_negative": 0, "db_checked": 0, "false_positive": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def _scan(self, db: Session, bloom: BloomFilter, after_id: int) -> tuple[int, int]:
+        """Adds users with id > `after_id` to `bloom` in chunks; returns (rows, last id)."""
+        rows_added = 0
+        while True:
+            rows = db.execute(
+                select(User.id, User.username, User.email).where(User.id > after_id)
+                .order_by(User.id).limit(USER_AVAILABILITY_SCAN_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                return rows_added, after_id
+            bloom.add_many([_username_key(row.username) for row in rows] + [_email_key(row.email) for row in rows])
+            rows_added += len(rows)
+            after_id = rows[-1].id
+
+    def build(self, db: Session) -> None:
+        started = time.perf_counter()
+        user_count = db.execute(select(func.count()).select_from(User)).scalar() or 0
+        bloom = BloomFilter(2 * max(USER_AVAILABILITY_CAPACITY, 2 * user_count), USER_AVAILABILITY_ERROR_RATE) # Two keys per user
+        rows, last_id = self._scan(db, bloom, 0)
+        with self._refresh_lock:
+            self._filter = bloom
+            self._last_user_id = max(self._last_user_id, last_id)
+            self._refreshed_at = time.monotonic()
+        print(f"User availability: Indexed {rows} users in {time.perf_counter() - started:.2f}s ({bloom.size // 8 / 1024 / 1024:.1f} MiB).")
+
+    def needs_refresh(self) -> bool:
+        return self._filter is not None and time.monotonic() - (self._refreshed_at or 0) > USER_AVAILABILITY_REFRESH_SECONDS
+
+    def refresh(self, db: Session) -> None:
+        if self._filter is None or not self._refresh_lock.acquire(blocking=False):
+            return # Not built yet, or another request is refreshing
+        try:
+            _, self._last_user_id = self._scan(db, self._filter, self._last_user_id)
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def add(self, username: str, email: str) -> None:
+        bloom = self._filter
+        if bloom is None:
+            return # The build in progress or the next refresh picks the account up
+        bloom.add_many([_username_key(username), _email_key(email)])
+
+    def might_exist(self, username: str | None = None, email: str | None = None) -> tuple[bool, bool]:
+        """(username probably registered, email probably registered); a value not given is False."""
+        bloom = self._filter
+        if bloom is None:
+            return username is not None, email is not None
+        return (
+            username is not None and _username_key(username) in bloom,
+            email is not None and _email_key(email) in bloom,
+        )
+
+    def record(self, checked_db: bool, false_positives: int = 0) -> None:
+        """Counts one availability check for `user_availability_checks_total`."""
+        self.stats["db_checked" if checked_db else "filter_negative"] += 1
+        self.stats["false_positive"] += false_positives
+
+def _build_in_background() -> None:
+    db: Session = read_session_factory()()
+    try:
+        user_availability.build(db)
+    except Exception as e:
+        print(f"User availability: Build failed, availability checks will query the database: {e}")
+    finally:
+        db.close()
+
+def start_user_availability_build() -> None:
+    """Builds the index on a daemon thread, so startup does not wait for the scan (app startup)."""
+    if USER_AVAILABILITY_ENABLED:
+        threading.Thread(target=_build_in_background, name="user-availability-build", daemon=True).start()
+
+user_availability = UserAvailabilityIndex()
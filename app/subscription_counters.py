@@ -0,0 +1,109 @@
+# app/subscription_counters.py
+import os
+from collections import defaultdict
+from datetime import date
+from sqlalchemy.engine import Dialect
+from . import models
+
+# Each (plan, status) and (day, plan) counter is split over this many rows, chosen by
+# user_id, so concurrent subscription writes rarely wait on the same row. Readers sum the shards.
+ANALYTICS_COUNTER_SHARDS = int(os.getenv("ANALYTICS_COUNTER_SHARDS", 8))
+
+DAILY_COLUMNS = ("new_subscriptions", "cancellations", "expirations")
+
+COUNTER_UPSERT_BACKENDS = ("sqlite", "postgresql", "mysql", "mariadb")
+
+def check_counter_backend(dialect: Dialect) -> None:
+    """
+    Why this function is necessary:
+    - Every subscription write upserts the counters in its transaction, so on a backend
+      without an upsert every one of them would fail; that is a configuration error to
+      report at startup (`bootstrap.ensure_schema`), not per request.
+    What it's doing:
+    - Raises RuntimeError unless the dialect is one of COUNTER_UPSERT_BACKENDS.
+    """
+    if dialect.name not in COUNTER_UPSERT_BACKENDS:
+        raise RuntimeError(
+            f"Database backend '{dialect.name}' is not supported: subscription counters need an upsert "
+            f"(supported: {', '.join(COUNTER_UPSERT_BACKENDS)})."
+        )
+
+def _dialect_insert(dialect: Dialect):
+    check_counter_backend(dialect)
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.mysql import insert
+    return insert
+
+def _increment_statement(dialect: Dialect, model, key_columns: tuple, value_columns: tuple, rows: list[dict]):
+    """One multi-row INSERT that adds `value_columns` to existing rows (upsert), rows sorted by key."""
+    insert = _dialect_insert(dialect)
+    table = model.__table__
+    statement = insert(table).values(sorted(rows, key=lambda row: tuple(str(row[column]) for column in key_columns)))
+    if dialect.name in ("mysql", "mariadb"):
+        return statement.on_duplicate_key_update({column: table.c[column] + statement.inserted[column] for column in value_columns})
+    return statement.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={column: table.c[column] + statement.excluded[column] for column in value_columns}
+    )
+
+def counter_shard(user_id: int) -> int:
+    return user_id % ANALYTICS_COUNTER_SHARDS
+
+class SubscriptionCounterDeltas:
+    """
+    Why this class is necessary:
+    - The analytics counters (`SubscriptionCount`, `SubscriptionDailyCount`) must change in
+      the same transaction as the subscriptions they count, from sync and async sessions alike.
+    What it's doing:
+    - Collects the counter changes of one transaction via `created`, `plan_changed` and
+      `status_changed`, netting them per counter row.
+    - `statements(dialect)` returns at most two upserts (one per table) that apply them;
+      callers execute them on their session before committing.
+    How it's used:
+    - `deltas = SubscriptionCounterDeltas(); deltas.created(user_id, plan_id, today)`, then
+      `for statement in deltas.statements(db.bind.dialect): db.execute(statement)`.
+    """
+
+    def __init__(self):
+        self.counts: dict[tuple, int] = defaultdict(int)
+        self.daily: dict[tuple, dict[str, int]] = defaultdict(lambda: dict.fromkeys(DAILY_COLUMNS, 0))
+
+    def created(self, user_id: int, plan_id: int, day: date) -> None:
+        shard = counter_shard(user_id)
+        self.counts[(plan_id, models.SubscriptionStatusEnum.ACTIVE, shard)] += 1
+        self.daily[(day, plan_id, shard)]["new_subscriptions"] += 1
+
+    def plan_changed(self, user_id: int, old_plan_id: int, new_plan_id: int) -> None:
+        shard = counter_shard(user_id)
+        self.counts[(old_plan_id, models.SubscriptionStatusEnum.ACTIVE, shard)] -= 1
+        self.counts[(new_plan_id, models.SubscriptionStatusEnum.ACTIVE, shard)] += 1
+
+    def status_changed(self, user_id: int, plan_id: int, old_status: models.SubscriptionStatusEnum, new_status: models.SubscriptionStatusEnum, day: date, count: int = 1) -> None:
+        """Moves `count` subscriptions; cancellations and expirations are also counted on `day`."""
+        shard = counter_shard(user_id)
+        self.counts[(plan_id, old_status, shard)] -= count
+        self.counts[(plan_id, new_status, shard)] += count
+        if new_status == models.SubscriptionStatusEnum.CANCELLED:
+            self.daily[(day, plan_id, shard)]["cancellations"] += count
+        elif new_status == models.SubscriptionStatusEnum.EXPIRED:
+            self.daily[(day, plan_id, shard)]["expirations"] += count
+
+    def statements(self, dialect: Dialect) -> list:
+        statements = []
+        counts = [
+            {"plan_id": plan_id, "status": status, "shard": shard, "count": delta}
+            for (plan_id, status, shard), delta in self.counts.items() if delta
+        ]
+        if counts:
+            statements.append(_increment_statement(dialect, models.SubscriptionCount, ("plan_id", "status", "shard"), ("count",), counts))
+        daily = [
+            {"day": day, "plan_id": plan_id, "shard": shard, **columns}
+            for (day, plan_id, shard), columns in self.daily.items() if any(columns.values())
+        ]
+        if daily:
+            statements.append(_increment_statement(dialect, models.SubscriptionDailyCount, ("day", "plan_id", "shard"), DAILY_COLUMNS, daily))
+        return statements
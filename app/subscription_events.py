@@ -0,0 +1,67 @@
+# app/subscription_events.py
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from . import models
+
+SUBSCRIPTION_CREATED = "subscription.created"
+SUBSCRIPTION_PLAN_CHANGED = "subscription.plan_changed"
+SUBSCRIPTION_CANCELLED = "subscription.cancelled"
+SUBSCRIPTION_EXPIRED = "subscription.expired"
+SUBSCRIPTION_STATUS_CHANGED = "subscription.status_changed"
+
+_STATUS_EVENTS = {
+    models.SubscriptionStatusEnum.CANCELLED: SUBSCRIPTION_CANCELLED,
+    models.SubscriptionStatusEnum.EXPIRED: SUBSCRIPTION_EXPIRED,
+}
+
+class SubscriptionEvents:
+    """
+    Why this class is necessary:
+    - Transactional outbox: an event row is written in the same transaction as the
+      subscription change it describes, so consumers see exactly the committed changes.
+    What it's doing:
+    - Collects the lifecycle events of one transaction (`created`, `plan_changed`,
+      `status_changed`); `statements()` returns the INSERT into `subscription_events` with its
+      rows, for the caller to execute on its session before committing.
+    - `app/services/outbox.py` relays the rows to consumers, ordered by id.
+    """
+
+    def __init__(self):
+        self.rows: list[dict] = []
+
+    def _record(self, event_type: str, subscription_id: int, user_id: int, plan_id: int, status: models.SubscriptionStatusEnum, previous_plan_id: int | None = None) -> None:
+        self.rows.append({
+            "event_type": event_type,
+            "subscription_id": subscription_id,
+            "user_id": user_id,
+            "plan_id": plan_id,
+            "previous_plan_id": previous_plan_id,
+            "status": status,
+            "occurred_at": datetime.now(timezone.utc).replace(tzinfo=None),
+        })
+
+    def created(self, subscription_id: int, user_id: int, plan_id: int) -> None:
+        self._record(SUBSCRIPTION_CREATED, subscription_id, user_id, plan_id, models.SubscriptionStatusEnum.ACTIVE)
+
+    def plan_changed(self, subscription_id: int, user_id: int, old_plan_id: int, new_plan_id: int) -> None:
+        self._record(SUBSCRIPTION_PLAN_CHANGED, subscription_id, user_id, new_plan_id, models.SubscriptionStatusEnum.ACTIVE, previous_plan_id=old_plan_id)
+
+    def status_changed(self, subscription_id: int, user_id: int, plan_id: int, new_status: models.SubscriptionStatusEnum) -> None:
+        self._record(_STATUS_EVENTS.get(new_status, SUBSCRIPTION_STATUS_CHANGED), subscription_id, user_id, plan_id, new_status)
+
+    def statements(self) -> list[tuple]:
+        """`[(statement, rows)]` to pass to `execute`; empty when nothing was recorded."""
+        return [(insert(models.SubscriptionEvent), self.rows)] if self.rows else []
+
+def event_to_dict(event) -> dict:
+    """The JSON shape consumers receive (SSE `data`, file sink lines); `id` is the offset."""
+    return {
+        "id": event.id,
+        "type": event.event_type,
+        "subscription_id": event.subscription_id,
+        "user_id": event.user_id,
+        "plan_id": event.plan_id,
+        "previous_plan_id": event.previous_plan_id,
+        "status": event.status.value if hasattr(event.status, "value") else event.status,
+        "occurred_at": event.occurred_at.isoformat() + "Z",
+    }
@@ -0,0 +1,107 @@
+# benchmarks/bench_async_db.py
+"""
+Requests/sec of an authenticated endpoint with the legacy sync DB lookup versus the
+native async path (AsyncSession + app.async_crud), using SQLite/aiosqlite as a stand-in.
+
+The async path also goes through `auth.user_cache` and `auth.token_claims_cache`, which the
+legacy path does not have. Both paths are therefore measured with those caches disabled
+(the sync vs. async comparison) and the async path again with them enabled.
+
+Usage (from the project root):
+    python -m benchmarks.bench_async_db --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+DB_DIR = tempfile.mkdtemp(prefix="bench_async_db_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'bench.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+import httpx
+from fastapi import Depends, HTTPException, status
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+
+from app import auth, crud, models, schemas
+from app.auth import ALGORITHM, SECRET_KEY, create_access_token, oauth2_scheme
+from app.bootstrap import ensure_schema
+from app.database import SessionLocal, async_engine, get_db
+from app.main import app
+
+
+async def legacy_get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+    # The pre-async dependency: `async def` running a blocking query on a sync Session.
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    user = crud.get_user_by_username(db, username=username)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+    return user
+
+
+@app.get("/bench/legacy/users/me/", response_model=schemas.User, include_in_schema=False)
+async def legacy_read_users_me(current_user: models.User = Depends(legacy_get_current_user)):
+    return current_user
+
+
+def seed_user() -> str:
+    ensure_schema()
+    db = SessionLocal()
+    try:
+        if crud.get_user_by_username(db, username="bench") is None:
+            crud.create_user(db, schemas.UserCreate(username="bench", email="bench@example.com", password="benchpassword"))
+    finally:
+        db.close()
+    return create_access_token(data={"sub": "bench"})
+
+
+def set_auth_caches(enabled: bool) -> None:
+    # Zero `maxsize` makes `set` store nothing, so every request decodes the JWT and queries.
+    for cache, maxsize in ((auth.user_cache, auth.USER_CACHE_MAX_ENTRIES), (auth.token_claims_cache, auth.TOKEN_CLAIMS_CACHE_MAX_ENTRIES)):
+        cache.maxsize = maxsize if enabled else 0
+        cache.clear()
+
+
+async def run(path: str, token: str, total: int, concurrency: int) -> float:
+    headers = {"Authorization": f"Bearer {token}"}
+    remaining = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in remaining:
+                response = await client.get(path, headers=headers)
+                response.raise_for_status()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    token = seed_user()
+    results = {}
+    for label, path, caches in (
+        ("before (sync session)", "/bench/legacy/users/me/", False),
+        ("after (async session)", "/users/me/", False),
+        ("after + auth caches", "/users/me/", True),
+    ):
+        set_auth_caches(caches)
+        asyncio.run(run(path, token, min(args.requests, 200), args.concurrency)) # warm-up
+        results[label] = asyncio.run(run(path, token, args.requests, args.concurrency))
+
+    print(f"GET /users/me/ x{args.requests}, concurrency {args.concurrency}, database {os.environ['DATABASE_URL']}")
+    for label, rps in results.items():
+        print(f"  {label:<24} {rps:10.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
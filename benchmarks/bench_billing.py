@@ -0,0 +1,85 @@
+# benchmarks/bench_billing.py
+"""
+Times a billing run (`app.services.billing`) over a synthetic subscriptions table.
+
+Seeds `--subscriptions` ACTIVE subscriptions (raw executemany INSERTs; users are not
+created, SQLite does not enforce the foreign key) with end dates spread over the billing
+period, and `--plan-changes` unbilled plan changes, then runs the period as a dry run
+(default) or for real.
+
+Usage (from the project root):
+    python -m benchmarks.bench_billing --subscriptions 5000000 --database billing.db
+    python -m benchmarks.bench_billing --database billing.db --no-seed --chunk-size 200000
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import configure_environment
+
+PERIOD_START = date(2030, 1, 1)
+PERIOD_END = date(2030, 2, 1)
+
+
+def seed(subscriptions: int, plan_changes: int, chunk_size: int = 50000, rng_seed: int = 42) -> float:
+    from sqlalchemy import insert
+    from app import models
+    from app.bootstrap import INITIAL_PLANS, ensure_schema
+    from app.database import engine
+
+    ensure_schema("create")
+    rng = random.Random(rng_seed)
+    period_days = (PERIOD_END - PERIOD_START).days
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(models.Plan), [{"id": i + 1, **plan.model_dump()} for i, plan in enumerate(INITIAL_PLANS)])
+    active = models.SubscriptionStatusEnum.ACTIVE
+    for first in range(1, subscriptions + 1, chunk_size):
+        rows = []
+        for i in range(first, min(first + chunk_size, subscriptions + 1)):
+            end = PERIOD_START + timedelta(days=rng.randrange(period_days))
+            rows.append({
+                "id": i, "user_id": i, "plan_id": rng.randint(1, len(INITIAL_PLANS)),
+                "start_date": end - timedelta(days=30), "end_date": end, "status": active,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(models.Subscription), rows)
+    with engine.begin() as conn:
+        changes = []
+        for i in range(plan_changes):
+            changed_on = PERIOD_START + timedelta(days=rng.randrange(period_days))
+            changes.append({
+                "subscription_id": rng.randint(1, subscriptions), "old_plan_id": rng.randint(1, len(INITIAL_PLANS)),
+                "new_plan_id": rng.randint(1, len(INITIAL_PLANS)), "changed_on": changed_on,
+                "old_end_date": changed_on + timedelta(days=rng.randrange(31)),
+            })
+        if changes:
+            conn.execute(insert(models.SubscriptionPlanChange), changes)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLite file (default: a temporary file)")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse an already seeded --database")
+    parser.add_argument("--subscriptions", type=int, default=1000000)
+    parser.add_argument("--plan-changes", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--write", action="store_true", help="Run for real instead of a dry run")
+    args = parser.parse_args()
+
+    configure_environment(args.database)
+    if not args.no_seed:
+        seconds = seed(args.subscriptions, args.plan_changes)
+        print(f"Seeded {args.subscriptions} subscriptions and {args.plan_changes} plan changes in {seconds:.1f}s")
+
+    from app.services.billing import run_billing
+
+    summary = run_billing(PERIOD_START, PERIOD_END, dry_run=not args.write, chunk_size=args.chunk_size)
+    rows = summary["subscriptions_renewed"] + summary["plan_changes"]
+    print(f"{'Dry run' if not args.write else 'Run'}: {rows} rows in {summary['seconds']:.1f}s ({rows / max(summary['seconds'], 1e-9):,.0f} rows/s), net {summary['net_amount']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
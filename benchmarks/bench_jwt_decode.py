@@ -0,0 +1,52 @@
+# benchmarks/bench_jwt_decode.py
+"""
+Microbenchmark of token verification: `jose.jwt.decode` on every call versus
+`app.auth.decode_access_token` with its claims cache (hit), plus the cost of a cache miss
+(a token seen for the first time: digest + decode + insert).
+
+Usage (from the project root):
+    python -m benchmarks.bench_jwt_decode --iterations 20000
+"""
+import argparse
+import time
+
+from benchmarks.common import configure_environment
+
+configure_environment()
+
+from jose import jwt
+
+from app import auth
+
+
+def per_call_microseconds(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = auth.create_access_token(data={"sub": "bench"})
+    auth.decode_access_token(token) # warm the cache and the lazy imports
+
+    uncached = per_call_microseconds(lambda: jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]), args.iterations)
+    cached = per_call_microseconds(lambda: auth.decode_access_token(token), args.iterations)
+
+    miss_iterations = min(args.iterations, auth.TOKEN_CLAIMS_CACHE_MAX_ENTRIES or args.iterations)
+    fresh_tokens = iter([auth.create_access_token(data={"sub": f"bench{i}"}) for i in range(miss_iterations)])
+    auth.token_claims_cache.clear()
+    miss = per_call_microseconds(lambda: auth.decode_access_token(next(fresh_tokens)), miss_iterations)
+
+    print(f"Token verification, {args.iterations} iterations ({auth.ALGORITHM}):")
+    print(f"  jwt.decode every call         {uncached:8.2f} us/call")
+    print(f"  decode_access_token, hit      {cached:8.2f} us/call  ({uncached / cached:.1f}x faster)")
+    print(f"  decode_access_token, miss     {miss:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_startup.py
+"""
+Measures worker cold start: interpreter + `import app.main`, then the startup hook.
+
+Every run is a fresh subprocess (like a new uvicorn/gunicorn worker) against the same
+SQLite file, once per SCHEMA_STARTUP_MODE, so the "create" (create_all on every boot) and
+"fingerprint" (one SELECT when the schema is unchanged) modes can be compared.
+`--simulated-rtt-ms` adds a sleep per SQL statement to mimic a remote database.
+
+Usage (from the project root):
+    python -m benchmarks.bench_startup --runs 10 --simulated-rtt-ms 2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import configure_environment
+
+CHILD = """
+import asyncio, json, os, time
+started = time.perf_counter()
+import app.main as main
+imported = time.perf_counter()
+from sqlalchemy import event
+statements = [0]
+rtt = float(os.environ["BENCH_SIMULATED_RTT_MS"]) / 1000
+@event.listens_for(main.engine, "before_cursor_execute")
+def simulate_round_trip(*args):
+    statements[0] += 1
+    time.sleep(rtt)
+asyncio.run(main.startup_event())
+booted = time.perf_counter()
+print("BOOT " + json.dumps({"import": imported - started, "startup": booted - imported, "statements": statements[0]}))
+"""
+
+def run_child(env: dict) -> dict:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - started
+    line = next(line for line in output.splitlines() if line.startswith("BOOT "))
+    timings = json.loads(line[len("BOOT "):])
+    timings["process"] = total
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLite file (default: temporary file)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--simulated-rtt-ms", type=float, default=0.0, help="Sleep per SQL statement during startup")
+    parser.add_argument("--modes", nargs="+", default=["create", "fingerprint"], choices=["create", "fingerprint", "skip"])
+    args = parser.parse_args()
+
+    configure_environment(args.database)
+    env = dict(os.environ, PYTHONPATH=os.getcwd(), BENCH_SIMULATED_RTT_MS=str(args.simulated_rtt_ms))
+    run_child(dict(env, SCHEMA_STARTUP_MODE="create")) # Creates and seeds the database once
+
+    print(f"{'mode':<12} {'process ms':>11} {'import ms':>10} {'startup ms':>11} {'statements':>11}  (median of {args.runs} runs)")
+    for mode in args.modes:
+        runs = [run_child(dict(env, SCHEMA_STARTUP_MODE=mode)) for _ in range(args.runs)]
+        medians = {key: statistics.median(run[key] for run in runs) * 1000 for key in ("process", "import", "startup")}
+        statements = statistics.median(run["statements"] for run in runs)
+        print(f"{mode:<12} {medians['process']:>11.1f} {medians['import']:>10.1f} {medians['startup']:>11.1f} {statements:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+# benchmarks/common.py
+"""
+Shared setup for the benchmarks. `configure_environment` must run before anything from
+`app` is imported, because `app.database` creates its engines at import time.
+"""
+import os
+import tempfile
+
+BENCH_PASSWORD = "benchpassword"
+
+
+def configure_environment(database_path: str | None = None) -> str:
+    """Points DATABASE_URL at a SQLite file (a temporary one by default) and returns the URL."""
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(prefix="subscription_bench_"), "bench.db")
+    url = f"sqlite:///{os.path.abspath(database_path)}"
+    os.environ["DATABASE_URL"] = url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["EXPOSE_DB_STATEMENT_COUNT"] = "true"
+    os.environ.setdefault("SCHEDULER_MODE", "daily")
+    # All bench clients share one address; the per-IP limits would measure rate limiting, not the app.
+    os.environ.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+    return url
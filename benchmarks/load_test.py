@@ -0,0 +1,190 @@
+# benchmarks/load_test.py
+"""
+Reproducible in-process load test of the API against a seeded SQLite stand-in.
+
+Drives POST /token, GET /users/me/, GET /plans/ and the GET/PUT/DELETE/POST
+/subscriptions/ flow with `--concurrency` virtual clients (each logged in as its own
+seeded user). Reports p50/p95/p99 latency, throughput and DB statements per request
+(from the X-DB-Statements header) for every endpoint, writes them as JSON, and can
+compare against a saved baseline.
+
+Usage (from the project root):
+    python -m benchmarks.load_test --users 100000 --requests 2000 --concurrency 32 \
+        --output benchmarks/results/baseline.json
+    python -m benchmarks.load_test ... --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+from benchmarks.common import BENCH_PASSWORD, configure_environment
+
+SCENARIOS = ("token", "users_me", "plans", "subscription_flow")
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client, name: str, method: str, url: str, expected: int, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        if response.status_code != expected:
+            self.errors[name][response.status_code] += 1
+        if "x-db-statements" in response.headers:
+            self.statements[name].append(int(response.headers["x-db-statements"]))
+        return response
+
+    def summary(self, elapsed: dict[str, float]) -> dict:
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            scenario_seconds = elapsed[name.split(" ")[0]]
+            endpoints[name] = {
+                "requests": len(values),
+                "errors": sum(self.errors[name].values()),
+                "error_statuses": {str(code): count for code, count in sorted(self.errors[name].items())},
+                "p50_ms": round(percentile(values, 0.50), 3),
+                "p95_ms": round(percentile(values, 0.95), 3),
+                "p99_ms": round(percentile(values, 0.99), 3),
+                "mean_ms": round(statistics.fmean(values), 3),
+                "throughput_rps": round(len(values) / scenario_seconds, 1) if scenario_seconds else 0.0,
+                "db_statements_per_request": round(statistics.fmean(self.statements[name]), 2) if self.statements[name] else None,
+            }
+        return endpoints
+
+
+async def run_scenario(app, scenario: str, tokens: list[str], total: int, concurrency: int, recorder: Recorder) -> float:
+    import httpx
+
+    remaining = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def client_loop(worker: int):
+            user_id = worker + 1
+            headers = {"Authorization": f"Bearer {tokens[worker]}"}
+            for _ in remaining:
+                if scenario == "token":
+                    await recorder.request(client, "token POST /token", "POST", "/token", 200,
+                                           data={"username": f"user{user_id}", "password": BENCH_PASSWORD})
+                elif scenario == "users_me":
+                    await recorder.request(client, "users_me GET /users/me/", "GET", "/users/me/", 200, headers=headers)
+                elif scenario == "plans":
+                    await recorder.request(client, "plans GET /plans/", "GET", "/plans/", 200)
+                else:
+                    current = await recorder.request(client, "subscription_flow GET /subscriptions/me/", "GET", "/subscriptions/me/", 200, headers=headers)
+                    plan_toggle = 3 if current.json().get("plan_id") == 2 else 2
+                    await recorder.request(client, "subscription_flow PUT /subscriptions/me/", "PUT", "/subscriptions/me/", 200,
+                                           headers=headers, json={"new_plan_id": plan_toggle})
+                    await recorder.request(client, "subscription_flow DELETE /subscriptions/me/", "DELETE", "/subscriptions/me/", 204, headers=headers)
+                    await recorder.request(client, "subscription_flow POST /subscriptions/", "POST", "/subscriptions/", 201,
+                                           headers=headers, json={"plan_id": plan_toggle})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(worker) for worker in range(concurrency)))
+        return time.perf_counter() - started
+
+
+async def run_all(args) -> dict:
+    from app.auth import create_access_token, shutdown_password_hash_executor
+    from app.database import async_engine
+    from app.main import app
+
+    tokens = [create_access_token(data={"sub": f"user{i + 1}"}) for i in range(args.concurrency)]
+    recorder = Recorder()
+    elapsed = {}
+    try:
+        for scenario in args.scenarios:
+            total = args.token_requests if scenario == "token" else args.requests
+            await run_scenario(app, scenario, tokens, min(total, args.concurrency * 2), args.concurrency, Recorder()) # warm-up
+            elapsed[scenario] = await run_scenario(app, scenario, tokens, total, args.concurrency, recorder)
+    finally:
+        await async_engine.dispose()
+        shutdown_password_hash_executor()
+    return recorder.summary(elapsed)
+
+
+def compare(current: dict, baseline: dict) -> None:
+    print(f"\nComparison with baseline from {baseline['meta']['timestamp']}:")
+    print(f"{'endpoint':<48} {'p50 Δ%':>8} {'p95 Δ%':>8} {'p99 Δ%':>8} {'rps Δ%':>8}")
+    for name, stats in current["endpoints"].items():
+        base = baseline["endpoints"].get(name)
+        if not base:
+            continue
+        deltas = [
+            (stats[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+        ]
+        print(f"{name:<48} " + " ".join(f"{delta:>+8.1f}" for delta in deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLite file; seeded unless --no-seed (default: temporary file)")
+    parser.add_argument("--no-seed", action="store_true", help="Reuse an already seeded --database")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests (or flow iterations) per scenario")
+    parser.add_argument("--token-requests", type=int, default=100, help="Requests for the bcrypt-bound token scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    args = parser.parse_args()
+    if args.concurrency > args.users:
+        parser.error("--concurrency cannot exceed --users (each client needs its own user)")
+
+    url = configure_environment(args.database)
+    seed_stats = None
+    if not args.no_seed:
+        from benchmarks.seed import seed
+        seed_stats = seed(args.users, args.history)
+
+    endpoints = asyncio.run(run_all(args))
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "packages": {name: version(name) for name in ("fastapi", "starlette", "sqlalchemy", "pydantic", "aiosqlite")},
+            "database": url,
+            "seed": seed_stats,
+            "concurrency": args.concurrency,
+        },
+        "endpoints": endpoints,
+    }
+
+    print(f"{'endpoint':<48} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rps':>8} {'stmts':>6}")
+    for name, stats in endpoints.items():
+        print(f"{name:<48} {stats['requests']:>6} {stats['errors']:>4} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['throughput_rps']:>8.1f} {stats['db_statements_per_request'] or 0:>6.2f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
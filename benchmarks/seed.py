@@ -0,0 +1,96 @@
+# benchmarks/seed.py
+"""
+Bulk-seeds synthetic users, plans and subscriptions for benchmarks.
+
+Uses Core executemany INSERTs in chunks and one precomputed bcrypt hash (every user's
+password is `benchmarks.common.BENCH_PASSWORD`), so millions of rows take seconds, not hours.
+Every user gets `history` EXPIRED/CANCELLED subscriptions plus one ACTIVE subscription.
+
+Usage (from the project root):
+    python -m benchmarks.seed --database bench.db --users 1000000 --history 2
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import BENCH_PASSWORD, configure_environment
+
+PLANS = [
+    ("Free Trial", 0.00, "Limited access, 7 days", 7),
+    ("Basic", 9.99, "Access to basic features, monthly", 30),
+    ("Premium", 19.99, "Access to all features, priority support, monthly", 30),
+    ("Pro Yearly", 199.99, "All premium features, yearly discount", 365),
+]
+
+
+def seed(users: int, history: int, chunk_size: int = 10000, rng_seed: int = 42) -> dict:
+    from sqlalchemy import insert
+    from app import models
+    from app.auth import get_password_hash
+    from app.database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(rng_seed)
+    hashed_password = get_password_hash(BENCH_PASSWORD)
+    today = date.today()
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.Plan), [
+            {"id": i + 1, "name": name, "price": price, "features": features, "duration_days": days}
+            for i, (name, price, features, days) in enumerate(PLANS)
+        ])
+
+    subscription_id = 0
+    for first in range(1, users + 1, chunk_size):
+        user_ids = range(first, min(first + chunk_size, users + 1))
+        user_rows = [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": hashed_password}
+            for i in user_ids
+        ]
+        subscription_rows = []
+        for i in user_ids:
+            for past in range(history):
+                start = today - timedelta(days=rng.randint(60, 1000))
+                subscription_id += 1
+                subscription_rows.append({
+                    "id": subscription_id, "user_id": i, "plan_id": rng.randint(1, len(PLANS)),
+                    "start_date": start, "end_date": start + timedelta(days=30),
+                    "status": rng.choice([models.SubscriptionStatusEnum.EXPIRED, models.SubscriptionStatusEnum.CANCELLED]),
+                })
+            plan_index = rng.randint(1, len(PLANS))
+            start = today - timedelta(days=rng.randint(0, 6))
+            subscription_id += 1
+            subscription_rows.append({
+                "id": subscription_id, "user_id": i, "plan_id": plan_index,
+                "start_date": start, "end_date": start + timedelta(days=PLANS[plan_index - 1][3]),
+                "status": models.SubscriptionStatusEnum.ACTIVE,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(models.User), user_rows)
+            conn.execute(insert(models.Subscription), subscription_rows)
+
+    return {
+        "users": users,
+        "plans": len(PLANS),
+        "subscriptions": subscription_id,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLite file to create (default: a temporary file)")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=2, help="Past subscriptions per user")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    url = configure_environment(args.database)
+    stats = seed(args.users, args.history, args.chunk_size)
+    print(f"Seeded {url}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# tests/conftest.py
+import itertools
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so they are set before `app` is imported.
+_DB_DIR = tempfile.mkdtemp(prefix="subscription_tests_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ.pop("DATABASE_REPLICA_URLS", None)
+os.environ["EXPOSE_DB_STATEMENT_COUNT"] = "true"
+os.environ["ADMISSION_CONTROL_ENABLED"] = "false" # Tests register and log in faster than the rate limits allow
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+_user_numbers = itertools.count(1)
+
+@pytest.fixture(scope="session")
+def client():
+    from app.main import app
+    with TestClient(app) as test_client: # Runs startup: schema, plan seeding, plan catalog
+        yield test_client
+
+@pytest.fixture
+def auth_headers(client):
+    """Headers of a newly registered user, so each test starts without a subscription."""
+    username = f"tester{next(_user_numbers)}"
+    response = client.post("/users/", json={"username": username, "email": f"{username}@example.com", "password": "password123"})
+    assert response.status_code == 201, response.text
+    token = client.post("/token", data={"username": username, "password": "password123"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
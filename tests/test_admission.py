@@ -0,0 +1,88 @@
+# tests/test_admission.py
+"""
+`AdmissionControlMiddleware`: 503 at the per-route concurrency limit, 429 for empty IP and
+username buckets, both with `Retry-After` and a `{"detail": ...}` body.
+"""
+import asyncio
+import json
+
+from app.admission import AdmissionControlMiddleware, RouteLimits
+
+def request_scope(ip="10.0.0.1", method="POST", path="/token", headers=()):
+    return {"type": "http", "method": method, "path": path, "client": (ip, 50000), "headers": list(headers)}
+
+async def call(middleware, scope, body=b""):
+    """Runs one request through `middleware`; returns (status, headers, body)."""
+    messages = iter([{"type": "http.request", "body": body, "more_body": False}])
+
+    async def receive():
+        return next(messages, {"type": "http.disconnect"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), b"".join(message.get("body", b"") for message in sent[1:])
+
+async def ok_app(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+def test_ip_bucket_rejects_with_retry_after():
+    middleware = AdmissionControlMiddleware(ok_app, limits={"POST /token": RouteLimits(ip_rate=0.5, ip_burst=2)}, enabled=True)
+
+    async def run():
+        return [await call(middleware, request_scope()) for _ in range(3)] + [await call(middleware, request_scope(ip="10.0.0.2"))]
+
+    first, second, third, other_ip = asyncio.run(run())
+    assert first[0] == second[0] == other_ip[0] == 200
+    status, headers, body = third
+    assert status == 429
+    assert headers[b"retry-after"] == b"2" # One token at 0.5/s
+    assert json.loads(body) == {"detail": "Too many requests from this address."}
+
+def test_username_bucket_rejects_with_retry_after():
+    middleware = AdmissionControlMiddleware(ok_app, limits={"POST /token": RouteLimits(user_rate=0.1, user_burst=1)}, enabled=True)
+    body = b"username=Alice&password=secret"
+    headers = [(b"content-type", b"application/x-www-form-urlencoded"), (b"content-length", str(len(body)).encode())]
+
+    async def run():
+        return [await call(middleware, request_scope(ip=ip, headers=headers), body) for ip in ("10.0.0.1", "10.0.0.2")]
+
+    first, second = asyncio.run(run())
+    assert first == (200, {}, b"ok") # The app still receives the body
+    assert second[0] == 429
+    assert second[1][b"retry-after"] == b"10"
+    assert json.loads(second[2]) == {"detail": "Too many requests for this username."}
+
+def test_concurrency_limit_rejects_with_503_and_releases_slots():
+    async def run():
+        done = asyncio.Event()
+
+        async def slow_app(scope, receive, send):
+            if scope["method"] == "POST":
+                await done.wait()
+            await ok_app(scope, receive, send)
+
+        middleware = AdmissionControlMiddleware(slow_app, limits={"POST /token": RouteLimits(concurrency=2, retry_after=3)}, enabled=True)
+        in_progress = [asyncio.create_task(call(middleware, request_scope())) for _ in range(2)]
+        await asyncio.sleep(0) # Both take a slot
+        rejected = await call(middleware, request_scope())
+        unlimited = await call(middleware, request_scope(method="GET", path="/plans/")) # Not a limited route
+        done.set()
+        admitted = await asyncio.gather(*in_progress)
+        after = await call(middleware, request_scope())
+        return rejected, unlimited, admitted, after, middleware.routes["POST /token"].in_flight
+
+    rejected, unlimited, admitted, after, in_flight = asyncio.run(run())
+    status, headers, body = rejected
+    assert status == 503
+    assert headers[b"retry-after"] == b"3"
+    assert json.loads(body) == {"detail": "Server is busy, please retry shortly."}
+    assert unlimited[0] == 200
+    assert [response[0] for response in admitted] == [200, 200]
+    assert after[0] == 200
+    assert in_flight == 0
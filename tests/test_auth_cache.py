@@ -0,0 +1,20 @@
+# tests/test_auth_cache.py
+"""
+Cached tokens (`auth.user_cache`, `auth.token_claims_cache`) are only valid for the
+SECRET_KEY that verified them.
+"""
+from app import auth
+
+def test_cached_user_rejected_after_secret_changes(client, auth_headers, monkeypatch):
+    assert client.get("/users/me/", headers=auth_headers).status_code == 200
+    assert client.get("/users/me/", headers=auth_headers).headers["X-DB-Statements"] == "0" # Served from user_cache
+
+    monkeypatch.setattr(auth, "SECRET_KEY", "a-different-secret") # Reassigned without rotate_secret_key
+    assert client.get("/users/me/", headers=auth_headers).status_code == 401
+
+def test_rotate_secret_key_rejects_old_tokens(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(auth, "SECRET_KEY", auth.SECRET_KEY) # Restored after the test
+    assert client.get("/users/me/", headers=auth_headers).status_code == 200
+
+    auth.rotate_secret_key("another-secret")
+    assert client.get("/users/me/", headers=auth_headers).status_code == 401
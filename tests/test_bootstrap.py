@@ -0,0 +1,16 @@
+# tests/test_bootstrap.py
+"""Startup refuses database backends that subscription writes cannot run on."""
+from types import SimpleNamespace
+
+import pytest
+
+from app import bootstrap
+
+@pytest.mark.parametrize("mode", ["skip", "fingerprint", "create"])
+def test_unsupported_backend_rejected_at_startup(mode):
+    bind = SimpleNamespace(dialect=SimpleNamespace(name="oracle"))
+    with pytest.raises(RuntimeError, match="oracle"):
+        bootstrap.ensure_schema(mode=mode, bind=bind)
+
+def test_supported_backend_starts(client):
+    assert bootstrap.ensure_schema(mode="skip") is False
@@ -0,0 +1,79 @@
+# tests/test_expiration.py
+"""
+The bulk expiration job (the default `EXPIRATION_MODE`) expires the same subscriptions and
+writes the same analytics counters and outbox events as the original per-row job.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.services import scheduler
+
+def seed(session_factory):
+    """Users with subscriptions due yesterday, today and tomorrow, and a cancelled one past its end."""
+    today = date.today()
+    db = session_factory()
+    db.add_all([
+        models.Plan(id=1, name="Basic", price=10.0, duration_days=30),
+        models.Plan(id=2, name="Pro", price=25.0, duration_days=30),
+    ])
+    statuses = [
+        (models.SubscriptionStatusEnum.ACTIVE, -3),
+        (models.SubscriptionStatusEnum.ACTIVE, -1),
+        (models.SubscriptionStatusEnum.ACTIVE, 0),
+        (models.SubscriptionStatusEnum.ACTIVE, 1),
+        (models.SubscriptionStatusEnum.CANCELLED, -2),
+    ]
+    for user_id in range(1, 8):
+        db.add(models.User(id=user_id, username=f"user{user_id}", email=f"user{user_id}@example.com", hashed_password="x"))
+        status, days = statuses[user_id % len(statuses)]
+        db.add(models.Subscription(
+            user_id=user_id,
+            plan_id=1 + user_id % 2,
+            start_date=today - timedelta(days=30),
+            end_date=today + timedelta(days=days),
+            status=status
+        ))
+    db.commit()
+    db.close()
+
+def snapshot(session_factory):
+    db = session_factory()
+    try:
+        return {
+            "subscriptions": sorted((s.id, s.status) for s in db.query(models.Subscription)),
+            "counts": sorted((c.plan_id, c.status.value, c.shard, c.count) for c in db.query(models.SubscriptionCount)),
+            "daily_counts": sorted(
+                (c.day, c.plan_id, c.shard, c.new_subscriptions, c.cancellations, c.expirations)
+                for c in db.query(models.SubscriptionDailyCount)
+            ),
+            "events": sorted(
+                (e.subscription_id, e.event_type, e.user_id, e.plan_id, e.previous_plan_id, e.status)
+                for e in db.query(models.SubscriptionEvent)
+            ),
+        }
+    finally:
+        db.close()
+
+def run_job(tmp_path, monkeypatch, name, job):
+    engine = create_engine(f"sqlite:///{tmp_path / name}.db")
+    models.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    seed(session_factory)
+    monkeypatch.setattr(scheduler, "SessionLocal", session_factory)
+    job()
+    result = snapshot(session_factory)
+    engine.dispose()
+    return result
+
+def test_bulk_job_matches_per_row_job(tmp_path, monkeypatch):
+    per_row = run_job(tmp_path, monkeypatch, "per_row", scheduler.expire_subscriptions_per_row_job)
+    bulk = run_job(tmp_path, monkeypatch, "bulk", lambda: scheduler.expire_subscriptions_bulk_job(chunk_size=2))
+
+    assert bulk == per_row
+    expired = [sub_id for sub_id, status in per_row["subscriptions"] if status == models.SubscriptionStatusEnum.EXPIRED]
+    assert len(expired) == 5 # Due three days ago, yesterday or today; not tomorrow or the cancelled one
+    assert [event[0] for event in per_row["events"]] == expired
+    assert all(event[1] == "subscription.expired" for event in per_row["events"])
@@ -0,0 +1,81 @@
+# tests/test_idempotency.py
+"""
+`IdempotencyMiddleware`: replayed responses, key reuse with a different body, concurrent
+duplicates, and the request body handed to the app.
+"""
+import asyncio
+import itertools
+
+from app.idempotency import IdempotencyMiddleware, MemoryIdempotencyStore
+
+_keys = itertools.count(1)
+
+def test_retry_is_replayed(client):
+    key = f"signup-{next(_keys)}"
+    user = {"username": f"idempotent{key}", "email": f"idempotent.{key}@example.com", "password": "password123"}
+    first = client.post("/users/", json=user, headers={"Idempotency-Key": key})
+    retry = client.post("/users/", json=user, headers={"Idempotency-Key": key})
+    assert first.status_code == retry.status_code == 201 # Not "already registered": the handler did not run again
+    assert retry.content == first.content
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+def test_key_reused_with_different_body(client):
+    key = f"signup-{next(_keys)}"
+    user = {"username": f"idempotent{key}", "email": f"idempotent.{key}@example.com", "password": "password123"}
+    assert client.post("/users/", json=user, headers={"Idempotency-Key": key}).status_code == 201
+    response = client.post("/users/", json={**user, "username": f"other{key}"}, headers={"Idempotency-Key": key})
+    assert response.status_code == 422
+
+def request_scope():
+    return {"type": "http", "method": "POST", "path": "/subscriptions/",
+            "headers": [(b"idempotency-key", b"k"), (b"authorization", b"Bearer t")]}
+
+async def call(middleware, body=b'{"plan_id": 2}'):
+    """Runs one request through `middleware`; returns (status, headers, body)."""
+    messages = iter([{"type": "http.request", "body": body, "more_body": False}])
+
+    async def receive():
+        return next(messages, {"type": "http.disconnect"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware(request_scope(), receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), b"".join(message.get("body", b"") for message in sent[1:])
+
+def test_concurrent_duplicates_share_one_response():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(await receive())
+        await asyncio.sleep(0.05) # Still in flight when the duplicate arrives
+        await send({"type": "http.response.start", "status": 201, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"id": %d}' % len(calls)})
+
+    async def run():
+        middleware = IdempotencyMiddleware(app, store=MemoryIdempotencyStore())
+        return await asyncio.gather(call(middleware), call(middleware))
+
+    first, duplicate = asyncio.run(run())
+    assert len(calls) == 1
+    assert first[0] == duplicate[0] == 201
+    assert first[2] == duplicate[2] == b'{"id": 1}'
+    assert duplicate[1][b"idempotent-replayed"] == b"true"
+
+def test_app_sees_body_once_then_disconnect():
+    received = []
+
+    async def app(scope, receive, send):
+        received.append(await receive())
+        received.append(await receive()) # E.g. a streaming response waiting for the disconnect
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    asyncio.run(call(IdempotencyMiddleware(app, store=MemoryIdempotencyStore())))
+    assert received == [
+        {"type": "http.request", "body": b'{"plan_id": 2}', "more_body": False},
+        {"type": "http.disconnect"},
+    ]
@@ -0,0 +1,36 @@
+# tests/test_metrics.py
+"""`render_metrics` output: every sample belongs to the family named on its TYPE line (format 0.0.4)."""
+from app.metrics import CallbackMetric, Counter, Gauge, Histogram, _registry, render_metrics
+
+def families(text: str) -> dict:
+    """{family: (type, [sample names])} from a text-format exposition."""
+    result, current = {}, None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            current, metric_type = line.split()[2:4]
+            result[current] = (metric_type, [])
+        elif line and not line.startswith("#"):
+            result[current][1].append(line.split("{")[0].split(" ")[0])
+    return result
+
+def test_counter_type_line_matches_total_samples():
+    counter = Counter("test_widgets", "Widgets made.", ("kind",))
+    callback = CallbackMetric("test_callback_widgets", "Widgets counted elsewhere.", ("kind",), lambda: {("a",): 2}, type="counter")
+    gauge = Gauge("test_widgets_in_flight", "Widgets in flight.")
+    histogram = Histogram("test_widget_seconds", "Widget time.", buckets=(1.0,))
+    try:
+        counter.inc("a")
+        gauge.set(value=1)
+        histogram.observe(0.5)
+        text = render_metrics()
+        assert "# HELP test_widgets_total Widgets made." in text
+        found = families(text)
+        assert found["test_widgets_total"] == ("counter", ["test_widgets_total"])
+        assert found["test_callback_widgets_total"] == ("counter", ["test_callback_widgets_total"])
+        assert found["test_widgets_in_flight"] == ("gauge", ["test_widgets_in_flight"])
+        assert found["test_widget_seconds"] == ("histogram", ["test_widget_seconds_bucket", "test_widget_seconds_bucket", "test_widget_seconds_sum", "test_widget_seconds_count"])
+        for family, (metric_type, samples) in found.items():
+            assert all(sample.startswith(family) for sample in samples), family
+    finally:
+        for metric in (counter, callback, gauge, histogram):
+            _registry.remove(metric)
@@ -0,0 +1,70 @@
+# tests/test_outbox.py
+"""
+SSE clients that resume from an offset older than the broker's buffer (`EventBroker.floor`)
+get the missing events replayed from the outbox table, then the buffered ones, in order.
+"""
+import asyncio
+
+from app import models
+from app.database import SessionLocal
+from app.services import outbox
+from app.subscription_events import event_to_dict
+
+class ConnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return False
+
+def stored_events_after(after_id):
+    db = SessionLocal()
+    try:
+        return db.query(models.SubscriptionEvent).filter(models.SubscriptionEvent.id > after_id).order_by(models.SubscriptionEvent.id).all()
+    finally:
+        db.close()
+
+def latest_event_id():
+    events = stored_events_after(0)
+    return events[-1].id if events else 0
+
+async def stream_ids(after_id, until_id):
+    """Event ids sent to a client resuming after `after_id`, until `until_id` arrives."""
+    ids = []
+    stream = outbox.stream_subscription_events(ConnectedRequest(), after_id)
+    try:
+        async for chunk in stream:
+            ids.extend(int(line[4:]) for line in chunk.decode().splitlines() if line.startswith("id: "))
+            if ids and ids[-1] >= until_id:
+                return ids
+    finally:
+        await stream.aclose()
+
+def test_resume_behind_buffer_replays_from_table(client, auth_headers, monkeypatch):
+    last_event_id = latest_event_id() # The client's Last-Event-ID
+    client.post("/subscriptions/", json={"plan_id": 2}, headers=auth_headers)
+    client.put("/subscriptions/me/", json={"new_plan_id": 3}, headers=auth_headers)
+    client.delete("/subscriptions/me/", headers=auth_headers)
+    events = [event_to_dict(event) for event in stored_events_after(last_event_id)]
+    assert len(events) == 3
+
+    async def run():
+        broker = outbox.EventBroker(size=1) # Only the newest event is buffered
+        monkeypatch.setattr(outbox, "event_broker", broker)
+        await broker.start_at(last_event_id)
+        await broker.publish(events)
+        assert broker.events_after(last_event_id) is None # Behind the buffer
+        return await stream_ids(last_event_id, events[-1]["id"])
+
+    assert asyncio.run(run()) == [event["id"] for event in events]
+
+def test_resume_within_buffer(client, auth_headers, monkeypatch):
+    last_event_id = latest_event_id()
+    client.post("/subscriptions/", json={"plan_id": 2}, headers=auth_headers)
+    events = [event_to_dict(event) for event in stored_events_after(last_event_id)]
+
+    async def run():
+        broker = outbox.EventBroker(size=10)
+        monkeypatch.setattr(outbox, "event_broker", broker)
+        await broker.start_at(last_event_id)
+        await broker.publish(events)
+        return await stream_ids(last_event_id, events[-1]["id"])
+
+    assert asyncio.run(run()) == [event["id"] for event in events]
@@ -0,0 +1,44 @@
+# tests/test_plan_catalog.py
+"""The `GET /plans/` ETag depends on the plans only: equal across workers and reloads."""
+from app.database import SessionLocal
+from app.services.plan_catalog import PlanCatalog, plan_catalog
+
+def loaded_catalog():
+    catalog = PlanCatalog()
+    db = SessionLocal()
+    try:
+        catalog.load(db)
+    finally:
+        db.close()
+    return catalog
+
+def test_etag_is_the_same_across_workers_and_reloads(client):
+    worker_a, worker_b = loaded_catalog(), loaded_catalog()
+    assert worker_a.etag == worker_b.etag
+
+    etag, version = worker_a.etag, worker_a.version
+    db = SessionLocal()
+    try:
+        worker_a.load(db) # Periodic refresh, nothing changed
+    finally:
+        db.close()
+    assert (worker_a.etag, worker_a.version) == (etag, version)
+
+def test_if_none_match_after_reload(client):
+    etag = client.get("/plans/").headers["ETag"]
+    db = SessionLocal()
+    try:
+        plan_catalog.load(db)
+    finally:
+        db.close()
+    response = client.get("/plans/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+def test_new_plan_changes_etag(client):
+    catalog = loaded_catalog()
+    etag, version = catalog.etag, catalog.version
+    plan = catalog.all()[0]
+    catalog.add(type(plan)(id=10_000, name="Catalog test", price=1.0, features=None, duration_days=1))
+    assert catalog.etag != etag
+    assert catalog.version == version + 1
@@ -0,0 +1,64 @@
+# tests/test_provisioning.py
+"""
+`POST /admin/users/bulk`: NDJSON read from the request stream (lines split across chunks),
+per-line results in input order, and duplicates decided by the database.
+"""
+import json
+
+import pytest
+
+from app import auth, crud
+from app.database import SessionLocal
+
+@pytest.fixture
+def admin_headers(client, monkeypatch):
+    user = {"username": "provisioning-admin", "email": "provisioning.admin@example.com", "password": "password123"}
+    client.post("/users/", json=user)
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", {user["username"]})
+    token = client.post("/token", data={"username": user["username"], "password": user["password"]}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def test_bulk_upload_is_streamed_and_checked(client, admin_headers):
+    hashed_password = auth.get_password_hash("password123")
+    client.post("/users/", json={"username": "bulkexisting", "email": "bulk.existing@example.com", "password": "password123"})
+    lines = [
+        {"username": "bulkuser1", "email": "bulk.user1@example.com", "password": "password123"},
+        {"username": "bulkuser2", "email": "bulk.user2@example.com", "hashed_password": hashed_password},
+        {"username": "bulkuser3", "email": "bulk.existing@example.com", "hashed_password": hashed_password},
+        {"username": "bulkexisting", "email": "bulk.user4@example.com", "hashed_password": hashed_password},
+        {"username": "bulkuser5", "email": "bulk.user2@example.com", "hashed_password": hashed_password},
+        {"username": "bulkuser6", "email": "not-an-email", "hashed_password": hashed_password},
+    ]
+    body = ("\n".join(json.dumps(line) for line in lines[:3]) + "\n\n" + "\r\n".join(json.dumps(line) for line in lines[3:])).encode()
+
+    def chunks(size=37): # Chunk boundaries fall inside lines
+        for start in range(0, len(body), size):
+            yield body[start:start + size]
+
+    response = client.post("/admin/users/bulk", content=chunks(), headers={**admin_headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [(result["line"], result["status"], result.get("detail")) for result in results] == [
+        (1, "created", None),
+        (2, "created", None),
+        (3, "error", "Email already registered"),
+        (5, "error", "Username already registered"), # Line 4 is blank
+        (6, "error", "Email repeated in this upload"),
+        (7, "error", results[5]["detail"]),
+    ]
+    assert "email" in results[5]["detail"]
+    token = client.post("/token", data={"username": "bulkuser1", "password": "password123"})
+    assert token.status_code == 200 # Hashed on the provisioning pool
+
+def test_registered_positions_are_compared_by_the_database(client):
+    client.post("/users/", json={"username": "positions", "email": "positions@example.com", "password": "password123"})
+    db = SessionLocal()
+    try:
+        taken_usernames, taken_emails = crud.get_registered_positions(
+            db, ["free-1", "positions", "Positions"], ["positions@example.com", "free@example.com", "other@example.com"]
+        )
+    finally:
+        db.close()
+    # SQLite compares case-sensitively, like its unique index; MySQL's default collation
+    # would also report "Positions" (position 2) as taken.
+    assert (taken_usernames, taken_emails) == ({1}, {0})
@@ -0,0 +1,112 @@
+# tests/test_serialization.py
+"""
+The FAST_SERIALIZATION path must produce the same bytes as FastAPI's standard
+`response_model` path (validation, `jsonable_encoder`, `JSONResponse`), or fall back to it.
+Each case is served both ways by a small app and the response bodies are compared.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import schemas, serialization
+from app.models import SubscriptionStatusEnum
+from app.serialization import fast_json_response, page_to_dict, plan_to_dict, subscription_to_dict
+
+def make_plan(**overrides):
+    values = dict(id=1, name="Basic", price=9.99, features="Access to basic features, monthly", duration_days=30)
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+def make_subscription(plan=None, **overrides):
+    plan = plan or make_plan()
+    values = dict(
+        id=7, user_id=3, plan_id=plan.id, start_date=date(2024, 5, 29), end_date=date(2024, 6, 28),
+        status=SubscriptionStatusEnum.ACTIVE, plan=plan
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+PLANS = {
+    "float price": make_plan(),
+    "no features": make_plan(features=None),
+    "free": make_plan(price=0.0),
+    "int price": make_plan(price=10),
+    "decimal price": make_plan(price=Decimal("19.99")),
+    "long decimal price": make_plan(price=Decimal("199.990000")),
+    "small price": make_plan(price=0.0001),
+    "tiny price": make_plan(price=1e-5), # Exponent notation in json.dumps: falls back
+    "huge price": make_plan(price=1e16), # Idem
+    "unicode features": make_plan(name="Prämie – ✨", features="Zugriff auf alle Funktionen, \"Support\" 24/7 😀\n"),
+}
+
+SUBSCRIPTIONS = {
+    "active": make_subscription(),
+    "status as string": make_subscription(status="CANCELLED"),
+    "expired with nested decimal plan": make_subscription(status=SubscriptionStatusEnum.EXPIRED, plan=make_plan(id=4, price=Decimal("199.99"), features=None)),
+    "datetime in date field": make_subscription(end_date=datetime(2024, 6, 28, 0, 0)), # pydantic converts: falls back
+}
+
+def bodies(response_model, value, build):
+    """Response bodies of the standard and the fast path for the same value."""
+    app = FastAPI()
+
+    @app.get("/standard", response_model=response_model)
+    def standard():
+        return value
+
+    @app.get("/fast", response_model=response_model)
+    def fast():
+        return fast_json_response(build) or value
+
+    client = TestClient(app)
+    standard_response, fast_response = client.get("/standard"), client.get("/fast")
+    assert standard_response.status_code == fast_response.status_code == 200
+    return standard_response.content, fast_response.content
+
+@pytest.fixture(autouse=True)
+def fast_serialization(monkeypatch):
+    monkeypatch.setattr(serialization, "FAST_SERIALIZATION", True)
+
+@pytest.mark.parametrize("case", PLANS)
+def test_plan(case):
+    plan = PLANS[case]
+    standard, fast = bodies(schemas.Plan, plan, lambda: plan_to_dict(plan))
+    assert fast == standard
+
+def test_plan_list():
+    plans = list(PLANS.values())
+    standard, fast = bodies(List[schemas.Plan], plans, lambda: [plan_to_dict(plan) for plan in plans])
+    assert fast == standard
+
+@pytest.mark.parametrize("case", SUBSCRIPTIONS)
+def test_subscription(case):
+    subscription = SUBSCRIPTIONS[case]
+    standard, fast = bodies(schemas.Subscription, subscription, lambda: subscription_to_dict(subscription))
+    assert fast == standard
+
+@pytest.mark.parametrize("next_cursor", [None, "aWQ6NA"])
+def test_pages(next_cursor):
+    plans = [PLANS["float price"], PLANS["no features"], PLANS["decimal price"]]
+    page = SimpleNamespace(items=plans, next_cursor=next_cursor)
+    standard, fast = bodies(schemas.PlanPage, page, lambda: page_to_dict(plan_to_dict, plans, next_cursor))
+    assert fast == standard
+
+    subscriptions = [SUBSCRIPTIONS["active"], SUBSCRIPTIONS["expired with nested decimal plan"]]
+    page = SimpleNamespace(items=subscriptions, next_cursor=next_cursor)
+    standard, fast = bodies(schemas.SubscriptionPage, page, lambda: page_to_dict(subscription_to_dict, subscriptions, next_cursor))
+    assert fast == standard
+
+def test_empty_page():
+    page = SimpleNamespace(items=[], next_cursor=None)
+    standard, fast = bodies(schemas.SubscriptionPage, page, lambda: page_to_dict(subscription_to_dict, [], None))
+    assert fast == standard
+
+def test_unsupported_values_fall_back():
+    assert fast_json_response(lambda: plan_to_dict(PLANS["tiny price"])) is None
+    assert fast_json_response(lambda: subscription_to_dict(SUBSCRIPTIONS["datetime in date field"])) is None
+    assert fast_json_response(lambda: plan_to_dict(PLANS["float price"])) is not None
@@ -0,0 +1,54 @@
+# tests/test_statement_counts.py
+"""
+SQL statements per request, from the `X-DB-Statements` header (EXPOSE_DB_STATEMENT_COUNT).
+These are the per-endpoint budgets documented in section 10.3; a change that adds a
+statement to one of these paths has to update the expected count here.
+"""
+
+def statements(response) -> int:
+    return int(response.headers["x-db-statements"])
+
+def test_user_endpoints(client):
+    response = client.post("/users/", json={"username": "counted", "email": "counted@example.com", "password": "password123"})
+    assert response.status_code == 201
+    assert statements(response) == 1 # INSERT ... RETURNING
+
+    response = client.post("/token", data={"username": "counted", "password": "password123"})
+    assert response.status_code == 200
+    assert statements(response) == 1 # User lookup
+
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert statements(client.get("/users/me/", headers=headers)) == 1 # User lookup, then cached
+    assert statements(client.get("/users/me/", headers=headers)) == 0
+
+def test_subscription_endpoints(client, auth_headers):
+    client.get("/users/me/", headers=auth_headers) # Fill the user cache, so only subscription SQL is counted
+
+    # Writes: the subscription write, the plan-change record or per-plan counter upsert,
+    # the daily counter upsert and the outbox event, in one transaction.
+    response = client.post("/subscriptions/", json={"plan_id": 2}, headers=auth_headers)
+    assert response.status_code == 201
+    assert statements(response) == 4
+
+    response = client.post("/subscriptions/", json={"plan_id": 2}, headers=auth_headers)
+    assert response.status_code == 409
+    assert statements(response) == 2 # The rejected INSERT and the lookup of the existing subscription
+
+    response = client.get("/subscriptions/me/", headers=auth_headers)
+    assert response.status_code == 200
+    assert statements(response) == 1
+
+    response = client.put("/subscriptions/me/", json={"new_plan_id": 3}, headers=auth_headers)
+    assert response.status_code == 200
+    assert statements(response) == 4
+
+    response = client.delete("/subscriptions/me/", headers=auth_headers)
+    assert response.status_code == 204
+    assert statements(response) == 4
+
+    response = client.get("/subscriptions/me/history/", headers=auth_headers)
+    assert response.status_code == 200
+    assert statements(response) == 1
+
+def test_plan_list_is_served_from_the_catalog(client):
+    assert statements(client.get("/plans/")) == 0
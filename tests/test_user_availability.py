@@ -0,0 +1,32 @@
+# tests/test_user_availability.py
+"""
+`GET /users/availability` and registration report a value as taken exactly when the
+database compares it equal to a registered one (`async_crud.get_registered_fields`).
+"""
+import asyncio
+
+from app import async_crud
+from app.database import AsyncSessionLocal
+
+def test_availability(client):
+    client.post("/users/", json={"username": "availability1", "email": "availability1@example.com", "password": "password123"})
+    response = client.get("/users/availability", params={"username": "availability1", "email": "availability1@example.com"})
+    assert response.json() == {"username_available": False, "email_available": False}
+    response = client.get("/users/availability", params={"username": "availability2"})
+    assert response.json() == {"username_available": True, "email_available": None}
+
+def test_registered_fields_follow_the_database_comparison(client):
+    client.post("/users/", json={"username": "CaseUser", "email": "case.user@example.com", "password": "password123"})
+
+    async def registered(username, email):
+        async with AsyncSessionLocal() as db:
+            return await async_crud.get_registered_fields(db, username=username, email=email)
+
+    assert asyncio.run(registered("CaseUser", None)) == (True, False)
+    assert asyncio.run(registered(None, "case.user@example.com")) == (False, True)
+    assert asyncio.run(registered("someone-else", "case.user@example.com")) == (False, True)
+    # SQLite compares case-sensitively, so "caseuser" is a different (available) username;
+    # a case-insensitive MySQL collation would report it as registered, matching its unique index.
+    assert asyncio.run(registered("caseuser", None)) == (False, False)
+    response = client.get("/users/availability", params={"username": "caseuser"})
+    assert response.json()["username_available"] is True